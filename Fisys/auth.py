@@ -2,19 +2,21 @@ COOKIE_MAX_AGE = 60 * 60 * 24 * 7  # 7 Tage
 from fastapi import APIRouter, Form, HTTPException, Depends
 from fastapi.responses import RedirectResponse, HTMLResponse
 from sqlalchemy.orm import Session
-from passlib.hash import bcrypt_sha256 as bcrypt
-from db import get_db
+from db import async_write_lane, get_db
 from models import User, AuthToken
+from password_hashing import HashingBusy, client_address, ip_throttle, login_throttle, password_hasher, throttle_key
+from presence import presence_tracker
+from user_cache import Principal, principal_cache
 import os
 import secrets
 import string
 from fastapi import Request
 from fastapi import HTTPException
+from typing import Optional
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from dotenv import load_dotenv
 from itsdangerous import URLSafeSerializer
-from datetime import datetime, timezone
 
 load_dotenv()
 
@@ -26,25 +28,102 @@ serializer = URLSafeSerializer(SECRET_KEY)
 router = APIRouter()
 
 
+# ----------------------------
+# Eingeloggter Benutzer (Principal): Cookie wird einmal je Request aufgelöst und in
+# request.state gemerkt, der Benutzer kommt aus dem kurzlebigen principal_cache (user_cache.py).
+# Routen hängen sich per Depends(current_principal) bzw. Depends(require_role(...)) daran.
+# ----------------------------
+
+def session_username(request: Request) -> Optional[str]:
+    raw_cookie = request.cookies.get("benutzer")
+    if not raw_cookie:
+        return None
+    try:
+        data = serializer.loads(raw_cookie, max_age=COOKIE_MAX_AGE)
+    except Exception:
+        return None
+    return data.get("username") if isinstance(data, dict) else None
+
+
+def resolve_principal(request: Request, db: Session) -> Principal:
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+    username = session_username(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
+    principal = principal_cache.get(db, username)
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Benutzer nicht gefunden")
+    presence_tracker.touch(principal)
+    request.state.principal = principal
+    return principal
+
+
+def current_principal(request: Request, db: Session = Depends(get_db)) -> Principal:
+    return resolve_principal(request, db)
+
+
+def require_role(*roles: str):
+    allowed = set(roles)
+
+    def _dependency(principal: Principal = Depends(current_principal)) -> Principal:
+        if principal.rolle not in allowed:
+            raise HTTPException(status_code=403, detail="Keine Berechtigung")
+        return principal
+
+    return _dependency
+
+
+require_admin_or_mod = require_role("admin", "mod")
+
+
+def _throttled(client_ip: Optional[str], attempt) -> bool:
+    # Zuerst die IP (alle Benutzernamen), dann Benutzername+IP
+    return ip_throttle.blocked(client_ip) or login_throttle.blocked(attempt)
+
+
+def _failed(client_ip: Optional[str], attempt) -> None:
+    ip_throttle.failure(client_ip)
+    login_throttle.failure(attempt)
+
+
 @router.get("/login", response_class=HTMLResponse)
 async def get_login_page():
     return RedirectResponse(url="/login.html")
 
 @router.post("/login")
 async def login(
+    request: Request,
     benutzername: str = Form(...),
     passwort: str = Form(...),
     db: Session = Depends(get_db)
 ):
+    client_ip = client_address(request)
+    attempt = throttle_key(benutzername, client_ip)
+    if _throttled(client_ip, attempt):
+        return RedirectResponse("/login?error=too_many_attempts", status_code=303)
+
     user = db.query(User).filter(User.username == benutzername).first()
     if not user:
+        _failed(client_ip, attempt)
         return RedirectResponse("/login?error=user_not_found", status_code=303)
 
-    if not bcrypt.verify(passwort, user.password_hash):
+    try:
+        valid, new_hash = await password_hasher.verify(passwort, user.password_hash)
+    except HashingBusy:
+        return RedirectResponse("/login?error=busy", status_code=303)
+    if not valid:
+        _failed(client_ip, attempt)
         return RedirectResponse("/login?error=wrong_password", status_code=303)
 
-    user.last_seen = datetime.now(timezone.utc)
-    db.commit()
+    login_throttle.reset(attempt)
+    if new_hash:
+        # Hash-Kosten wurden geändert: mit aktuellem Verfahren neu speichern
+        user.password_hash = new_hash
+        async with async_write_lane(db):
+            db.commit()
+    presence_tracker.touch(user, force=True)
 
     response = RedirectResponse(url="/", status_code=303)
     cookie_wert = serializer.dumps({"username": benutzername})
@@ -64,27 +143,38 @@ async def get_register_page():
 
 @router.post("/register")
 async def register(
+    request: Request,
     token: str = Form(...),
     benutzername: str = Form(...),
     passwort: str = Form(...),
     db: Session = Depends(get_db)
 ):
+    client_ip = client_address(request)
+    attempt = throttle_key(benutzername, client_ip)
+    if _throttled(client_ip, attempt):
+        return RedirectResponse("/register?error=too_many_attempts", status_code=303)
+
     token = token.replace("-", "").upper()
     token_obj = db.query(AuthToken).filter(AuthToken.token == token, AuthToken.verwendet == False).first()
     if not token_obj:
+        _failed(client_ip, attempt)
         return RedirectResponse("/register?error=invalid_token", status_code=303)
 
     if db.query(User).filter(User.username == benutzername).first():
         return RedirectResponse("/register?error=user_exists", status_code=303)
 
-    password_hash = bcrypt.hash(passwort)
+    try:
+        password_hash = await password_hasher.hash(passwort)
+    except HashingBusy:
+        return RedirectResponse("/register?error=busy", status_code=303)
     neuer_nutzer = User(username=benutzername, password_hash=password_hash, rolle=token_obj.rolle)
     db.add(neuer_nutzer)
 
     # Token als benutzt markieren
     token_obj.verwendet = True
     db.add(token_obj)
-    db.commit()
+    async with async_write_lane(db):
+        db.commit()
 
     # Nach erfolgreicher Registrierung auf Login leiten (mit Erfolgshinweis)
     return RedirectResponse("/login?error=registered_success", status_code=303)
@@ -101,37 +191,19 @@ from fastapi.responses import JSONResponse
 
 @router.get("/api/userinfo")
 async def get_userinfo(request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie, max_age=COOKIE_MAX_AGE)["username"] if raw_cookie else None
-    except:
-        benutzer = None
+    benutzer = session_username(request)
     if not benutzer:
         return JSONResponse(status_code=401, content={"detail": "Nicht eingeloggt"})
 
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user:
+    try:
+        user = resolve_principal(request, db)
+    except HTTPException:
         return JSONResponse(status_code=404, content={"detail": "Benutzer nicht gefunden"})
 
-    user.last_seen = datetime.now(timezone.utc)
-    db.commit()
-
     return {"username": user.username, "rolle": user.rolle, "discord_id": user.discord_id}
 
 @router.post("/admin/create-token")
-async def create_token(request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def create_token(request: Request, db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     neuer_token = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
     data = await request.json()
     rolle = data.get("rolle", "user")
@@ -139,62 +211,28 @@ async def create_token(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Ungültige Rolle")
     token_obj = AuthToken(token=neuer_token, verwendet=False, rolle=rolle)
     db.add(token_obj)
-    db.commit()
+    async with async_write_lane(db):
+        db.commit()
     return {"token": neuer_token}
 
 @router.get("/admin/tokens")
-async def list_tokens(request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def list_tokens(db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     tokens = db.query(AuthToken).all()
     return [{"token": t.token, "verwendet": t.verwendet, "rolle": t.rolle} for t in tokens]
 
 @router.delete("/admin/token/{token_str}")
-async def delete_token(token_str: str, request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def delete_token(token_str: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     token_obj = db.query(AuthToken).filter(AuthToken.token == token_str).first()
     if not token_obj:
         raise HTTPException(status_code=404, detail="Token nicht gefunden")
 
     db.delete(token_obj)
-    db.commit()
+    async with async_write_lane(db):
+        db.commit()
     return {"detail": "Token gelöscht"}
 
 @router.patch("/admin/user/{username}/rolle")
-async def update_user_role(username: str, request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def update_user_role(username: str, request: Request, db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     daten = await request.json()
     neue_rolle = daten.get("rolle")
     if neue_rolle not in ["user", "helper", "mod", "admin"]:
@@ -205,52 +243,31 @@ async def update_user_role(username: str, request: Request, db: Session = Depend
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
 
     ziel_user.rolle = neue_rolle
-    db.commit()
+    async with async_write_lane(db):
+        db.commit()
     return {"detail": "Rolle aktualisiert"}
 
 @router.delete("/admin/user/{username}")
-async def delete_user(username: str, request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def delete_user(username: str, db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     ziel_user = db.query(User).filter(User.username == username).first()
     if not ziel_user:
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
 
     db.delete(ziel_user)
-    db.commit()
+    async with async_write_lane(db):
+        db.commit()
+    presence_tracker.forget(ziel_user.id)
     return {"detail": "Benutzer gelöscht"}
 
 @router.get("/admin/users")
-async def list_users(request: Request, db: Session = Depends(get_db)):
-    raw_cookie = request.cookies.get("benutzer")
-    try:
-        benutzer = serializer.loads(raw_cookie)["username"] if raw_cookie else None
-    except:
-        benutzer = None
-    if not benutzer:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == benutzer).first()
-    if not user or user.rolle not in ["admin", "mod"]:
-        raise HTTPException(status_code=403, detail="Keine Berechtigung")
-
+async def list_users(db: Session = Depends(get_db), _: Principal = Depends(require_admin_or_mod)):
     users = db.query(User).all()
     return [
         {
             "username": u.username,
             "rolle": u.rolle,
             "created_at": u.created_at.isoformat() if u.created_at else None,
-            "last_seen": u.last_seen.isoformat() if u.last_seen else None,
+            "last_seen": last_seen.isoformat() if (last_seen := presence_tracker.last_seen(u)) else None,
         }
         for u in users
     ]
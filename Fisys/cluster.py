@@ -0,0 +1,408 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+import queue
+import select
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from sqlalchemy.engine import make_url
+
+# ----------------------------
+# Mehrere uvicorn-Worker: gemeinsamer Pub/Sub-Kanal + Leader-Wahl.
+# Nur der Leader hält die Drucker-Verbindungen; alle Worker bedienen HTTP/WebSockets
+# und bekommen Drucker-Snapshots und Dashboard-Events über den Kanal.
+#
+# Backends:
+#   - "local":    Worker auf demselben Host (SQLite): flock auf eine Lock-Datei für die Leader-Wahl,
+#                 Unix-Datagram-Sockets im Cluster-Verzeichnis für Nachrichten
+#   - "postgres": LISTEN/NOTIFY für Nachrichten, pg_try_advisory_lock für die Leader-Wahl
+# CLUSTER_BACKEND=auto wählt Postgres, sobald DATABASE_URL auf Postgres zeigt.
+# Das Cluster-Verzeichnis (CLUSTER_LOCAL_DIR) liegt standardmäßig neben der SQLite-Datei.
+#
+# Zustellung ist nicht garantiert (voller Datagram-Puffer, volle Publisher-Queue, NOTIFYs während
+# eines Reconnects). Jede Nachricht trägt deshalb eine fortlaufende Nummer je Absender; dazu sendet
+# jeder Worker alle CLUSTER_HEARTBEAT_SECONDS seinen aktuellen Stand. Fehlt beim Empfänger eine
+# Nummer, meldet das Backend eine Lücke (on_gap) – der Worker verwirft dann alle Caches, die sonst
+# nur per Nachricht invalidiert werden. Dasselbe passiert nach jedem (Re-)Connect.
+# ----------------------------
+
+CLUSTER_BACKEND = os.getenv("CLUSTER_BACKEND", "auto").strip().lower()
+CLUSTER_CHANNEL = os.getenv("CLUSTER_CHANNEL", "fisys_cluster")
+LEADER_LOCK_KEY = int(os.getenv("CLUSTER_LEADER_LOCK_KEY", "471101"))
+LEADER_RETRY_SECONDS = float(os.getenv("CLUSTER_LEADER_RETRY_SECONDS", "10"))
+CLUSTER_LOCAL_DIR = os.getenv("CLUSTER_LOCAL_DIR", "").strip()
+HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "5"))
+
+# Eindeutige ID dieses Worker-Prozesses (eigene Nachrichten werden beim Empfang ignoriert)
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# NOTIFY-Payloads sind in Postgres auf knapp 8000 Bytes begrenzt
+_MAX_PAYLOAD_BYTES = 7900
+# Unix-Datagramme: Linux erlaubt standardmäßig gut 200 KB
+_MAX_DATAGRAM_BYTES = 65536
+
+MessageHandler = Callable[[dict[str, Any]], None]
+LeadershipHandler = Callable[[bool], None]
+ConnectedHandler = Callable[[], None]
+GapHandler = Callable[[], None]
+
+
+class _Backend:
+    name = "base"
+
+    def __init__(self):
+        self.worker_id = WORKER_ID
+        self.is_leader = False
+        self._running = False
+        self._on_message: Optional[MessageHandler] = None
+        self._on_leadership: Optional[LeadershipHandler] = None
+        self._on_connected: Optional[ConnectedHandler] = None
+        self._on_gap: Optional[GapHandler] = None
+        self._threads: list[threading.Thread] = []
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        # Absender -> höchste gesehene Nummer
+        self._peer_seq: dict[str, int] = {}
+        self._next_heartbeat = 0.0
+        self.dropped = 0
+        self.gaps = 0
+
+    def _set_leader(self, value: bool) -> None:
+        if self.is_leader == value:
+            return
+        self.is_leader = value
+        print(f"[Cluster] Worker {self.worker_id} ist {'jetzt Leader' if value else 'kein Leader mehr'}")
+        if self._on_leadership:
+            try:
+                self._on_leadership(value)
+            except Exception as exc:
+                print(f"[Cluster] Leader-Wechsel fehlgeschlagen: {exc}")
+
+    def _send(self, message: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def publish(self, message: dict[str, Any]) -> None:
+        # Unter dem Lock senden: Nummern verlassen den Worker in aufsteigender Reihenfolge
+        with self._seq_lock:
+            self._seq += 1
+            self._send({**message, "origin": self.worker_id, "seq": self._seq})
+
+    def _send_heartbeat(self) -> None:
+        now = time.monotonic()
+        if now < self._next_heartbeat:
+            return
+        self._next_heartbeat = now + HEARTBEAT_SECONDS
+        with self._seq_lock:
+            # Ohne eigene Nummer: zeigt nur den Stand, damit Empfänger verlorene Nachrichten bemerken
+            self._send({"kind": "heartbeat", "origin": self.worker_id, "seq": self._seq})
+
+    def _report_gap(self) -> None:
+        self.gaps += 1
+        if self._on_gap:
+            try:
+                self._on_gap()
+            except Exception as exc:
+                print(f"[Cluster] Resync nach verlorenen Nachrichten fehlgeschlagen: {exc}")
+
+    def _check_sequence(self, message: dict[str, Any]) -> None:
+        origin, seq = message.get("origin"), message.get("seq")
+        if not isinstance(origin, str) or not isinstance(seq, int):
+            return
+        heartbeat = message.get("kind") == "heartbeat"
+        previous = self._peer_seq.get(origin, 0)
+        expected = previous if heartbeat else previous + 1
+        if seq > expected:
+            self._report_gap()
+        if seq > previous:
+            self._peer_seq[origin] = seq
+
+    def _dispatch(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except Exception:
+            return
+        if not isinstance(message, dict) or message.get("origin") == self.worker_id:
+            return
+        self._check_sequence(message)
+        if message.get("kind") == "heartbeat":
+            return
+        try:
+            if self._on_message:
+                self._on_message(message)
+        except Exception as exc:
+            print(f"[Cluster] Verarbeitung fehlgeschlagen: {exc}")
+
+
+def _local_cluster_dir(database_url: str) -> str:
+    if CLUSTER_LOCAL_DIR:
+        return CLUSTER_LOCAL_DIR
+    try:
+        url = make_url(database_url)
+    except Exception:
+        url = None
+    if url is not None and url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        return os.path.join(os.path.dirname(os.path.abspath(url.database)), ".fisys-cluster")
+    # Kein Dateipfad: je Datenbank-URL ein eigenes Verzeichnis, damit sich Installationen nicht mischen
+    digest = hashlib.sha1(database_url.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"fisys-cluster-{digest}")
+
+
+class LocalBackend(_Backend):
+    """Worker auf einem Host: flock-Leader-Wahl, Nachrichten per Unix-Datagram-Socket je Worker.
+
+    Der Lock hängt am offenen Dateideskriptor – stirbt der Leader, gibt das Betriebssystem ihn frei
+    und ein anderer Worker übernimmt beim nächsten Versuch. Ohne fcntl (Windows) ist der
+    einzige Worker immer Leader.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self._lock_file = None
+        self._socket: Optional[socket.socket] = None
+        self._socket_path = os.path.join(directory, f"worker-{self.worker_id}.sock")
+
+    def start(
+        self,
+        on_message: MessageHandler,
+        on_leadership: LeadershipHandler,
+        on_connected: Optional[ConnectedHandler] = None,
+        on_gap: Optional[GapHandler] = None,
+    ) -> None:
+        self._on_message = on_message
+        self._on_leadership = on_leadership
+        self._on_connected = on_connected
+        self._on_gap = on_gap
+        self._running = True
+        try:
+            import fcntl  # noqa: F401
+
+            os.makedirs(self.directory, exist_ok=True)
+        except (ImportError, OSError) as exc:
+            print(f"[Cluster] Lokale Leader-Wahl nicht verfügbar ({exc}) – Einzel-Worker-Betrieb")
+            self._set_leader(True)
+            return
+        try:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(self._socket_path)
+            self._socket.settimeout(1.0)
+        except (AttributeError, OSError) as exc:
+            # z. B. Pfad zu lang für AF_UNIX: Leader-Wahl bleibt, nur ohne Nachrichten zwischen Workern
+            print(f"[Cluster] Lokaler Kanal nicht verfügbar ({exc}) – CLUSTER_LOCAL_DIR prüfen")
+            if self._socket is not None:
+                self._socket.close()
+            self._socket = None
+        # Erster Versuch synchron: ein einzelner Worker startet die Drucker sofort
+        self._try_lead()
+        thread = threading.Thread(target=self._listen_loop, name="ClusterListener", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        if self._socket is not None and self._on_connected:
+            self._on_connected()
+
+    def _try_lead(self) -> None:
+        import fcntl
+
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(self.directory, "leader.lock"), "a+")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        self._set_leader(True)
+
+    def _listen_loop(self) -> None:
+        next_attempt = time.monotonic() + LEADER_RETRY_SECONDS
+        while self._running:
+            if not self.is_leader and time.monotonic() >= next_attempt:
+                self._try_lead()
+                next_attempt = time.monotonic() + LEADER_RETRY_SECONDS
+            receiver = self._socket
+            if receiver is None:
+                time.sleep(1)
+                continue
+            self._send_heartbeat()
+            try:
+                data = receiver.recv(_MAX_DATAGRAM_BYTES)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._running:
+                    time.sleep(1)
+                continue
+            self._dispatch(data.decode("utf-8", errors="replace"))
+
+    def _send(self, message: dict[str, Any]) -> None:
+        if self._socket is None:
+            # Kein Kanal: lokale Zustellung erledigt der Aufrufer selbst
+            return
+        payload = json.dumps(message, separators=(",", ":"), default=str).encode("utf-8")
+        if len(payload) > _MAX_DATAGRAM_BYTES:
+            self.dropped += 1
+            return
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(False)
+        try:
+            for path in glob.glob(os.path.join(self.directory, "worker-*.sock")):
+                if path == self._socket_path:
+                    continue
+                try:
+                    sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Worker ist weg: verwaisten Socket aufräumen
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except (BlockingIOError, OSError):
+                    # Empfänger-Puffer voll: lieber verwerfen als den Aufrufer blockieren;
+                    # der Empfänger bemerkt die Lücke an der nächsten Nummer bzw. am Heartbeat
+                    self.dropped += 1
+        finally:
+            sender.close()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            try:
+                os.unlink(self._socket_path)
+            except OSError:
+                pass
+            self._socket = None
+        if self._lock_file is not None:
+            # Schließen gibt den flock frei
+            self._lock_file.close()
+            self._lock_file = None
+        self._set_leader(False)
+
+
+class PostgresBackend(_Backend):
+    """LISTEN/NOTIFY + Advisory-Lock. Ein Listener- und ein Publisher-Thread je Worker."""
+
+    name = "postgres"
+
+    def __init__(self, database_url: str):
+        super().__init__()
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._outbox: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=1000)
+
+    def start(
+        self,
+        on_message: MessageHandler,
+        on_leadership: LeadershipHandler,
+        on_connected: Optional[ConnectedHandler] = None,
+        on_gap: Optional[GapHandler] = None,
+    ) -> None:
+        self._on_message = on_message
+        self._on_leadership = on_leadership
+        self._on_connected = on_connected
+        self._on_gap = on_gap
+        self._running = True
+        for target, name in ((self._listen_loop, "ClusterListener"), (self._publish_loop, "ClusterPublisher")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _send(self, message: dict[str, Any]) -> None:
+        payload = json.dumps(message, separators=(",", ":"), default=str)
+        if len(payload.encode("utf-8")) > _MAX_PAYLOAD_BYTES:
+            self.dropped += 1
+            print(f"[Cluster] Nachricht zu groß für NOTIFY ({len(payload)} Bytes) – verworfen")
+            return
+        try:
+            self._outbox.put_nowait(payload)
+        except queue.Full:
+            # Die Nummer ist vergeben: Empfänger bemerken die Lücke und synchronisieren neu
+            self.dropped += 1
+
+    def stop(self) -> None:
+        self._running = False
+        try:
+            self._outbox.put_nowait(None)
+        except queue.Full:
+            pass
+        self._set_leader(False)
+
+    def _connect(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def _listen_loop(self) -> None:
+        while self._running:
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CLUSTER_CHANNEL}")
+                if self._on_connected:
+                    self._on_connected()
+                next_attempt = 0.0
+                while self._running:
+                    if not self.is_leader and time.monotonic() >= next_attempt:
+                        # Der Lock hängt an dieser Verbindung: stirbt der Leader, wird er frei
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,))
+                            acquired = bool(cur.fetchone()[0])
+                        if acquired:
+                            self._set_leader(True)
+                        next_attempt = time.monotonic() + LEADER_RETRY_SECONDS
+                    self._send_heartbeat()
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as exc:
+                print(f"[Cluster] Listener-Fehler: {exc}")
+                self._set_leader(False)
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _publish_loop(self) -> None:
+        conn = None
+        while self._running:
+            payload = self._outbox.get()
+            if payload is None:
+                break
+            for _ in range(2):
+                try:
+                    if conn is None or conn.closed:
+                        conn = self._connect()
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT pg_notify(%s, %s)", (CLUSTER_CHANNEL, payload))
+                    break
+                except Exception as exc:
+                    print(f"[Cluster] NOTIFY fehlgeschlagen: {exc}")
+                    conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def create_backend(database_url: str, backend: str = CLUSTER_BACKEND):
+    if backend == "postgres" or (backend == "auto" and database_url.startswith("postgres")):
+        return PostgresBackend(database_url)
+    return LocalBackend(_local_cluster_dir(database_url))
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Optional
+
+from fastapi import WebSocket
+
+# ----------------------------
+# Broadcast an /ws/dashboard: jeder Client hat eine eigene, begrenzte Queue + Writer-Task.
+# Ein langsamer Client bremst so niemanden aus; Drucker-Snapshots werden je Serial
+# zusammengefasst (nur der neueste zählt), tote Verbindungen werden entfernt.
+# Events (spule_*, Notizen, ...) lassen sich nicht zusammenfassen: läuft die Queue trotzdem über,
+# wird der Client mit 1013 getrennt und lädt nach dem Reconnect neu, statt still Events zu verlieren.
+#
+# Topics: Ohne Abo bekommt ein Client alles. Mit
+#   {"action": "subscribe", "topics": ["printer:SERIAL", "spule:12", "typ:3", "event:spule_deleted"]}
+# nur noch passende Nachrichten. "printer", "spule", ... (bzw. "printer:*") abonnieren eine ganze Klasse.
+# "unsubscribe" entfernt Topics, "subscribe" mit "topics": null schaltet den Filter wieder ab.
+# ----------------------------
+
+MAX_PENDING = int(os.getenv("DASHBOARD_WS_MAX_PENDING", "100"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("DASHBOARD_WS_SEND_TIMEOUT", "5"))
+# "Try Again Later": Client soll sich neu verbinden und seinen Stand neu laden
+OVERFLOW_CLOSE_CODE = 1013
+
+_sequence = itertools.count()
+
+
+def _message_key(data: dict[str, Any]) -> Any:
+    # Drucker-Snapshots (ohne "event") ersetzen ältere, noch nicht gesendete Snapshots derselben Serial
+    serial = data.get("serial") or data.get("printer_serial")
+    if serial and not data.get("event"):
+        return ("printer", serial)
+    return ("event", next(_sequence))
+
+
+def _message_topics(data: dict[str, Any]) -> set[str]:
+    topics: set[str] = set()
+    event = data.get("event")
+    serial = data.get("serial") or data.get("printer_serial")
+    if not event:
+        if serial:
+            topics.update({"printer", f"printer:{serial}"})
+        return topics
+    event = str(event)
+    topics.update({f"event:{event}", event.split("_", 1)[0]})
+    if serial:
+        topics.add(f"printer:{serial}")
+    spule_id = data.get("spule_id") or data.get("spulen_id")
+    if spule_id is not None:
+        topics.add(f"spule:{spule_id}")
+    typ_id = data.get("typ_id")
+    if typ_id is not None:
+        topics.add(f"typ:{typ_id}")
+    return topics
+
+
+def _normalize_topic(topic: Any) -> Optional[str]:
+    value = str(topic or "").strip()
+    if not value:
+        return None
+    if value.endswith(":*"):
+        value = value[:-2]
+    return value
+
+
+class DashboardClient:
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.topics: Optional[set[str]] = None  # None = alles empfangen
+        self.pending: "OrderedDict[Any, str]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.overflowed = False
+
+    def wants(self, topics: set[str]) -> bool:
+        return self.topics is None or not self.topics.isdisjoint(topics)
+
+    def enqueue(self, key: Any, text: str, max_pending: int) -> None:
+        if self.overflowed:
+            return
+        if key not in self.pending and len(self.pending) >= max_pending:
+            # Client hängt hinterher: nichts verwerfen, sondern Verbindung neu aufbauen lassen
+            self.overflowed = True
+            self.pending.clear()
+        else:
+            self.pending[key] = text
+        self.wakeup.set()
+
+
+class DashboardBroadcaster:
+    """Fan-out mit einmaligem JSON-Encoding je Nachricht. Alle Methoden laufen im App-Event-Loop."""
+
+    def __init__(self, max_pending: int = MAX_PENDING, send_timeout: float = SEND_TIMEOUT_SECONDS):
+        self.max_pending = max(1, max_pending)
+        self.send_timeout = send_timeout
+        self.clients: dict[WebSocket, DashboardClient] = {}
+        self.overflow_disconnects = 0
+        self.send_failures = 0
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def add(self, ws: WebSocket) -> DashboardClient:
+        client = DashboardClient(ws)
+        self.clients[ws] = client
+        client.task = asyncio.get_running_loop().create_task(self._writer(client))
+        return client
+
+    async def remove(self, ws: WebSocket, close: bool = False) -> None:
+        client = self.clients.pop(ws, None)
+        if client is None:
+            return
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+        if close:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+
+    def publish(self, data: dict[str, Any]) -> None:
+        if not self.clients:
+            return
+        topics = _message_topics(data)
+        receivers = [client for client in self.clients.values() if client.wants(topics)]
+        if not receivers:
+            return
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+        key = _message_key(data)
+        for client in receivers:
+            client.enqueue(key, text, self.max_pending)
+
+    def handle_client_message(self, ws: WebSocket, raw: str) -> None:
+        """Verarbeitet subscribe/unsubscribe-Nachrichten eines Clients."""
+        client = self.clients.get(ws)
+        if client is None:
+            return
+        try:
+            message = json.loads(raw)
+        except Exception:
+            return
+        if not isinstance(message, dict):
+            return
+        action = message.get("action")
+        requested = message.get("topics")
+        if action not in ("subscribe", "unsubscribe"):
+            return
+        if action == "subscribe" and requested is None:
+            client.topics = None
+        else:
+            if isinstance(requested, str):
+                requested = [requested]
+            normalized = {t for t in (_normalize_topic(x) for x in (requested or [])) if t}
+            if action == "subscribe":
+                client.topics = (client.topics or set()) | normalized
+            elif client.topics is not None:
+                client.topics -= normalized
+        ack = {"event": "subscribed", "topics": sorted(client.topics) if client.topics is not None else None}
+        client.enqueue(("event", next(_sequence)), json.dumps(ack, separators=(",", ":")), self.max_pending)
+
+    async def close_all(self) -> None:
+        for ws in list(self.clients):
+            await self.remove(ws, close=True)
+
+    async def _writer(self, client: DashboardClient) -> None:
+        try:
+            while True:
+                await client.wakeup.wait()
+                client.wakeup.clear()
+                if client.overflowed:
+                    self.overflow_disconnects += 1
+                    self.clients.pop(client.ws, None)
+                    try:
+                        await asyncio.wait_for(client.ws.close(code=OVERFLOW_CLOSE_CODE), timeout=self.send_timeout)
+                    except Exception:
+                        pass
+                    return
+                while client.pending and not client.overflowed:
+                    _, text = client.pending.popitem(last=False)
+                    await asyncio.wait_for(client.ws.send_text(text), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Senden fehlgeschlagen oder Timeout: Verbindung gilt als tot
+            self.send_failures += 1
+            await self.remove(client.ws, close=True)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# ----------------------------
+# Vorberechneter Snapshot für /api/dashboard-details.
+# Die Antwort besteht aus Abschnitten (Bestand, Verbrauch, Historie, Jobs, Notizen), die jeweils
+# an bestimmten Tabellen hängen. Ein Commit, der eine dieser Tabellen verändert, markiert nur die
+# betroffenen Abschnitte als veraltet; beim nächsten Abruf werden genau diese neu gebaut, alles
+# andere kommt aus dem Speicher. Jeder Neuaufbau erhöht die Versionsnummer des Snapshots.
+#
+# Änderungen werden über Session-Events erkannt (after_flush sammelt die Tabellen, after_commit
+# invalidiert). Andere Worker erfahren davon über den Cluster-Kanal (siehe main.py).
+# Zeitabhängige Abschnitte (z. B. "letzte 7 Tage") und Änderungen außerhalb des ORM fängt ein
+# maximales Alter je Abschnitt ab.
+#
+# Abschnitte mit billigen Zählern (Anzahl Typen/Spulen, Verbrauch) können zusätzlich eine
+# delta-Funktion angeben: sie rechnet die im Commit eingefügten/gelöschten Zeilen direkt in den
+# gespeicherten Wert ein, statt den Abschnitt neu abzufragen. Liefert sie None (z. B. bei
+# Änderungen, die sich nicht verrechnen lassen), wird der Abschnitt wie gewohnt invalidiert.
+# Deltas gelten nur im eigenen Worker; andere Worker invalidieren und bauen neu.
+# Überschneidet sich ein Neuaufbau mit einem Commit (Start oder Ende zwischen erstem Flush und
+# after_commit), ist unklar, ob der Aufbau die Zeilen schon gesehen hat – dann wird invalidiert statt
+# verrechnet, sonst zählte das Delta sie doppelt.
+# Schlüssel mit führendem "_" bleiben intern und erscheinen nicht in der Antwort.
+# ----------------------------
+
+MAX_AGE_SECONDS = float(os.getenv("DASHBOARD_SNAPSHOT_MAX_AGE", "300"))
+
+_INFO_KEY = "dashboard_snapshot_changes"
+_EPOCH_KEY = "dashboard_snapshot_build_epoch"
+
+
+class TableChanges:
+    """Änderungen an einer Tabelle innerhalb eines Commits (alle Flushes zusammen)."""
+
+    __slots__ = ("inserted", "updated", "deleted")
+
+    def __init__(self):
+        # Spaltenwerte der eingefügten Zeilen zum Zeitpunkt des Flushs (Server-Defaults fehlen)
+        self.inserted: list[dict[str, Any]] = []
+        self.updated = 0
+        self.deleted = 0
+
+
+SectionBuilder = Callable[[Session], dict[str, Any]]
+SectionDelta = Callable[[dict[str, Any], dict[str, TableChanges]], Optional[dict[str, Any]]]
+ChangeHandler = Callable[[set[str]], None]
+
+
+class _Section:
+    __slots__ = ("name", "tables", "max_age", "builder", "delta", "value", "built_at")
+
+    def __init__(self, name: str, tables: set[str], max_age: float, builder: SectionBuilder, delta: Optional[SectionDelta]):
+        self.name = name
+        self.tables = tables
+        self.max_age = max_age
+        self.builder = builder
+        self.delta = delta
+        self.value: Optional[dict[str, Any]] = None
+        self.built_at = 0.0
+
+
+class DashboardSnapshot:
+    """Hält die Abschnitte des Dashboards im Speicher und baut nur veraltete neu."""
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self._session_factory = session_factory
+        self._sections: dict[str, _Section] = {}
+        self._dirty: set[str] = set()
+        # Abschnitte, die gerade neu gebaut werden: Deltas darauf würden vom Ergebnis überschrieben
+        self._building: set[str] = set()
+        self._dirty_lock = threading.Lock()
+        # Serialisiert den Neuaufbau, damit parallele Abrufe nicht doppelt rechnen
+        self._build_lock = threading.Lock()
+        # Zählt Beginn und Ende jedes Neuaufbaus (unter _dirty_lock)
+        self._build_epoch = 0
+        self.version = 0
+        self.deltas_applied = 0
+
+    def section(self, name: str, tables: Iterable[str], max_age: Optional[float] = None, delta: Optional[SectionDelta] = None):
+        """Decorator: registriert einen Abschnitt, der von den genannten Tabellen abhängt."""
+        def register(builder: SectionBuilder) -> SectionBuilder:
+            self._sections[name] = _Section(
+                name,
+                set(tables),
+                MAX_AGE_SECONDS if max_age is None else max_age,
+                builder,
+                delta,
+            )
+            return builder
+        return register
+
+    def sections_for_tables(self, tables: Iterable[str]) -> set[str]:
+        tables = set(tables)
+        return {s.name for s in self._sections.values() if s.tables & tables}
+
+    def invalidate(self, sections: Optional[Iterable[str]] = None) -> None:
+        names = set(self._sections) if sections is None else set(sections) & set(self._sections)
+        if not names:
+            return
+        with self._dirty_lock:
+            self._dirty |= names
+
+    def apply_changes(self, changes: dict[str, TableChanges], build_epoch: Optional[int] = None) -> set[str]:
+        """Verrechnet die Änderungen eines Commits und gibt alle betroffenen Abschnitte zurück.
+
+        build_epoch: Stand von _build_epoch beim ersten Flush des Commits. Abschnitte ohne
+        (erfolgreiches) Delta werden invalidiert.
+        """
+        sections = self.sections_for_tables(changes)
+        stale = {name for name in sections if not self._apply_delta(self._sections[name], changes, build_epoch)}
+        self.invalidate(stale)
+        return sections
+
+    def _apply_delta(self, section: _Section, changes: dict[str, TableChanges], build_epoch: Optional[int]) -> bool:
+        if section.delta is None:
+            return False
+        relevant = {table: change for table, change in changes.items() if table in section.tables}
+        with self._dirty_lock:
+            if section.value is None or section.name in self._dirty or section.name in self._building:
+                return False
+            if build_epoch is not None and build_epoch != self._build_epoch:
+                # Ein Neuaufbau lief seit dem Flush: er kann die Zeilen schon enthalten
+                return False
+            try:
+                value = section.delta(dict(section.value), relevant)
+            except Exception as exc:
+                print(f"[Dashboard] Delta für Abschnitt {section.name} fehlgeschlagen: {exc}")
+                return False
+            if value is None:
+                return False
+            section.value = value
+            self.version += 1
+            self.deltas_applied += 1
+            return True
+
+    def get(self) -> dict[str, Any]:
+        with self._build_lock:
+            now = time.monotonic()
+            with self._dirty_lock:
+                stale = {
+                    s.name
+                    for s in self._sections.values()
+                    if s.value is None or s.name in self._dirty or now - s.built_at >= s.max_age
+                }
+                # Invalidierungen während des Aufbaus bleiben für den nächsten Abruf stehen
+                self._dirty -= stale
+                self._building = stale
+                if stale:
+                    self._build_epoch += 1
+            if stale:
+                session = self._session_factory()
+                try:
+                    for name in stale:
+                        section = self._sections[name]
+                        try:
+                            section.value = section.builder(session)
+                            section.built_at = time.monotonic()
+                        except Exception:
+                            self.invalidate([name])
+                            raise
+                finally:
+                    session.close()
+                    with self._dirty_lock:
+                        self._building = set()
+                        self._build_epoch += 1
+                        self.version += 1
+            result: dict[str, Any] = {}
+            for section in self._sections.values():
+                result.update((key, value) for key, value in (section.value or {}).items() if not key.startswith("_"))
+            result["snapshot_version"] = self.version
+            return result
+
+    def track(self, session_target: Any, on_change: Optional[ChangeHandler] = None) -> None:
+        """Hängt die Invalidierung an die Commits von session_target (Session-Klasse oder sessionmaker)."""
+
+        @event.listens_for(session_target, "after_flush")
+        def _collect_changes(session: Session, _flush_context) -> None:
+            changes: dict[str, TableChanges] = session.info.setdefault(_INFO_KEY, {})
+            if _EPOCH_KEY not in session.info:
+                with self._dirty_lock:
+                    session.info[_EPOCH_KEY] = self._build_epoch
+            for objects, kind in ((session.new, "inserted"), (session.dirty, "updated"), (session.deleted, "deleted")):
+                for obj in objects:
+                    table = getattr(obj, "__tablename__", None)
+                    if not table:
+                        continue
+                    change = changes.get(table)
+                    if change is None:
+                        change = changes[table] = TableChanges()
+                    if kind == "inserted":
+                        # Nach dem Commit sind die Attribute expired: Werte jetzt ohne DB-Zugriff kopieren
+                        change.inserted.append({key: value for key, value in vars(obj).items() if not key.startswith("_sa_")})
+                    elif kind == "updated":
+                        change.updated += 1
+                    else:
+                        change.deleted += 1
+
+        @event.listens_for(session_target, "after_commit")
+        def _invalidate_on_commit(session: Session) -> None:
+            changes = session.info.pop(_INFO_KEY, None)
+            build_epoch = session.info.pop(_EPOCH_KEY, None)
+            if not changes:
+                return
+            sections = self.apply_changes(changes, build_epoch)
+            if not sections:
+                return
+            # Andere Worker kennen die Zeilen nicht und bauen die Abschnitte neu
+            if on_change:
+                try:
+                    on_change(sections)
+                except Exception as exc:
+                    print(f"[Dashboard] Snapshot-Invalidierung konnte nicht verteilt werden: {exc}")
+
+        @event.listens_for(session_target, "after_rollback")
+        def _discard_on_rollback(session: Session) -> None:
+            session.info.pop(_INFO_KEY, None)
+            session.info.pop(_EPOCH_KEY, None)
@@ -1,9 +1,14 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text, inspect
-from sqlalchemy.orm import sessionmaker
-from models import Base
-from sqlalchemy.orm import Session
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+import migrations
+from pool_metrics import PoolMetrics, metered_pool_class
+from sqlite_write_lane import SQLiteWriteLane, WriteLaneBusy
+import verbrauch_rollup
 
 
 load_dotenv()
@@ -11,85 +16,188 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///fallback.db")
 
 is_sqlite = DATABASE_URL.startswith("sqlite")
 
+# ----------------------------
+# SQLite-Profil für kleine Installationen: WAL (Leser blockieren Schreiber nicht), Pragmas je
+# Verbindung und eine Schreib-Spur – Sessions, die etwas flushen, halten bis zum Ende ihrer
+# Transaktion einen prozessweiten Lock (sqlite_write_lane.py). So warten konkurrierende Schreiber
+# (Station-PATCHes, Job-Abschlüsse aus Hintergrund-Threads) geordnet, statt sich gegenseitig
+# "database is locked" zu liefern. Lesende Sessions nehmen den Lock nie.
+# ----------------------------
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+# Negativ = KiB (SQLite-Konvention), Standard 20 MB Page-Cache je Verbindung
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))
+SQLITE_WRITE_LANE = os.getenv("SQLITE_WRITE_LANE", "1").lower() not in {"0", "false", "no"}
+
+# Connection-Pool: Request-Threads (FastAPI-Threadpool, standardmäßig 40) und Hintergrund-Threads
+# (Job-Abschlüsse, Discord-Outbox, Druckernamen) teilen sich diesen Pool. Auslastung: /_debug/db-pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in {"0", "false", "no"}
+
+_is_sqlite_memory = is_sqlite and (DATABASE_URL in {"sqlite://", "sqlite:///"} or ":memory:" in DATABASE_URL)
+_pool_args = {} if _is_sqlite_memory else {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if is_sqlite else {},
-    echo=False
+    poolclass=metered_pool_class(DATABASE_URL),
+    connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if is_sqlite else {},
+    echo=False,
+    **_pool_args,
 )
+
+
+class FisysSession(Session):
+    """Gemeinsame Session-Klasse für sync und async: Session-Events (Rollup, Dashboard-Snapshot) hängen hier."""
+
+
 SessionLocal = sessionmaker(
     bind=engine,
+    class_=FisysSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+# ----------------------------
+# Async-Pfad für async-Routen (asyncpg bzw. aiosqlite), damit DB-Zugriffe den Event-Loop nicht blockieren.
+# Sync-Routen bleiben im Threadpool bei SessionLocal. Beide nutzen FisysSession, die Session-Events
+# greifen also auch hier – einschließlich der SQLite-Schreib-Spur. Auf dem Event-Loop wird nie auf
+# die Spur gewartet: schreibende async-Routen holen sie vorher mit `async with async_write_lane(db)`.
+# ----------------------------
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise RuntimeError(f"Kein Async-Treiber für '{backend}' konfiguriert")
+    return parsed.set(drivername=_ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+async_engine = create_async_engine(
+    _async_database_url(DATABASE_URL),
+    poolclass=metered_pool_class(_async_database_url(DATABASE_URL)),
+    connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if is_sqlite else {},
+    echo=False,
+    **_pool_args,
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    sync_session_class=FisysSession,
     autoflush=False,
     expire_on_commit=False,
 )
 
+# Pool-Messwerte für beide Engines (Events am Pool, Wartezeit über die Pool-Klasse, siehe pool_metrics.py)
+engine_pool_metrics = PoolMetrics.attach(engine.pool, DB_MAX_OVERFLOW)
+async_pool_metrics = PoolMetrics.attach(async_engine.sync_engine.pool, DB_MAX_OVERFLOW)
+
+write_lane = SQLiteWriteLane(timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+_WRITE_LANE_PINNED = "sqlite_write_lane_pinned"
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        finally:
+            cursor.close()
+
+    if SQLITE_WRITE_LANE:
+        def _on_event_loop() -> bool:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        def _enter_write_lane_for(session):
+            if not _on_event_loop():
+                write_lane.enter(session)
+            elif not write_lane.try_enter(session, join=False):
+                # run_sync/async-Commit ohne async_write_lane(): den Loop nie blockieren
+                raise WriteLaneBusy("SQLite-Schreib-Spur belegt (async-Schreibzugriff ohne async_write_lane)")
+
+        @event.listens_for(FisysSession, "before_flush")
+        def _enter_write_lane(session, _flush_context, _instances):
+            _enter_write_lane_for(session)
+
+        @event.listens_for(FisysSession, "do_orm_execute")
+        def _enter_write_lane_for_dml(orm_execute_state):
+            # Core-/Bulk-DML über session.execute (z. B. presence, Outbox-Leases) läuft ohne Flush
+            if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+                _enter_write_lane_for(orm_execute_state.session)
+
+        @event.listens_for(FisysSession, "after_transaction_end")
+        def _leave_write_lane(session, transaction):
+            if transaction.parent is None and not session.info.get(_WRITE_LANE_PINNED):
+                write_lane.leave(session)
+
+# Tagessummen (verbrauch_daily) bei jeder Änderung an filament_verbrauch mitführen
+verbrauch_rollup.track(FisysSession)
+
+# Mehrere Worker starten gleichzeitig: Schema-Anpassungen auf Postgres per Advisory-Lock serialisieren
+INIT_DB_LOCK_KEY = 471100
+
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Aktuelles Schema: ein einziges SELECT, kein Lock
+    if migrations.current_version(engine) >= migrations.LATEST_VERSION:
+        return
+    if is_sqlite:
+        migrations.migrate(engine)
+        return
+    with engine.connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INIT_DB_LOCK_KEY})
+        try:
+            migrations.migrate(engine)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_DB_LOCK_KEY})
+
+
+@asynccontextmanager
+async def async_write_lane(db: AsyncSession | Session):
+    """Hält die SQLite-Schreib-Spur für alle Flushes/Commits im Block (ohne Spur: nichts zu tun).
+
+    Für Coroutinen, die schreiben – per AsyncSession oder mit einer sync Session direkt auf dem
+    Loop. Gewartet wird in einem Worker-Thread; Commits im Block (auch innerhalb von run_sync)
+    geben die Spur nicht frei, erst das Verlassen des Blocks.
+    """
+    if not (is_sqlite and SQLITE_WRITE_LANE):
+        yield
+        return
+    session = db.sync_session if isinstance(db, AsyncSession) else db
+    await write_lane.enter_async(session)
+    session.info[_WRITE_LANE_PINNED] = True
     try:
-        with engine.begin() as conn:
-            inspector = inspect(conn)
-            columns = [col["name"] for col in inspector.get_columns("filament_spule")]
-            if "printer_serial" not in columns:
-                conn.execute(text("ALTER TABLE filament_spule ADD COLUMN printer_serial VARCHAR"))
-            if "letzte_aktion" not in columns:
-                conn.execute(text("ALTER TABLE filament_spule ADD COLUMN letzte_aktion VARCHAR"))
-            user_columns = [col["name"] for col in inspector.get_columns("users")]
-            timestamp_type = "TIMESTAMP" if is_sqlite else "TIMESTAMP WITH TIME ZONE"
-            default_clause = "DEFAULT CURRENT_TIMESTAMP"
-            if is_sqlite:
-                if "discord_id" not in user_columns:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN discord_id VARCHAR"))
-            else:
-                conn.execute(text(
-                    """
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1
-                            FROM information_schema.columns
-                            WHERE table_name = 'users' AND column_name = 'discord_id'
-                        ) THEN
-                            ALTER TABLE users ADD COLUMN discord_id VARCHAR;
-                        END IF;
-                    END
-                    $$;
-                    """
-                ))
-            if "created_at" not in user_columns:
-                conn.execute(text(f"ALTER TABLE users ADD COLUMN created_at {timestamp_type} {default_clause}"))
-            if "last_seen" not in user_columns:
-                conn.execute(text(f"ALTER TABLE users ADD COLUMN last_seen {timestamp_type} {default_clause}"))
-            updated_user_columns = {col["name"] for col in inspect(conn).get_columns("users")}
-            if {"created_at", "last_seen"}.issubset(updated_user_columns):
-                conn.execute(text("UPDATE users SET created_at = COALESCE(created_at, CURRENT_TIMESTAMP), last_seen = COALESCE(last_seen, CURRENT_TIMESTAMP)"))
-
-            tables = set(inspector.get_table_names())
-            if "discord_bot_config" in tables:
-                bot_columns = [col["name"] for col in inspector.get_columns("discord_bot_config")]
-                if "use_dm" not in bot_columns:
-                    if is_sqlite:
-                        conn.execute(text("ALTER TABLE discord_bot_config ADD COLUMN use_dm BOOLEAN DEFAULT 0"))
-                    else:
-                        conn.execute(text("ALTER TABLE discord_bot_config ADD COLUMN IF NOT EXISTS use_dm BOOLEAN DEFAULT FALSE"))
-                if "failure_message_template" not in bot_columns:
-                    if is_sqlite:
-                        conn.execute(text("ALTER TABLE discord_bot_config ADD COLUMN failure_message_template TEXT"))
-                    else:
-                        conn.execute(text("ALTER TABLE discord_bot_config ADD COLUMN IF NOT EXISTS failure_message_template TEXT"))
-                failure_default = "Hey {username}, dein Druckauftrag {job_name} auf {printer_name} ist fehlgeschlagen: {failure_reason}"
-                conn.execute(
-                    text("UPDATE discord_bot_config SET failure_message_template = :default WHERE failure_message_template IS NULL"),
-                    {"default": failure_default}
-                )
-                result = conn.execute(text("SELECT COUNT(*) FROM discord_bot_config"))
-                count = result.scalar() if result is not None else 0
-                if not count:
-                    default_template = "Hey {username}, dein Druckauftrag {job_name} auf {printer_name} ist fertig!"
-                    conn.execute(
-                        text("INSERT INTO discord_bot_config (id, enabled, use_dm, message_template, failure_message_template) VALUES (1, :enabled, :use_dm, :template, :failure_template)"),
-                        {"enabled": False, "use_dm": False, "template": default_template, "failure_template": failure_default}
-                    )
-    except Exception as exc:
-        print(f"[DB] Konnte Datenbank-Anpassungen nicht durchführen: {exc}")
+        yield
+    finally:
+        session.info.pop(_WRITE_LANE_PINNED, None)
+        # Noch offene Transaktion (z. B. Fehler vor dem Commit): after_transaction_end gibt frei
+        if not session.in_transaction():
+            write_lane.leave(session)
+
+
+def pool_stats() -> dict:
+    stats = {"engine": engine_pool_metrics.stats(), "async_engine": async_pool_metrics.stats()}
+    if is_sqlite and SQLITE_WRITE_LANE:
+        stats["sqlite_write_lane"] = write_lane.stats()
+    return stats
 
 
 def get_db():
@@ -98,3 +206,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
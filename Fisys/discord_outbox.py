@@ -0,0 +1,515 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import joinedload
+
+from db import SessionLocal
+from models import DiscordBotConfig, DiscordNotificationSubscription, DiscordOutbox, User
+
+# ----------------------------
+# Discord-Outbox: Nachrichten werden erst in discord_outbox gespeichert und dann vom
+# Zustell-Worker verschickt. Fehler (Timeout, 5xx, 429) führen zu einem neuen Versuch mit
+# exponentiellem Backoff; bei 429 wird Retry-After bzw. retry_after aus der Antwort eingehalten.
+# DM-Channel-IDs werden je discord_id zwischengespeichert, alle Aufrufe laufen über eine
+# gemeinsame requests.Session (Connection-Pool). Fällige Einträge werden rundenweise parallel
+# (SEND_CONCURRENCY) versendet, der Status wird je Runde gespeichert.
+#
+# Sammelnachrichten speichern Vorlage und Kontext mit: wird ein Abo vor dem Versand gelöscht, wird
+# der Text aus den verbleibenden Abos neu gebaut (Namen und Erwähnungen des Entfernten fallen weg).
+#
+# Ein Eintrag wird per bedingtem UPDATE "geleast" (next_attempt_at in die Zukunft), daher können
+# mehrere Worker-Prozesse dieselbe Tabelle abarbeiten, ohne doppelt zu senden. Stirbt ein Prozess
+# mitten in der Zustellung, wird der Eintrag nach Ablauf des Leases erneut versucht.
+# ----------------------------
+
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE", "https://discord.com/api/v10").rstrip("/")
+HTTP_TIMEOUT_SECONDS = float(os.getenv("DISCORD_HTTP_TIMEOUT", "10"))
+MAX_ATTEMPTS = int(os.getenv("DISCORD_OUTBOX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = float(os.getenv("DISCORD_OUTBOX_BACKOFF_BASE", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("DISCORD_OUTBOX_BACKOFF_MAX", "600"))
+POLL_SECONDS = float(os.getenv("DISCORD_OUTBOX_POLL_SECONDS", "15"))
+BATCH_SIZE = int(os.getenv("DISCORD_OUTBOX_BATCH_SIZE", "20"))
+LEASE_SECONDS = float(os.getenv("DISCORD_OUTBOX_LEASE_SECONDS", "120"))
+# Max. gleichzeitige Zustellungen je Runde (v. a. DM-Modus: eine Nachricht pro Abonnent)
+SEND_CONCURRENCY = int(os.getenv("DISCORD_SEND_CONCURRENCY", "4"))
+# Webhook-/Channel-Modus: eine Sammelnachricht mit allen Erwähnungen statt einer Nachricht je Abonnent
+AGGREGATE_CHANNEL_MESSAGES = os.getenv("DISCORD_AGGREGATE_MESSAGES", "1").strip().lower() not in ("0", "false", "no", "off")
+# Discord begrenzt Nachrichten auf 2000 Zeichen: Sammelnachrichten werden ggf. aufgeteilt
+AGGREGATE_MAX_MENTIONS = int(os.getenv("DISCORD_AGGREGATE_MAX_MENTIONS", "40"))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class DeliveryResult:
+    ok: bool
+    error: Optional[str] = None
+    retryable: bool = False
+    retry_after: Optional[float] = None
+    attempted: bool = True  # False: wegen aktivem Rate-Limit gar nicht erst gesendet
+
+
+def _create_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_http = _create_http_session()
+
+# DM-Channel-Cache: discord_id -> channel_id (gilt nur für den Bot-Token, mit dem er gefüllt wurde)
+_dm_channels: dict[str, str] = {}
+_dm_channels_token: Optional[str] = None
+_dm_lock = threading.Lock()
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    try:
+        body = response.json() if response.content else {}
+        if isinstance(body, dict) and body.get("retry_after") is not None:
+            value = body.get("retry_after")
+    except ValueError:
+        pass
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _result_from_response(response: requests.Response, prefix: str = "") -> DeliveryResult:
+    if 200 <= response.status_code < 300:
+        return DeliveryResult(ok=True)
+    error = f"{prefix}HTTP {response.status_code}: {response.text[:200]}"
+    if response.status_code == 429:
+        return DeliveryResult(ok=False, error=error, retryable=True, retry_after=_retry_after(response) or 1.0)
+    return DeliveryResult(ok=False, error=error, retryable=response.status_code >= 500)
+
+
+def _post(url: str, payload: dict, headers: Optional[dict] = None, prefix: str = "") -> tuple[Optional[requests.Response], DeliveryResult]:
+    try:
+        response = _http.post(url, json=payload, headers=headers, timeout=HTTP_TIMEOUT_SECONDS)
+    except requests.RequestException as exc:
+        return None, DeliveryResult(ok=False, error=f"{prefix}{exc}", retryable=True)
+    return response, _result_from_response(response, prefix)
+
+
+def _dm_channel_id(bot_token: str, discord_id: str) -> tuple[Optional[str], DeliveryResult]:
+    global _dm_channels_token
+    with _dm_lock:
+        if _dm_channels_token != bot_token:
+            _dm_channels.clear()
+            _dm_channels_token = bot_token
+        cached = _dm_channels.get(discord_id)
+    if cached:
+        return cached, DeliveryResult(ok=True)
+    headers = {"Authorization": f"Bot {bot_token}"}
+    response, result = _post(f"{DISCORD_API_BASE}/users/@me/channels", {"recipient_id": discord_id}, headers, prefix="DM-Channel-Fehler: ")
+    if not result.ok:
+        return None, result
+    payload = response.json() if response is not None and response.content else {}
+    channel_id = payload.get("id") if isinstance(payload, dict) else None
+    if not channel_id:
+        return None, DeliveryResult(ok=False, error="DM-Channel konnte nicht ermittelt werden")
+    with _dm_lock:
+        if _dm_channels_token == bot_token:
+            _dm_channels[discord_id] = str(channel_id)
+    return str(channel_id), DeliveryResult(ok=True)
+
+
+def _forget_dm_channel(discord_id: str) -> None:
+    with _dm_lock:
+        _dm_channels.pop(discord_id, None)
+
+
+def send_message(config: DiscordBotConfig, content: str, discord_id: Optional[str] = None) -> DeliveryResult:
+    """Ein Zustellversuch über DM, Webhook oder Bot-Channel (je nach Konfiguration)."""
+    if not config.enabled:
+        return DeliveryResult(ok=False, error="Bot deaktiviert")
+
+    if config.use_dm:
+        if not config.bot_token:
+            return DeliveryResult(ok=False, error="Bot-Token erforderlich, um Direktnachrichten zu senden")
+        if not discord_id or not str(discord_id).isdigit():
+            return DeliveryResult(ok=False, error="Discord-ID fehlt oder ist ungültig")
+        channel_id, result = _dm_channel_id(config.bot_token, str(discord_id))
+        if not channel_id:
+            return result
+        headers = {"Authorization": f"Bot {config.bot_token}"}
+        _, result = _post(f"{DISCORD_API_BASE}/channels/{channel_id}/messages", {"content": content}, headers)
+        if not result.ok and not result.retryable:
+            # Channel evtl. nicht mehr gültig: beim nächsten Versuch neu anlegen
+            _forget_dm_channel(str(discord_id))
+        return result
+
+    if config.webhook_url:
+        _, result = _post(config.webhook_url, {"content": content})
+        return result
+
+    if config.channel_id and config.bot_token:
+        headers = {"Authorization": f"Bot {config.bot_token}"}
+        _, result = _post(f"{DISCORD_API_BASE}/channels/{config.channel_id}/messages", {"content": content}, headers)
+        return result
+
+    return DeliveryResult(ok=False, error="Keine gültige Discord-Konfiguration gefunden")
+
+
+class _SafeFormatDict(dict):
+    def __missing__(self, key):
+        return ""
+
+
+def format_message(template: str, context: dict) -> str:
+    """Füllt die Platzhalter der Vorlage; unbekannte bleiben leer, kaputte Vorlagen unverändert."""
+    safe_context = {k: "" if v is None else str(v) for k, v in context.items()}
+    try:
+        return template.format_map(_SafeFormatDict(safe_context))
+    except Exception:
+        return template
+
+
+def aggregate_message(template: str, context: dict, users: list[User]) -> str:
+    """Sammelnachricht an mehrere Benutzer (Webhook/Channel).
+
+    Enthält die Vorlage kein {discord_mention}, werden die Erwähnungen angehängt – sonst würde
+    niemand benachrichtigt.
+    """
+    mentions = " ".join(f"<@{user.discord_id}>" for user in users if user.discord_id and user.discord_id.isdigit())
+    message = format_message(template, {
+        **context,
+        'username': ", ".join(user.username for user in users),
+        'discord_id': ", ".join(user.discord_id for user in users if user.discord_id),
+        'discord_mention': f"{mentions} " if mentions else "",
+    })
+    if mentions and "{discord_mention}" not in template:
+        message = f"{message}\n{mentions}"
+    return message
+
+
+def enqueue(
+    session,
+    subscriptions: list[DiscordNotificationSubscription],
+    content: str,
+    discord_id: Optional[str] = None,
+    failure_reason: Optional[str] = None,
+    template: Optional[str] = None,
+    context: Optional[dict] = None,
+) -> DiscordOutbox:
+    """Legt eine Nachricht in der Outbox ab. Der Aufrufer committet und ruft danach wake() auf.
+
+    Bei mehreren Abos (Sammelnachricht im Webhook-/Channel-Modus) gilt das Ergebnis für alle;
+    template/context sind dann die Eingaben von aggregate_message.
+    """
+    entry = DiscordOutbox(
+        subscription_id=subscriptions[0].id if len(subscriptions) == 1 else None,
+        subscription_ids=",".join(str(sub.id) for sub in subscriptions) if len(subscriptions) > 1 else None,
+        discord_id=discord_id,
+        content=content,
+        failure_reason=failure_reason,
+        template=template,
+        context=json.dumps(context) if context is not None else None,
+        status='pending',
+        attempts=0,
+        next_attempt_at=_utcnow(),
+    )
+    session.add(entry)
+    for subscription in subscriptions:
+        subscription.status = 'queued'
+        subscription.last_error = None
+    return entry
+
+
+def _entry_subscription_ids(entry: DiscordOutbox) -> list[int]:
+    if entry.subscription_ids:
+        return [int(value) for value in entry.subscription_ids.split(",") if value.strip().isdigit()]
+    return [entry.subscription_id] if entry.subscription_id else []
+
+
+def cancel_for_subscription(session, subscription: DiscordNotificationSubscription) -> int:
+    """Nimmt ein gelöschtes Abo aus allen noch offenen Nachrichten. Der Aufrufer committet.
+
+    Einzelnachrichten werden verworfen; Sammelnachrichten werden aus den verbleibenden Abos neu
+    gebaut, ohne verbleibende Abos wird auch die Sammelnachricht verworfen.
+    """
+    changed = 0
+    entries = (
+        session.query(DiscordOutbox)
+        .filter(
+            DiscordOutbox.status == 'pending',
+            or_(
+                DiscordOutbox.subscription_id == subscription.id,
+                # Grobfilter, exakt geprüft wird unten
+                DiscordOutbox.subscription_ids.like(f"%{subscription.id}%"),
+            ),
+        )
+        .all()
+    )
+    for entry in entries:
+        ids = _entry_subscription_ids(entry)
+        if subscription.id not in ids:
+            continue
+        remaining = [value for value in ids if value != subscription.id]
+        changed += 1
+        if not remaining:
+            entry.status = 'cancelled'
+            continue
+        entry.subscription_ids = ",".join(str(value) for value in remaining)
+        if entry.template is not None:
+            entry.content = _rebuild_content(session, entry, remaining)
+        else:
+            _remove_mention(session, entry, subscription, remaining)
+    return changed
+
+
+def _rebuild_content(session, entry: DiscordOutbox, subscription_ids: list[int]) -> str:
+    subscriptions = (
+        session.query(DiscordNotificationSubscription)
+        .options(joinedload(DiscordNotificationSubscription.user))
+        .filter(DiscordNotificationSubscription.id.in_(subscription_ids))
+        .order_by(DiscordNotificationSubscription.id)
+        .all()
+    )
+    users = [sub.user for sub in subscriptions if sub.user is not None]
+    return aggregate_message(entry.template, json.loads(entry.context or "{}"), users)
+
+
+def _remove_mention(session, entry: DiscordOutbox, subscription: DiscordNotificationSubscription, remaining: list[int]) -> None:
+    # Einträge von vor Migration 11 ohne Vorlage: nur die Erwähnung aus dem Text nehmen
+    discord_id = subscription.user.discord_id if subscription.user else None
+    if not discord_id:
+        return
+    still_mentioned = (
+        session.query(DiscordNotificationSubscription.id)
+        .join(DiscordNotificationSubscription.user)
+        .filter(DiscordNotificationSubscription.id.in_(remaining), User.discord_id == discord_id)
+        .first()
+    )
+    if not still_mentioned:
+        entry.content = entry.content.replace(f"<@{discord_id}> ", "").replace(f"<@{discord_id}>", "")
+
+
+def _backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class DiscordOutboxWorker:
+    """Zustell-Thread für discord_outbox. wake() stößt eine sofortige Runde an."""
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        # Globales Rate-Limit: bis zu diesem Zeitpunkt (monotonic) nichts senden
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, SEND_CONCURRENCY), thread_name_prefix="DiscordSend")
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="DiscordOutbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        session = SessionLocal()
+        try:
+            pending = session.query(DiscordOutbox).filter(DiscordOutbox.status == 'pending').count()
+        finally:
+            session.close()
+        return {
+            "pending": pending,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 1),
+        }
+
+    def _run(self) -> None:
+        while self._running:
+            wait = POLL_SECONDS
+            try:
+                blocked = self._blocked_until - time.monotonic()
+                if blocked > 0:
+                    wait = blocked
+                else:
+                    wait = self.process_due()
+            except Exception as exc:
+                print(f"[DiscordOutbox] Fehler im Zustell-Worker: {exc}")
+            if wait > 0:
+                self._wakeup.wait(min(wait, POLL_SECONDS))
+            self._wakeup.clear()
+
+    def _seconds_until_next_due(self, session) -> float:
+        next_due = (
+            session.query(func.min(DiscordOutbox.next_attempt_at))
+            .filter(DiscordOutbox.status == 'pending')
+            .scalar()
+        )
+        if next_due is None:
+            return POLL_SECONDS
+        if next_due.tzinfo is None:
+            next_due = next_due.replace(tzinfo=timezone.utc)
+        return max(0.0, (next_due - _utcnow()).total_seconds())
+
+    def _claim(self, session, entry_id: int, attempts: int, now: datetime) -> bool:
+        result = session.execute(
+            update(DiscordOutbox)
+            .where(
+                DiscordOutbox.id == entry_id,
+                DiscordOutbox.status == 'pending',
+                DiscordOutbox.attempts == attempts,
+            )
+            .values(attempts=attempts + 1, next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+        )
+        return result.rowcount == 1
+
+    def _send(self, config: Optional[DiscordBotConfig], content: str, discord_id: Optional[str]) -> DeliveryResult:
+        if config is None:
+            return DeliveryResult(ok=False, error="Keine gültige Discord-Konfiguration gefunden")
+        blocked = self._blocked_until - time.monotonic()
+        if blocked > 0:
+            # Ein paralleler Versand hat bereits ein 429 bekommen
+            return DeliveryResult(ok=False, error="Rate-Limit aktiv", retryable=True, retry_after=blocked, attempted=False)
+        result = send_message(config, content, discord_id)
+        if result.retry_after is not None:
+            # 429: Discord-Limit gilt für den ganzen Bot/Webhook, daher alle Zustellungen pausieren
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + result.retry_after)
+        return result
+
+    def process_due(self) -> float:
+        """Arbeitet eine Runde fälliger Einträge ab und gibt zurück, wie lange bis zur nächsten Runde gewartet werden kann.
+
+        Eine Runde wird mit einer Transaktion geleast, parallel (max. SEND_CONCURRENCY) versendet
+        und das Ergebnis gesammelt in einer zweiten Transaktion gespeichert.
+        """
+        session = SessionLocal()
+        try:
+            now = _utcnow()
+            due = (
+                session.query(DiscordOutbox.id, DiscordOutbox.attempts)
+                .filter(DiscordOutbox.status == 'pending', DiscordOutbox.next_attempt_at <= now)
+                .order_by(DiscordOutbox.next_attempt_at, DiscordOutbox.id)
+                .limit(BATCH_SIZE)
+                .all()
+            )
+            if not due:
+                return self._seconds_until_next_due(session)
+            claimed = [entry_id for entry_id, attempts in due if self._claim(session, entry_id, attempts, now)]
+            session.commit()
+            if not claimed:
+                return 0
+            config = session.get(DiscordBotConfig, 1)
+            entries = self._drop_orphaned(
+                session,
+                session.query(DiscordOutbox).filter(DiscordOutbox.id.in_(claimed)).order_by(DiscordOutbox.id).all(),
+            )
+            jobs = [(entry.content, entry.discord_id) for entry in entries]
+            results = list(self._executor.map(lambda job: self._send(config, *job), jobs))
+            for entry, result in zip(entries, results):
+                self._record(session, entry, result)
+            session.commit()
+            if not self._running:
+                return 0
+            blocked = self._blocked_until - time.monotonic()
+            if blocked > 0:
+                return blocked
+            # Volle Runde: es liegt vermutlich noch mehr an, sonst bis zum nächsten fälligen Eintrag warten
+            return 0 if len(due) >= BATCH_SIZE else self._seconds_until_next_due(session)
+        finally:
+            session.close()
+
+    def _drop_orphaned(self, session, entries: list[DiscordOutbox]) -> list[DiscordOutbox]:
+        # Sammelnachrichten, deren Abos inzwischen alle gelöscht sind, nicht mehr senden
+        ids = {value for entry in entries if entry.subscription_ids for value in _entry_subscription_ids(entry)}
+        if not ids:
+            return entries
+        existing = {
+            value for (value,) in session.query(DiscordNotificationSubscription.id).filter(DiscordNotificationSubscription.id.in_(ids))
+        }
+        kept = []
+        for entry in entries:
+            if entry.subscription_ids and not existing.intersection(_entry_subscription_ids(entry)):
+                entry.status = 'cancelled'
+                continue
+            kept.append(entry)
+        return kept
+
+    def _record(self, session, entry: DiscordOutbox, result: DeliveryResult) -> None:
+        now = _utcnow()
+        ids = _entry_subscription_ids(entry)
+        subscriptions = session.query(DiscordNotificationSubscription).filter(DiscordNotificationSubscription.id.in_(ids)).all() if ids else []
+        reason = entry.failure_reason
+
+        if result.ok:
+            self.sent += 1
+            entry.status = 'sent'
+            entry.sent_at = now
+            entry.last_error = None
+            for subscription in subscriptions:
+                subscription.notified_at = now
+                if reason:
+                    subscription.status = 'failed'
+                    subscription.last_error = f"{reason} Nachricht gesendet."
+                else:
+                    subscription.status = 'sent'
+                    subscription.last_error = None
+            return
+
+        if not result.attempted:
+            # Nicht gesendet: Versuch nicht mitzählen, nur bis zum Ende des Rate-Limits zurückstellen
+            entry.attempts = max(0, entry.attempts - 1)
+            entry.next_attempt_at = now + timedelta(seconds=result.retry_after or 0)
+            return
+
+        entry.last_error = result.error
+        if result.retryable and entry.attempts < MAX_ATTEMPTS:
+            self.retried += 1
+            delay = result.retry_after if result.retry_after is not None else _backoff_seconds(entry.attempts)
+            entry.next_attempt_at = now + timedelta(seconds=delay)
+            for subscription in subscriptions:
+                subscription.last_error = f"Versuch {entry.attempts} fehlgeschlagen, neuer Versuch folgt: {result.error}"
+            print(f"[DiscordOutbox] Nachricht {entry.id}: {result.error} – neuer Versuch in {delay:.1f}s")
+            return
+
+        self.failed += 1
+        entry.status = 'failed'
+        error = result.error or 'Unbekannter Fehler'
+        for subscription in subscriptions:
+            subscription.status = 'failed'
+            subscription.last_error = f"{reason} {error}".strip() if reason else error
+        print(f"[DiscordOutbox] Nachricht {entry.id} endgültig fehlgeschlagen: {result.error}")
+
+
+outbox_worker = DiscordOutboxWorker()
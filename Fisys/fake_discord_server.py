@@ -0,0 +1,171 @@
+"""Lokaler Fake-Discord-Server zum Testen der Discord-Outbox.
+
+Start:
+    python fake_discord_server.py --port 8765 --limit 5 --window 1 --fail-every 7
+
+Fisys dagegen laufen lassen:
+    DISCORD_API_BASE=http://127.0.0.1:8765 uvicorn main:app
+    (Webhook-Modus: Webhook-URL in den Einstellungen auf http://127.0.0.1:8765/webhooks/1/test setzen)
+
+Unterstützt:
+    POST /users/@me/channels        -> DM-Channel anlegen ({"recipient_id": ...})
+    POST /channels/{id}/messages    -> Nachricht senden
+    POST /webhooks/{id}/{token}     -> Webhook-Nachricht
+    GET  /_stats                    -> Zähler als JSON
+
+Nachrichten werden per Fenster begrenzt (--limit pro --window Sekunden). Darüber hinaus gibt es
+429 mit Retry-After-Header und retry_after im Body, wie bei Discord. --fail-every N liefert bei jeder
+N-ten Nachricht einen 500er, --delay verzögert jede Antwort (Timeouts testen).
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+stats = {"dm_channels": 0, "messages": 0, "webhooks": 0, "rate_limited": 0, "errors": 0}
+received: list[dict] = []
+lock = threading.Lock()
+window_start = time.monotonic()
+window_count = 0
+request_counter = 0
+args = None
+
+
+def _rate_limited() -> float:
+    """Gibt 0 zurück, wenn die Nachricht durch darf, sonst die Wartezeit in Sekunden."""
+    global window_start, window_count
+    now = time.monotonic()
+    if now - window_start >= args.window:
+        window_start = now
+        window_count = 0
+    if window_count >= args.limit:
+        return round(args.window - (now - window_start), 3)
+    window_count += 1
+    return 0.0
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *log_args):
+        if args.verbose:
+            super().log_message(format, *log_args)
+
+    def _send(self, status: int, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/_stats":
+            with lock:
+                self._send(200, {**stats, "received": received[-20:]})
+            return
+        self._send(404, {"message": "404: Not Found"})
+
+    def do_POST(self):
+        global request_counter
+        payload = self._read_json()
+        if args.delay:
+            time.sleep(args.delay)
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts[-3:] == ["users", "@me", "channels"]:
+            with lock:
+                stats["dm_channels"] += 1
+            self._send(200, {"id": f"9{payload.get('recipient_id', '0')}", "type": 1})
+            return
+
+        is_message = len(parts) >= 3 and parts[-3] == "channels" and parts[-1] == "messages"
+        is_webhook = len(parts) >= 3 and parts[-3] == "webhooks"
+        if not (is_message or is_webhook):
+            self._send(404, {"message": "404: Not Found"})
+            return
+
+        with lock:
+            request_counter += 1
+            retry_after = _rate_limited()
+            if retry_after:
+                stats["rate_limited"] += 1
+            elif args.fail_every and request_counter % args.fail_every == 0:
+                stats["errors"] += 1
+                retry_after = -1
+            else:
+                stats["webhooks" if is_webhook else "messages"] += 1
+                received.append({"path": self.path, "content": payload.get("content")})
+
+        if retry_after > 0:
+            self._send(429, {"message": "You are being rate limited.", "retry_after": retry_after, "global": False},
+                       {"Retry-After": str(retry_after)})
+        elif retry_after < 0:
+            self._send(500, {"message": "500: Internal Server Error"})
+        elif is_webhook:
+            self._send(204)
+        else:
+            self._send(200, {"id": str(request_counter), "content": payload.get("content")})
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake-Discord-API für lokale Tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--limit", type=int, default=5, help="Nachrichten pro Fenster")
+    parser.add_argument("--window", type=float, default=1.0, help="Fensterlänge in Sekunden")
+    parser.add_argument("--fail-every", type=int, default=0, help="jede N-te Nachricht mit 500 beantworten")
+    parser.add_argument("--delay", type=float, default=0.0, help="Verzögerung je Antwort in Sekunden")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def _reset(options: argparse.Namespace) -> None:
+    global args, window_start, window_count, request_counter
+    with lock:
+        args = options
+        window_start = time.monotonic()
+        window_count = 0
+        request_counter = 0
+        received.clear()
+        for key in stats:
+            stats[key] = 0
+
+
+def start(argv=None) -> ThreadingHTTPServer:
+    """Startet den Server in einem Hintergrund-Thread (für Tests, --port 0 = freier Port).
+
+    Beenden mit server.shutdown(); server.server_close(). Zähler und Optionen werden zurückgesetzt,
+    es läuft also immer nur ein Fake-Server je Prozess.
+    """
+    _reset(_parse_args(argv))
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    threading.Thread(target=server.serve_forever, name="FakeDiscord", daemon=True).start()
+    return server
+
+
+def main():
+    _reset(_parse_args())
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"[FakeDiscord] läuft auf http://{args.host}:{args.port} (Limit {args.limit}/{args.window}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[FakeDiscord] Statistik: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import column, event, select, table, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# ----------------------------
+# Revisionszähler für den Bestand (Typen, Spulen, Drucker, Bilder) und darauf aufbauende
+# Conditional GETs. Jeder Commit, der eine der INVENTORY_TABLES ändert, erhöht die Revision;
+# andere Worker erfahren es über den Cluster-Kanal. Für /bilder/ kommt die mtime des
+# Bildverzeichnisses dazu (Uploads/Löschungen ohne DB-Änderung).
+#
+# Das ETag besteht aus einer zufälligen Prozess-Epoche und der Revision – zwei Worker liefern
+# daher nie dasselbe ETag für unterschiedliche Stände. If-None-Match wird vor jeder
+# DB-Abfrage geprüft; passt es, gibt es ein 304 ohne Datenbankzugriff.
+#
+# Damit eine verlorene Cluster-Nachricht kein veraltetes ETag festhält, erhöht jeder solche Commit
+# zusätzlich einen Zähler in der Datenbank (inventory_state, in derselben Transaktion). Höchstens alle
+# INVENTORY_REVISION_CHECK_SECONDS liest ein Request den Zähler; weicht er von dem ab, was dieser
+# Worker kennt, wird die Revision erhöht und on_stale (Katalog-Cache) aufgerufen.
+# ----------------------------
+
+INVENTORY_TABLES = frozenset({"filament_typ", "filament_spule", "printers"})
+CHECK_SECONDS = float(os.getenv("INVENTORY_REVISION_CHECK_SECONDS", "5"))
+_INFO_KEY = "inventory_revision_dirty"
+_COUNTER_KEY = "inventory_revision_counter"
+
+# Einzeilige Tabelle aus Migration 10
+inventory_state = table("inventory_state", column("id"), column("revision"))
+
+ChangeHandler = Callable[[], None]
+
+
+class InventoryRevision:
+    def __init__(self, tables: Iterable[str] = INVENTORY_TABLES, check_seconds: float = CHECK_SECONDS):
+        self.tables = frozenset(tables)
+        self.check_seconds = max(0.0, check_seconds)
+        self._epoch = secrets.token_hex(4)
+        self._revision = 0
+        self._lock = threading.Lock()
+        self._engine: Optional[Engine] = None
+        self._on_stale: Optional[ChangeHandler] = None
+        # Zuletzt gesehener Stand des DB-Zählers (None: noch nie gelesen)
+        self._db_revision: Optional[int] = None
+        self._checked_at = 0.0
+        self.stale_detected = 0
+
+    @property
+    def revision(self) -> int:
+        return self._revision
+
+    def bump(self) -> int:
+        with self._lock:
+            self._revision += 1
+            return self._revision
+
+    def watch(self, engine: Engine, on_stale: Optional[ChangeHandler] = None) -> None:
+        """Gleicht die Revision regelmäßig mit dem DB-Zähler ab (siehe Kopfkommentar)."""
+        self._engine = engine
+        self._on_stale = on_stale
+
+    def _check_db(self) -> None:
+        if self._engine is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+        try:
+            with self._engine.connect() as conn:
+                value = conn.execute(select(inventory_state.c.revision).where(inventory_state.c.id == 1)).scalar()
+        except Exception as exc:
+            print(f"[Inventory] Revisions-Zähler nicht lesbar: {exc}")
+            return
+        with self._lock:
+            stale = self._db_revision is not None and value != self._db_revision
+            self._db_revision = value
+        if not stale:
+            return
+        self.stale_detected += 1
+        self.bump()
+        if self._on_stale:
+            try:
+                self._on_stale()
+            except Exception as exc:
+                print(f"[Inventory] Abgleich mit dem Revisions-Zähler fehlgeschlagen: {exc}")
+
+    def _committed(self, counter: Optional[int]) -> None:
+        # Eigener Commit: genau ein Schritt weiter heißt, niemand sonst hat dazwischen geschrieben –
+        # sonst bleibt der alte Stand stehen und der nächste Abgleich bemerkt die fremde Änderung
+        with self._lock:
+            if counter is not None and self._db_revision is not None and counter == self._db_revision + 1:
+                self._db_revision = counter
+
+    def etag(self, extra: Optional[str] = None) -> str:
+        tag = f"inv-{self._epoch}-{self._revision}"
+        if extra:
+            tag = f"{tag}-{extra}"
+        return f'"{tag}"'
+
+    def not_modified(self, request: Request, response: Response, extra: Optional[str] = None) -> Optional[Response]:
+        """304-Antwort, wenn If-None-Match passt; sonst None und ETag auf `response` gesetzt.
+
+        Muss vor der DB-Abfrage aufgerufen werden: ändert sich der Bestand währenddessen, trägt
+        die Antwort das ältere ETag und wird beim nächsten Abruf neu geladen.
+        """
+        self._check_db()
+        etag = self.etag(extra)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            candidates = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+            if etag in candidates or "*" in candidates:
+                return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return None
+
+    def track(self, session_target: Any, on_change: Optional[ChangeHandler] = None) -> None:
+        """Erhöht die Revision nach jedem Commit, der eine Bestands-Tabelle geändert hat."""
+
+        @event.listens_for(session_target, "after_flush")
+        def _collect(session: Session, _flush_context) -> None:
+            if session.info.get(_INFO_KEY):
+                return
+            for obj in (*session.new, *session.dirty, *session.deleted):
+                if getattr(obj, "__tablename__", None) in self.tables:
+                    session.info[_INFO_KEY] = True
+                    # Einmal je Transaktion, atomar mit der Änderung selbst
+                    session.info[_COUNTER_KEY] = session.connection().execute(
+                        update(inventory_state)
+                        .where(inventory_state.c.id == 1)
+                        .values(revision=inventory_state.c.revision + 1)
+                        .returning(inventory_state.c.revision)
+                    ).scalar()
+                    return
+
+        @event.listens_for(session_target, "after_commit")
+        def _bump_on_commit(session: Session) -> None:
+            counter = session.info.pop(_COUNTER_KEY, None)
+            if not session.info.pop(_INFO_KEY, False):
+                return
+            self._committed(counter)
+            self.bump()
+            if on_change:
+                try:
+                    on_change()
+                except Exception as exc:
+                    print(f"[Inventory] Revisions-Änderung konnte nicht verteilt werden: {exc}")
+
+        @event.listens_for(session_target, "after_rollback")
+        def _discard_on_rollback(session: Session) -> None:
+            session.info.pop(_INFO_KEY, None)
+            session.info.pop(_COUNTER_KEY, None)
+
+
+inventory_revision = InventoryRevision()
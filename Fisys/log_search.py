@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+from sqlalchemy import Integer, column, literal_column, or_, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from models import FilamentSpuleHistorie, PrinterJobHistory
+
+# ----------------------------
+# Volltextsuche für die Admin-Logs (Druckjobs, Spulen-Historie).
+# Teilstring-Suche wie bisher (ILIKE '%begriff%'), aber über einen Index:
+#   - Postgres: pg_trgm-GIN-Index auf den zusammengefügten Suchspalten; ILIKE auf genau diesem
+#     Ausdruck nutzt den Index.
+#   - SQLite:   FTS5-Schattentabelle mit trigram-Tokenizer (external content), per Trigger bei jedem
+#     INSERT/UPDATE/DELETE der Log-Tabelle mitgeführt.
+# Ist keins davon verfügbar (fehlende Rechte für CREATE EXTENSION, SQLite ohne FTS5) oder der Begriff
+# kürzer als ein Trigramm, bleibt es beim ILIKE über die einzelnen Spalten.
+# ----------------------------
+
+SEARCH_COLUMNS: dict[Any, tuple[str, ...]] = {
+    PrinterJobHistory: ("job_name", "printer_name", "printer_serial"),
+    FilamentSpuleHistorie: ("typ_name", "material", "farbe"),
+}
+
+_MIN_INDEXED_LENGTH = 3
+
+_available: dict[str, bool] = {}
+_available_lock = threading.Lock()
+
+
+def _table(model: Any) -> str:
+    return model.__tablename__
+
+
+def _fts_table(model: Any) -> str:
+    return f"{_table(model)}_fts"
+
+
+def _trgm_index(model: Any) -> str:
+    return f"ix_{_table(model)}_search_trgm"
+
+
+def _pg_expression(model: Any) -> str:
+    return " || ' | ' || ".join(f"coalesce({column}, '')" for column in SEARCH_COLUMNS[model])
+
+
+def _autocommit(conn: Connection) -> bool:
+    return conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+
+def _install_postgres(conn: Connection) -> None:
+    # Im Autocommit (Migrationsschritt) CONCURRENTLY: die Log-Tabellen bleiben beschreibbar,
+    # während der Index gebaut wird. Innerhalb einer Transaktion geht nur das normale CREATE INDEX.
+    concurrently = _autocommit(conn)
+    try:
+        if concurrently:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        else:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception as exc:
+        print(f"[DB] pg_trgm nicht verfügbar – Log-Suche bleibt bei ILIKE: {exc}")
+        return
+    keyword = "CONCURRENTLY " if concurrently else ""
+    for model in SEARCH_COLUMNS:
+        if concurrently:
+            # Ein abgebrochenes CREATE INDEX CONCURRENTLY hinterlässt einen ungültigen Index,
+            # den IF NOT EXISTS sonst stehen ließe
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": _trgm_index(model)}).first()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {_trgm_index(model)}"))
+        conn.execute(text(
+            f"CREATE INDEX {keyword}IF NOT EXISTS {_trgm_index(model)} ON {_table(model)} "
+            f"USING gin (({_pg_expression(model)}) gin_trgm_ops)"
+        ))
+
+
+def _install_sqlite(conn: Connection) -> None:
+    for model in SEARCH_COLUMNS:
+        table = _table(model)
+        fts = _fts_table(model)
+        columns = SEARCH_COLUMNS[model]
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        try:
+            with conn.begin_nested():
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"{column_list}, content='{table}', content_rowid='id', tokenize='trigram')"
+                ))
+        except Exception as exc:
+            print(f"[DB] FTS5/trigram nicht verfügbar – Log-Suche bleibt bei ILIKE: {exc}")
+            return
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END"
+        ))
+        # Bestehende Zeilen einmalig übernehmen
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def install(conn: Connection) -> None:
+    """Legt Suchindex bzw. FTS-Tabellen an (Migrationsschritt)."""
+    if conn.dialect.name == "postgresql":
+        _install_postgres(conn)
+    elif conn.dialect.name == "sqlite":
+        _install_sqlite(conn)
+    with _available_lock:
+        _available.clear()
+
+
+def _index_available(db: Session, model: Any) -> bool:
+    dialect = db.get_bind().dialect.name
+    key = f"{dialect}:{_table(model)}"
+    with _available_lock:
+        if key in _available:
+            return _available[key]
+    if dialect == "postgresql":
+        found = db.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {"name": _trgm_index(model)}).first()
+    elif dialect == "sqlite":
+        found = db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": _fts_table(model)}).first()
+    else:
+        found = None
+    with _available_lock:
+        _available[key] = found is not None
+    return found is not None
+
+
+def search_filter(db: Session, model: Any, term: str):
+    """Filter-Ausdruck für `term` über die Suchspalten von `model` (indexgestützt, falls möglich)."""
+    columns = SEARCH_COLUMNS[model]
+    pattern = f"%{term}%"
+    if len(term) >= _MIN_INDEXED_LENGTH and _index_available(db, model):
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            return literal_column(f"({_pg_expression(model)})").ilike(pattern)
+        if dialect == "sqlite":
+            phrase = '"' + term.replace('"', '""') + '"'
+            return model.id.in_(
+                text(f"SELECT rowid FROM {_fts_table(model)} WHERE {_fts_table(model)} MATCH :phrase")
+                .bindparams(phrase=phrase)
+                .columns(column("rowid", Integer))
+            )
+    return or_(*[getattr(model, column).ilike(pattern) for column in columns])
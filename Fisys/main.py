@@ -1,14 +1,16 @@
 from contextlib import asynccontextmanager
 import os
 import string
+import threading
 from datetime import datetime, timezone
 from fastapi.responses import HTMLResponse
-from sqlalchemy import func, or_
-from db import SessionLocal, init_db
+from sqlalchemy import func, or_, select
+from db import FisysSession, SessionLocal, async_write_lane, engine, get_async_db, init_db, pool_stats, DATABASE_URL
 from models import (
     FilamentTyp,
     FilamentSpule,
     FilamentVerbrauch,
+    VerbrauchDaily,
     FilamentSpuleHistorie,
     PrinterJobHistory,
     User,
@@ -17,16 +19,28 @@ from models import (
     DiscordBotConfig,
 )
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Response, BackgroundTasks, Request, Query
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse
 from qrcode_utils import generate_qrcode_for_spule, delete_qrcode_for_spule
 import shutil
 import requests
-from auth import router as auth_router, serializer, COOKIE_MAX_AGE
+from auth import router as auth_router, resolve_principal
 from printer_service import start_printer_service, stop_printer_service
+from cluster import create_backend
+from work_queue import WorkQueue
+import discord_outbox
+import log_search
+from presence import presence_tracker
+from user_cache import Principal, principal_cache
+from inventory_revision import inventory_revision
+from response_cache import ResponseCache
+import stock_levels
+import verbrauch_rollup
+from pagination import TotalCache, keyset_page
 from models import Printer, PrinterCreate, PrinterUpdate, PrinterRead
 
 def get_db():
@@ -45,23 +59,19 @@ async def lifespan(app: FastAPI):
     global APP_EVENT_LOOP
     APP_EVENT_LOOP = _asyncio.get_running_loop()
     
-    # Aus der Datenbank konfigurierte Drucker laden und Services starten
-    def _start_selected_printers():
-        db = SessionLocal()
-        try:
-            for p in db.query(Printer).filter(Printer.show_on_dashboard == True).all():
-                start_printer_service(
-                    ip=p.ip,
-                    serial=p.serial,
-                    access_code=p.access_token,
-                    on_push=push_to_dashboard,
-                    interval_seconds=15,
-                    name=p.name,
-                )
-        finally:
-            db.close()
-
-    _start_selected_printers()
+    background_jobs.start()
+    discord_outbox.outbox_worker.start()
+    presence_tracker.start()
+
+    # Leader-Wahl: nur ein Worker hält die Drucker-Verbindungen. Der Leader startet die
+    # Services aus der Datenbank (siehe _on_cluster_leadership), alle anderen Worker
+    # bekommen Snapshots und Events über den Cluster-Kanal.
+    cluster_backend.start(
+        on_message=_on_cluster_message,
+        on_leadership=_on_cluster_leadership,
+        on_connected=_on_cluster_connected,
+        on_gap=_resync_cluster_caches,
+    )
 
     # --- Initialen Admin-Token generieren, falls keine Benutzer vorhanden ---
     from models import User, AuthToken
@@ -87,18 +97,15 @@ async def lifespan(app: FastAPI):
         global SHUTTING_DOWN
         SHUTTING_DOWN = True
         try:
-            for ws in list(dashboard_connections):
-                try:
-                    await ws.close()
-                except Exception:
-                    pass
-                try:
-                    dashboard_connections.remove(ws)
-                except ValueError:
-                    pass
+            await dashboard_broadcaster.close_all()
         except Exception:
             pass
+        cluster_backend.stop()
         stop_printer_service()
+        # Laufende Job-Abschlüsse/Benachrichtigungen noch abarbeiten lassen
+        background_jobs.stop(timeout=BACKGROUND_SHUTDOWN_TIMEOUT)
+        discord_outbox.outbox_worker.stop()
+        presence_tracker.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -110,11 +117,42 @@ app.include_router(auth_router)
 APP_EVENT_LOOP = None  # wird im lifespan gesetzt
 SHUTTING_DOWN = False  # verhindert neue Pushes beim Shutdown
 
+# Job-Persistenz und Discord-Versand laufen in einem eigenen, begrenzten Worker-Pool,
+# damit ein langsamer DB-Commit oder Discord-Aufruf den Status-Stream eines Druckers nicht blockiert
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+BACKGROUND_QUEUE_SIZE = int(os.getenv("BACKGROUND_QUEUE_SIZE", "500"))
+BACKGROUND_SHUTDOWN_TIMEOUT = float(os.getenv("BACKGROUND_SHUTDOWN_TIMEOUT", "10"))
+background_jobs = WorkQueue("Background", workers=BACKGROUND_WORKERS, maxsize=BACKGROUND_QUEUE_SIZE)
+
 # --- WebSocket Dashboard Support ---
 from fastapi import WebSocket, WebSocketDisconnect
 import asyncio
-
-dashboard_connections: list[WebSocket] = []
+from dashboard_broadcast import DashboardBroadcaster
+from dashboard_snapshot import DashboardSnapshot, TableChanges
+
+dashboard_broadcaster = DashboardBroadcaster()
+cluster_backend = create_backend(DATABASE_URL)
+dashboard_snapshot = DashboardSnapshot(SessionLocal)
+# Commits auf diesem Worker invalidieren direkt, die anderen Worker per Cluster-Kanal
+dashboard_snapshot.track(
+    FisysSession,
+    on_change=lambda sections: cluster_backend.publish({"kind": "dashboard_snapshot", "sections": sorted(sections)}),
+)
+principal_cache.track(
+    FisysSession,
+    on_change=lambda usernames: cluster_backend.publish({"kind": "principal_cache", "usernames": sorted(usernames)}),
+)
+inventory_revision.track(FisysSession, on_change=lambda: cluster_backend.publish({"kind": "inventory_revision"}))
+# Kodierte JSON-Antworten von /typs/ und /spulen_mit_typen/
+CATALOG_TABLES = frozenset({"filament_typ", "filament_spule"})
+catalog_cache = ResponseCache(CATALOG_TABLES)
+catalog_cache.track(
+    FisysSession,
+    on_change=lambda tables: cluster_backend.publish({"kind": "catalog_cache", "tables": sorted(tables)}),
+)
+# Verpasste Cluster-Nachrichten: der DB-Zähler verrät fremde Bestandsänderungen spätestens nach
+# INVENTORY_REVISION_CHECK_SECONDS, dann auch den Katalog-Cache verwerfen
+inventory_revision.watch(engine, on_stale=catalog_cache.invalidate)
 LATEST_PRINTER_STATUSES: dict[str, dict] = {}
 CURRENT_PRINTER_JOBS: dict[str, dict] = {}
 PRINTER_NAME_CACHE: dict[str, Optional[str]] = {}
@@ -181,7 +219,39 @@ def _finalize_printer_job(serial: str, entry: dict, status: str, finished_at: da
     finally:
         session.close()
 
-    _process_discord_notifications(serial, printer_name, job_name_value, status)
+    if not background_jobs.submit(_process_discord_notifications, serial, printer_name, job_name_value, status):
+        # Queue voll: Abos sonst bis zum nächsten Job "pending" (falscher Job-Name/Status).
+        # _finalize_printer_job läuft nie auf einem Event-Loop (siehe _run_overflow), direkt ausführen
+        _process_discord_notifications(serial, printer_name, job_name_value, status)
+
+
+def _run_overflow(fn, *args) -> None:
+    """Arbeit, die trotz voller background_jobs-Queue nicht verloren gehen darf.
+
+    Im Sender-Thread (Betriebsart "threads") direkt; auf einem Event-Loop (PrinterHub im
+    asyncio-Modus, App-Loop) im Executor – ein DB-Commit würde sonst alle Drucker aufhalten.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        fn(*args)
+        return
+
+    def _logged() -> None:
+        try:
+            fn(*args)
+        except Exception as exc:
+            print(f"[Background] Überlauf-Auftrag {getattr(fn, '__name__', fn)} fehlgeschlagen: {exc}")
+
+    loop.run_in_executor(None, _logged)
+
+
+def _enqueue_job_finalization(serial: str, entry: dict, status: str, finished_at: datetime) -> None:
+    # Eintrag kopieren: CURRENT_PRINTER_JOBS wird direkt danach vom Sender-Thread weiter verändert
+    entry = dict(entry)
+    if not background_jobs.submit(_finalize_printer_job, serial, entry, status, finished_at):
+        # Queue voll: der Verlauf darf nicht verloren gehen
+        _run_overflow(_finalize_printer_job, serial, entry, status, finished_at)
 
 
 def _track_printer_job(payload: dict) -> None:
@@ -207,7 +277,7 @@ def _track_printer_job(payload: dict) -> None:
         if is_printing:
             if entry:
                 if job_name and entry.get('job_name') != job_name:
-                    _finalize_printer_job(serial, entry, 'abgebrochen', now)
+                    _enqueue_job_finalization(serial, entry, 'abgebrochen', now)
                     CURRENT_PRINTER_JOBS.pop(serial, None)
                     entry = None
             if not entry:
@@ -240,7 +310,7 @@ def _track_printer_job(payload: dict) -> None:
         entry['last_update'] = now
 
         if status:
-            _finalize_printer_job(serial, entry, status, now)
+            _enqueue_job_finalization(serial, entry, status, now)
             CURRENT_PRINTER_JOBS.pop(serial, None)
     except Exception as exc:
         print(f"[PrinterJob] Tracking-Fehler: {exc}")
@@ -258,11 +328,12 @@ def push_to_dashboard(payload: dict):
             LATEST_PRINTER_STATUSES[serial] = payload
         else:
             _track_printer_job(payload)
-        # Wenn wir im Event-Loop-Thread sind, direkt Task erstellen
+        # Wenn wir im Event-Loop-Thread der App sind, direkt Task erstellen
+        # (der PrinterHub hat einen eigenen Loop – von dort geht es über run_coroutine_threadsafe)
         import asyncio as _asyncio
         try:
             loop = _asyncio.get_running_loop()
-            if loop.is_running():
+            if loop.is_running() and loop is APP_EVENT_LOOP:
                 loop.create_task(notify_dashboard(payload))
                 return
         except RuntimeError:
@@ -270,7 +341,6 @@ def push_to_dashboard(payload: dict):
             pass
 
         # Aus Fremd-Thread: run_coroutine_threadsafe auf den gemerkten Loop
-        global APP_EVENT_LOOP
         if APP_EVENT_LOOP:
             _asyncio.run_coroutine_threadsafe(notify_dashboard(payload), APP_EVENT_LOOP)
         else:
@@ -282,29 +352,104 @@ def push_to_dashboard(payload: dict):
 async def websocket_dashboard(ws: WebSocket):
     await ws.accept()
     print("[WS] Client connected")
-    dashboard_connections.append(ws)
+    dashboard_broadcaster.add(ws)
     try:
         while True:
-            await asyncio.sleep(10)  # Verbindung offen halten
-    except (WebSocketDisconnect, asyncio.CancelledError):
+            # Lesen hält die Verbindung offen, erkennt Abbrüche sofort und nimmt Topic-Abos entgegen
+            dashboard_broadcaster.handle_client_message(ws, await ws.receive_text())
+    except (WebSocketDisconnect, asyncio.CancelledError, RuntimeError):
         print("[WS] Client disconnected")
-        if ws in dashboard_connections:
-            dashboard_connections.remove(ws)
+    finally:
+        await dashboard_broadcaster.remove(ws)
 
 async def notify_dashboard(data: dict):
-    if not dashboard_connections:
+    # Nur einreihen – gesendet wird von den Writer-Tasks je Client; andere Worker per Cluster-Kanal
+    dashboard_broadcaster.publish(data)
+    cluster_backend.publish({"kind": "dashboard", "data": data})
+
+
+# ---- Cluster (mehrere Worker) ----
+def _apply_shared_printer_state(data: dict) -> None:
+    """Hält LATEST_PRINTER_STATUSES auf Nicht-Leader-Workern aktuell."""
+    if data.get("event") == "printers_selected":
+        selected_serials = {p.get("serial") for p in data.get("printers") or []}
+        for serial in list(LATEST_PRINTER_STATUSES.keys()):
+            if serial not in selected_serials:
+                LATEST_PRINTER_STATUSES.pop(serial, None)
+        PRINTER_NAME_CACHE.clear()
         return
-    for conn in list(dashboard_connections):
-        try:
-            await conn.send_json(data)
-        except Exception:
-            pass
+    serial = data.get("serial") or data.get("printer_serial")
+    if serial and not data.get("event"):
+        LATEST_PRINTER_STATUSES[serial] = data
+
+
+def _on_cluster_message(message: dict) -> None:
+    # Läuft im Listener-Thread des Cluster-Backends
+    kind = message.get("kind")
+    if kind == "dashboard":
+        data = message.get("data") or {}
+        _apply_shared_printer_state(data)
+        if APP_EVENT_LOOP and not SHUTTING_DOWN:
+            APP_EVENT_LOOP.call_soon_threadsafe(dashboard_broadcaster.publish, data)
+    elif kind == "dashboard_snapshot":
+        dashboard_snapshot.invalidate(message.get("sections"))
+    elif kind == "principal_cache":
+        principal_cache.invalidate(message.get("usernames"))
+    elif kind == "inventory_revision":
+        inventory_revision.bump()
+    elif kind == "catalog_cache":
+        catalog_cache.invalidate(message.get("tables"))
+    elif kind == "reload_printers" and cluster_backend.is_leader:
+        _reload_printers_in_background()
+    elif kind == "sync_request" and cluster_backend.is_leader:
+        for payload in list(LATEST_PRINTER_STATUSES.values()):
+            cluster_backend.publish({"kind": "dashboard", "data": payload})
+
+
+def _reload_printers_in_background() -> None:
+    # Drucker-Neustart blockiert (MQTT-Verbindungen, DB): nicht im Listener-Thread ausführen
+    def _reload_if_leader() -> None:
+        if cluster_backend.is_leader:
+            reload_dashboard_printers()
+
+    if not background_jobs.submit(_reload_if_leader):
+        threading.Thread(target=_reload_if_leader, name="PrinterReload", daemon=True).start()
+
+
+def _on_cluster_leadership(is_leader: bool) -> None:
+    if is_leader:
+        _reload_printers_in_background()
+    else:
+        stop_printer_service()
+        CURRENT_PRINTER_JOBS.clear()
+
+
+def _resync_cluster_caches() -> None:
+    # Cluster-Nachrichten können verloren gegangen sein: alles verwerfen, was sonst nur per
+    # Nachricht eines anderen Workers invalidiert wird (Revision/ETag, Katalog, Principals, Dashboard)
+    inventory_revision.bump()
+    catalog_cache.invalidate()
+    principal_cache.invalidate()
+    dashboard_snapshot.invalidate()
+
+
+def _on_cluster_connected() -> None:
+    # Während der Verbindungspause verpasste Invalidierungen nachholen,
+    # fehlende Drucker-Snapshots beim Leader anfragen
+    _resync_cluster_caches()
+    if not cluster_backend.is_leader:
+        cluster_backend.publish({"kind": "sync_request"})
 
 
 # ---- Printer Verwaltung (Server-seitig) ----
 def reload_dashboard_printers():
     """Stoppt alle laufenden Drucker-Services und startet sie entsprechend der DB neu."""
+    if not cluster_backend.is_leader:
+        # Die Drucker-Verbindungen gehören dem Leader-Worker
+        cluster_backend.publish({"kind": "reload_printers"})
+        return
     stop_printer_service()
+    PRINTER_NAME_CACHE.clear()
     db = SessionLocal()
     try:
         selected = db.query(Printer).filter(Printer.show_on_dashboard == True).all()
@@ -315,7 +460,6 @@ def reload_dashboard_printers():
                 serial=p.serial,
                 access_code=p.access_token,
                 on_push=push_to_dashboard,
-                interval_seconds=15,
                 name=p.name,
             )
         # Nicht mehr ausgewählte Stati verwerfen, damit Initial-Fetch sie nicht zurückbringt
@@ -353,6 +497,30 @@ async def debug_ws_text():
     await notify_dashboard({"event": "debug", "message": "Hello from server"})
     return {"ok": True}
 
+# --- DEBUG: Füllstand der Hintergrund-Queue (Betriebsdaten: nur Admins/Mods) ---
+@app.get("/_debug/work-queue")
+def debug_work_queue(request: Request, db: Session = Depends(get_db)):
+    require_admin_or_mod(request, db)
+    return background_jobs.stats()
+
+# --- DEBUG: Zustand der Discord-Outbox ---
+@app.get("/_debug/discord-outbox")
+def debug_discord_outbox(request: Request, db: Session = Depends(get_db)):
+    require_admin_or_mod(request, db)
+    return discord_outbox.outbox_worker.stats()
+
+# --- DEBUG: Auslastung des DB-Connection-Pools ---
+@app.get("/_debug/db-pool")
+def debug_db_pool(request: Request, db: Session = Depends(get_db)):
+    require_admin_or_mod(request, db)
+    return pool_stats()
+
+
+@app.get("/_debug/response-cache")
+def debug_response_cache(request: Request, db: Session = Depends(get_db)):
+    require_admin_or_mod(request, db)
+    return catalog_cache.stats()
+
 # API endpoint: Get the latest printer status snapshots (all)
 @app.get("/api/printer_status_all", response_class=JSONResponse)
 def get_printer_status_all():
@@ -401,7 +569,7 @@ def api_admin_users(
             "username": u.username,
             "rolle": u.rolle,
             "created_at": u.created_at.isoformat() if u.created_at else None,
-            "last_seen": u.last_seen.isoformat() if u.last_seen else None,
+            "last_seen": last_seen.isoformat() if (last_seen := presence_tracker.last_seen(u)) else None,
             "discord_id": u.discord_id,
         }
         for u in users
@@ -409,6 +577,11 @@ def api_admin_users(
     return {"total": total, "items": items}
 
 
+# Admin-Logs: Keyset-Pagination über cursor (next_cursor/prev_cursor aus der Antwort),
+# total ist ein gecachter Näherungswert (siehe pagination.py)
+admin_log_totals = TotalCache()
+
+
 @app.get("/api/admin/logs/printer_jobs", response_class=JSONResponse)
 def api_admin_printer_jobs(
     request: Request,
@@ -418,6 +591,8 @@ def api_admin_printer_jobs(
     serial: Optional[str] = Query(default=None, max_length=64),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(default=None, max_length=512),
+    include_total: bool = Query(default=True),
     date_from: Optional[str] = Query(default=None),
     date_to: Optional[str] = Query(default=None),
 ):
@@ -426,14 +601,7 @@ def api_admin_printer_jobs(
     query = db.query(PrinterJobHistory)
     if search:
         cleaned = search.strip()
-        pattern = f"%{cleaned}%"
-        query = query.filter(
-            or_(
-                PrinterJobHistory.job_name.ilike(pattern),
-                PrinterJobHistory.printer_name.ilike(pattern),
-                PrinterJobHistory.printer_serial.ilike(pattern),
-            )
-        )
+        query = query.filter(log_search.search_filter(db, PrinterJobHistory, cleaned))
     if status:
         query = query.filter(PrinterJobHistory.status.ilike(status.strip()))
     if serial:
@@ -446,14 +614,15 @@ def api_admin_printer_jobs(
     if end_dt:
         query = query.filter(PrinterJobHistory.created_at <= end_dt)
 
-    total = query.count()
-    entries = (
-        query
-        .order_by(PrinterJobHistory.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+    total = None
+    if include_total:
+        total = admin_log_totals.get(("printer_jobs", *(search, status, serial, date_from, date_to)), query.count)
+    next_cursor = prev_cursor = None
+    if offset and not cursor:
+        # Alte Offset-Pagination bleibt für bestehende Aufrufer erhalten
+        entries = query.order_by(PrinterJobHistory.created_at.desc(), PrinterJobHistory.id.desc()).offset(offset).limit(limit).all()
+    else:
+        entries, next_cursor, prev_cursor = keyset_page(query, PrinterJobHistory.created_at, PrinterJobHistory.id, limit, cursor)
 
     items = [
         {
@@ -469,7 +638,7 @@ def api_admin_printer_jobs(
         }
         for job in entries
     ]
-    return {"total": total, "items": items}
+    return {"total": total, "items": items, "next_cursor": next_cursor, "prev_cursor": prev_cursor}
 
 
 @app.get("/api/admin/logs/spools", response_class=JSONResponse)
@@ -480,6 +649,8 @@ def api_admin_spool_logs(
     action: Optional[str] = Query(default=None, max_length=64),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(default=None, max_length=512),
+    include_total: bool = Query(default=True),
     date_from: Optional[str] = Query(default=None),
     date_to: Optional[str] = Query(default=None),
 ):
@@ -488,12 +659,7 @@ def api_admin_spool_logs(
     query = db.query(FilamentSpuleHistorie)
     if search:
         cleaned = search.strip()
-        pattern = f"%{cleaned}%"
-        filters = [
-            FilamentSpuleHistorie.typ_name.ilike(pattern),
-            FilamentSpuleHistorie.material.ilike(pattern),
-            FilamentSpuleHistorie.farbe.ilike(pattern),
-        ]
+        filters = [log_search.search_filter(db, FilamentSpuleHistorie, cleaned)]
         if cleaned.isdigit():
             filters.append(FilamentSpuleHistorie.spulen_id == int(cleaned))
         query = query.filter(or_(*filters))
@@ -507,14 +673,15 @@ def api_admin_spool_logs(
     if end_dt:
         query = query.filter(FilamentSpuleHistorie.created_at <= end_dt)
 
-    total = query.count()
-    entries = (
-        query
-        .order_by(FilamentSpuleHistorie.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+    total = None
+    if include_total:
+        total = admin_log_totals.get(("spools", *(search, action, date_from, date_to)), query.count)
+    next_cursor = prev_cursor = None
+    if offset and not cursor:
+        # Alte Offset-Pagination bleibt für bestehende Aufrufer erhalten
+        entries = query.order_by(FilamentSpuleHistorie.created_at.desc(), FilamentSpuleHistorie.id.desc()).offset(offset).limit(limit).all()
+    else:
+        entries, next_cursor, prev_cursor = keyset_page(query, FilamentSpuleHistorie.created_at, FilamentSpuleHistorie.id, limit, cursor)
 
     items = [
         {
@@ -533,7 +700,7 @@ def api_admin_spool_logs(
         }
         for log in entries
     ]
-    return {"total": total, "items": items}
+    return {"total": total, "items": items, "next_cursor": next_cursor, "prev_cursor": prev_cursor}
 
 
 @app.get("/api/admin/logs/verbrauch", response_class=JSONResponse)
@@ -544,6 +711,8 @@ def api_admin_consumption_logs(
     search: Optional[str] = Query(default=None, max_length=64),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(default=None, max_length=512),
+    include_total: bool = Query(default=True),
     date_from: Optional[str] = Query(default=None),
     date_to: Optional[str] = Query(default=None),
 ):
@@ -568,14 +737,15 @@ def api_admin_consumption_logs(
     if end_dt:
         query = query.filter(FilamentVerbrauch.datum <= end_dt)
 
-    total = query.count()
-    entries = (
-        query
-        .order_by(FilamentVerbrauch.datum.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+    total = None
+    if include_total:
+        total = admin_log_totals.get(("verbrauch", *(typ_id, search, date_from, date_to)), query.count)
+    next_cursor = prev_cursor = None
+    if offset and not cursor:
+        # Alte Offset-Pagination bleibt für bestehende Aufrufer erhalten
+        entries = query.order_by(FilamentVerbrauch.datum.desc(), FilamentVerbrauch.id.desc()).offset(offset).limit(limit).all()
+    else:
+        entries, next_cursor, prev_cursor = keyset_page(query, FilamentVerbrauch.datum, FilamentVerbrauch.id, limit, cursor)
 
     items = [
         {
@@ -589,7 +759,7 @@ def api_admin_consumption_logs(
         }
         for entry in entries
     ]
-    return {"total": total, "items": items}
+    return {"total": total, "items": items, "next_cursor": next_cursor, "prev_cursor": prev_cursor}
 
 # Statische Dateien (HTML, CSS, JS)
 static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "html"))
@@ -629,26 +799,11 @@ def serve_admin_html():
 
 # Authentication helpers
 
-def get_current_user(request: Request, db: Session) -> User:
-    raw_cookie = request.cookies.get("benutzer")
-    if not raw_cookie:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-    try:
-        data = serializer.loads(raw_cookie, max_age=COOKIE_MAX_AGE)
-    except Exception:
-        raise HTTPException(status_code=401, detail="Session ungültig oder abgelaufen")
-    username = data.get('username') if isinstance(data, dict) else None
-    if not username:
-        raise HTTPException(status_code=401, detail="Session ungültig")
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Benutzer nicht gefunden")
-    user.last_seen = datetime.now(timezone.utc)
-    db.commit()
-    return user
+def get_current_user(request: Request, db: Session) -> Principal:
+    return resolve_principal(request, db)
 
 
-def require_admin_or_mod(request: Request, db: Session) -> User:
+def require_admin_or_mod(request: Request, db: Session) -> Principal:
     """Stellt sicher, dass der aktuelle Benutzer mindestens Mod-Rechte hat."""
     user = get_current_user(request, db)
     if user.rolle not in ("admin", "mod"):
@@ -668,11 +823,6 @@ def _parse_iso_datetime(value: Optional[str]) -> Optional[datetime]:
         return None
 
 
-class _SafeFormatDict(dict):
-    def __missing__(self, key):
-        return ""
-
-
 def _ensure_discord_config(db: Session) -> DiscordBotConfig:
     config = db.query(DiscordBotConfig).filter(DiscordBotConfig.id == 1).first()
     if not config:
@@ -695,80 +845,6 @@ def _ensure_discord_config(db: Session) -> DiscordBotConfig:
     return config
 
 
-def _format_discord_message(template: str, context: dict) -> str:
-    safe_context = {k: "" if v is None else str(v) for k, v in context.items()}
-    try:
-        return template.format_map(_SafeFormatDict(safe_context))
-    except Exception:
-        return template
-
-
-
-def _dispatch_discord_message(config: DiscordBotConfig, message: str, user: Optional[User] = None) -> tuple[bool, Optional[str]]:
-    if not config.enabled:
-        return False, "Bot deaktiviert"
-
-    if config.use_dm:
-        if not config.bot_token:
-            return False, "Bot-Token erforderlich, um Direktnachrichten zu senden"
-        if not user or not user.discord_id or not str(user.discord_id).isdigit():
-            return False, "Discord-ID fehlt oder ist ungültig"
-        headers = {"Authorization": f"Bot {config.bot_token}", "Content-Type": "application/json"}
-        try:
-            dm_response = requests.post(
-                "https://discord.com/api/v10/users/@me/channels",
-                headers=headers,
-                json={"recipient_id": str(user.discord_id)},
-                timeout=10,
-            )
-        except Exception as exc:
-            return False, str(exc)
-        if not (200 <= dm_response.status_code < 300):
-            return False, f"DM-Channel-Fehler: HTTP {dm_response.status_code}: {dm_response.text[:200]}"
-        channel_payload = dm_response.json() if dm_response.content else {}
-        channel_id = channel_payload.get("id")
-        if not channel_id:
-            return False, "DM-Channel konnte nicht ermittelt werden"
-        try:
-            message_response = requests.post(
-                f"https://discord.com/api/v10/channels/{channel_id}/messages",
-                headers=headers,
-                json={"content": message},
-                timeout=10,
-            )
-        except Exception as exc:
-            return False, str(exc)
-        if 200 <= message_response.status_code < 300:
-            return True, None
-        return False, f"HTTP {message_response.status_code}: {message_response.text[:200]}"
-
-    if config.webhook_url:
-        try:
-            response = requests.post(
-                config.webhook_url,
-                json={"content": message},
-                timeout=10,
-            )
-        except Exception as exc:
-            return False, str(exc)
-        if 200 <= response.status_code < 300:
-            return True, None
-        return False, f"HTTP {response.status_code}: {response.text[:200]}"
-
-    if config.channel_id and config.bot_token:
-        url = f"https://discord.com/api/v10/channels/{config.channel_id}/messages"
-        headers = {"Authorization": f"Bot {config.bot_token}", "Content-Type": "application/json"}
-        try:
-            response = requests.post(url, json={"content": message}, headers=headers, timeout=10)
-        except Exception as exc:
-            return False, str(exc)
-        if 200 <= response.status_code < 300:
-            return True, None
-        return False, f"HTTP {response.status_code}: {response.text[:200]}"
-
-    return False, "Keine gültige Discord-Konfiguration gefunden"
-
-
 
 def _process_discord_notifications(serial: str, printer_name: Optional[str], job_name: Optional[str], status: str) -> None:
     normalized = (status or '').lower()
@@ -805,49 +881,55 @@ def _process_discord_notifications(serial: str, printer_name: Optional[str], job
 
         template_success = config.message_template or DEFAULT_DISCORD_MESSAGE_TEMPLATE
         template_failure = getattr(config, 'failure_message_template', None) or DEFAULT_DISCORD_FAILURE_TEMPLATE
-        now = _utcnow()
+        template_to_use = template_failure if is_failed else template_success
+        outbox_reason = failure_reason if is_failed else None
+        base_context = {
+            'printer_name': printer_name or serial,
+            'printer_serial': serial,
+            'job_name': job_name or 'Unbekannter Job',
+            'status': status,
+            'failure_reason': failure_reason or '',
+        }
 
+        recipients = []
         for sub in pending:
             user = sub.user
             if not user or not user.discord_id:
                 sub.status = 'failed'
                 sub.last_error = 'Discord-ID fehlt'
                 continue
-
-            mention = f"<@{user.discord_id}> " if user.discord_id and user.discord_id.isdigit() else ""
-            context = {
-                'username': user.username,
-                'printer_name': printer_name or serial,
-                'printer_serial': serial,
-                'job_name': job_name or 'Unbekannter Job',
-                'status': status,
-                'discord_id': user.discord_id,
-                'discord_mention': mention,
-                'failure_reason': failure_reason or '',
-            }
-            template_to_use = template_failure if is_failed else template_success
-            message = _format_discord_message(template_to_use, context)
-            success, error = _dispatch_discord_message(config, message, user=user)
-
-            if success:
-                sub.notified_at = now
-                if is_failed:
-                    base_reason = failure_reason or 'Druck fehlgeschlagen.'
-                    sub.status = 'failed'
-                    sub.last_error = f"{base_reason} Nachricht gesendet."
-                else:
-                    sub.status = 'sent'
-                    sub.last_error = None
-            else:
-                sub.status = 'failed'
-                if is_failed:
-                    base_reason = failure_reason or 'Druck fehlgeschlagen.'
-                    sub.last_error = f"{base_reason} {error}".strip() if error else base_reason
-                else:
-                    sub.last_error = error or 'Unbekannter Fehler'
+            recipients.append((sub, user))
+
+        # Zustellung (inkl. Retry/Backoff) übernimmt der Outbox-Worker
+        if not config.use_dm and discord_outbox.AGGREGATE_CHANNEL_MESSAGES:
+            # Webhook/Channel: eine Sammelnachricht, die alle Abonnenten erwähnt
+            chunk_size = max(1, discord_outbox.AGGREGATE_MAX_MENTIONS)
+            for start in range(0, len(recipients), chunk_size):
+                chunk = recipients[start:start + chunk_size]
+                message = discord_outbox.aggregate_message(template_to_use, base_context, [user for _, user in chunk])
+                discord_outbox.enqueue(
+                    session,
+                    [sub for sub, _ in chunk],
+                    message,
+                    failure_reason=outbox_reason,
+                    template=template_to_use,
+                    context=base_context,
+                )
+        else:
+            for sub, user in recipients:
+                mention = f"<@{user.discord_id}> " if user.discord_id.isdigit() else ""
+                context = {
+                    **base_context,
+                    'username': user.username,
+                    'discord_id': user.discord_id,
+                    'discord_mention': mention,
+                }
+                message = discord_outbox.format_message(template_to_use, context)
+                discord_outbox.enqueue(session, [sub], message, discord_id=user.discord_id, failure_reason=outbox_reason)
         session.commit()
     finally:
         session.close()
+    discord_outbox.outbox_worker.wake()
 
 
 def log_spool_history(db: Session, spule: FilamentSpule, aktion: str, alt: Optional[float] = None, neu: Optional[float] = None) -> None:
@@ -1001,21 +1083,10 @@ class DiscordBotConfigPayload(BaseModel):
     message_template: Optional[str] = Field(default=None, max_length=2000)
     failure_message_template: Optional[str] = Field(default=None, max_length=2000)
 
-def require_roles(request: Request, db: Session, allowed_roles: set[str]) -> User:
+def require_roles(request: Request, db: Session, allowed_roles: set[str]) -> Principal:
     """Stellt sicher, dass der aktuelle Nutzer eine erlaubte Rolle besitzt."""
-    raw_cookie = request.cookies.get("benutzer")
-    username = None
-    if raw_cookie:
-        try:
-            data = serializer.loads(raw_cookie, max_age=COOKIE_MAX_AGE)
-            username = data.get("username")
-        except Exception:
-            username = None
-    if not username:
-        raise HTTPException(status_code=401, detail="Nicht eingeloggt")
-
-    user = db.query(User).filter(User.username == username).first()
-    if not user or user.rolle not in allowed_roles:
+    user = resolve_principal(request, db)
+    if user.rolle not in allowed_roles:
         raise HTTPException(status_code=403, detail="Keine Berechtigung")
     return user
 
@@ -1032,7 +1103,7 @@ def _normalize_printer_serial(db: Session, serial: Optional[str]) -> Optional[st
 
 @app.patch("/api/me/settings")
 def update_user_settings(payload: UserSettingsUpdate, request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+    user = db.get(User, get_current_user(request, db).id)
     raw = (payload.discord_id or "").strip()
     cleaned = None
     if raw:
@@ -1203,6 +1274,8 @@ def delete_discord_subscription(subscription_id: int, request: Request, db: Sess
     sub = db.get(DiscordNotificationSubscription, subscription_id)
     if not sub:
         raise HTTPException(status_code=404, detail="Abonnement nicht gefunden")
+    # Noch nicht zugestellte Nachrichten zu diesem Abo verwerfen (auch Anteile an Sammelnachrichten)
+    discord_outbox.cancel_for_subscription(db, sub)
     db.delete(sub)
     db.commit()
     return Response(status_code=204)
@@ -1210,9 +1283,33 @@ def delete_discord_subscription(subscription_id: int, request: Request, db: Sess
 
 
 
+# Einmal aufgebaut: ein TypeAdapter kompiliert beim Erzeugen das komplette Validierungs-Schema
+_TYPS_ADAPTER = TypeAdapter(List[FilamentTypWithSpulen])
+_SPULEN_ADAPTER = TypeAdapter(List[FilamentSpuleRead])
+
+
+def _encode_json(adapter: TypeAdapter, items) -> bytes:
+    # Gleiche Validierung wie response_model, aber direkt zu JSON-Bytes (für catalog_cache)
+    return adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+
+
+def _catalog_response(endpoint: str, request: Request, response: Response, build) -> Response:
+    body = catalog_cache.get_or_build(endpoint, request.query_params, CATALOG_TABLES, build)
+    headers = {name: response.headers[name] for name in ("etag", "cache-control") if name in response.headers}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/typs/", response_model=List[FilamentTypWithSpulen])
-def read_typs(db: Session = Depends(get_db)):
-    return db.query(FilamentTyp).all()
+def read_typs(request: Request, response: Response, db: Session = Depends(get_db)):
+    if (not_modified := inventory_revision.not_modified(request, response)):
+        return not_modified
+
+    def _build() -> bytes:
+        # Spulen in einer zweiten Abfrage mitladen (statt je Typ einzeln); spule.typ kommt aus der Identity-Map
+        typs = db.query(FilamentTyp).options(selectinload(FilamentTyp.spulen)).all()
+        return _encode_json(_TYPS_ADAPTER, typs)
+
+    return _catalog_response("typs", request, response, _build)
 
 # --- POST-Endpunkt zum Erstellen eines neuen Typs ---
 @app.post("/typs/")
@@ -1234,7 +1331,7 @@ def create_typ(typ: FilamentTypBase, db: Session = Depends(get_db)):
 
 @app.get("/typs/{typ_id}", response_model=FilamentTypWithSpulen)
 def read_typ(typ_id: int, db: Session = Depends(get_db)):
-    typ = db.get(FilamentTyp, typ_id)
+    typ = db.get(FilamentTyp, typ_id, options=[selectinload(FilamentTyp.spulen)])
     if not typ:
         raise HTTPException(status_code=404, detail="Typ not found")
     return typ
@@ -1275,7 +1372,19 @@ def delete_typ(typ_id: int, db: Session = Depends(get_db)):
 
 
 @app.post("/spulen/", response_model=FilamentSpuleRead)
-async def create_spule(spule: FilamentSpuleCreate, db: Session = Depends(get_db)):
+async def create_spule(spule: FilamentSpuleCreate, db: AsyncSession = Depends(get_async_db)):
+    # DB-Arbeit läuft über den Async-Treiber (run_sync), der Event-Loop wartet nicht auf die Datenbank
+    async with async_write_lane(db):
+        result, dashboard_event = await db.run_sync(_create_spule, spule)
+    if isinstance(result, FilamentSpuleRead):
+        generate_qrcode_for_spule(result)
+    if dashboard_event:
+        # WebSocket-Dashboard-Benachrichtigung
+        await notify_dashboard(dashboard_event)
+    return result
+
+
+def _create_spule(db: Session, spule: FilamentSpuleCreate):
     typ = get_or_create_filament_typ(
         db,
         name=spule.name,
@@ -1288,7 +1397,7 @@ async def create_spule(spule: FilamentSpuleCreate, db: Session = Depends(get_db)
 
     if spule.gesamtmenge is None or spule.restmenge is None:
         # Nur Typ wurde erstellt/zurückgegeben
-        return JSONResponse({"detail": f"Nur Typ '{typ.name}' wurde erstellt oder verwendet"}, status_code=201)
+        return JSONResponse({"detail": f"Nur Typ '{typ.name}' wurde erstellt oder verwendet"}, status_code=201), None
 
     is_verpackt = getattr(spule, "verpackt", None)
     assigned_serial: Optional[str] = None
@@ -1319,14 +1428,13 @@ async def create_spule(spule: FilamentSpuleCreate, db: Session = Depends(get_db)
             log_spool_history(db, match, "spule_entpackt", alt=previous_rest, neu=match.restmenge)
             db.commit()
             db.refresh(match)
-            generate_qrcode_for_spule(match)
-            await notify_dashboard({
+            return FilamentSpuleRead.model_validate(match), {
                 "event": "spule_updated",
                 "spule_id": match.spulen_id,
+                "typ_id": match.typ_id,
                 "restmenge": match.restmenge,
                 "gesamtmenge": match.gesamtmenge
-            })
-            return FilamentSpuleRead.model_validate(match)
+            }
 
     # Prüfung: Maximal 4 Spulen im Drucker
     if spule.in_printer:
@@ -1349,22 +1457,27 @@ async def create_spule(spule: FilamentSpuleCreate, db: Session = Depends(get_db)
     log_spool_history(db, new_spule, letzte_aktion, alt=None, neu=new_spule.restmenge)
     db.commit()
     db.refresh(new_spule)
-    generate_qrcode_for_spule(new_spule)
-    # WebSocket-Dashboard-Benachrichtigung
-    await notify_dashboard({"event": "spule_created", "spule_id": new_spule.spulen_id})
-    return FilamentSpuleRead.model_validate(new_spule)
+    return FilamentSpuleRead.model_validate(new_spule), {"event": "spule_created", "spule_id": new_spule.spulen_id, "typ_id": new_spule.typ_id}
 
 @app.get("/spulen/", response_model=List[FilamentSpuleRead])
-def read_spulen(db: Session = Depends(get_db)):
-    return db.query(FilamentSpule).all()
+def read_spulen(request: Request, response: Response, db: Session = Depends(get_db)):
+    if (not_modified := inventory_revision.not_modified(request, response)):
+        return not_modified
+    return db.query(FilamentSpule).options(joinedload(FilamentSpule.typ)).all()
 
 
 # Neuer Endpoint: Alle Spulen mit ihren Typ-Informationen
 
 @app.get("/spulen_mit_typen/", response_model=List[FilamentSpuleRead])
-def read_spulen_mit_typen(db: Session = Depends(get_db)):
-    spulen = db.query(FilamentSpule).options(joinedload(FilamentSpule.typ)).all()
-    return spulen
+def read_spulen_mit_typen(request: Request, response: Response, db: Session = Depends(get_db)):
+    if (not_modified := inventory_revision.not_modified(request, response)):
+        return not_modified
+
+    def _build() -> bytes:
+        spulen = db.query(FilamentSpule).options(joinedload(FilamentSpule.typ)).all()
+        return _encode_json(_SPULEN_ADAPTER, spulen)
+
+    return _catalog_response("spulen_mit_typen", request, response, _build)
 
 @app.get("/spulen/{spulen_id}")
 def read_spule(spulen_id: int, db: Session = Depends(get_db)):
@@ -1384,7 +1497,20 @@ def read_spule(spulen_id: int, db: Session = Depends(get_db)):
 
 
 @app.put("/spulen/{spulen_id}", response_model=FilamentSpuleRead)
-async def update_spule(spulen_id: int, spule_update: FilamentSpuleCreate, db: Session = Depends(get_db)):
+async def update_spule(spulen_id: int, spule_update: FilamentSpuleCreate, db: AsyncSession = Depends(get_async_db)):
+    async with async_write_lane(db):
+        spule = await db.run_sync(_update_spule, spulen_id, spule_update)
+    await notify_dashboard({
+        "event": "spule_updated",
+        "spule_id": spule.spulen_id,
+        "typ_id": spule.typ_id,
+        "restmenge": spule.restmenge,
+        "gesamtmenge": spule.gesamtmenge
+    })
+    return spule
+
+
+def _update_spule(db: Session, spulen_id: int, spule_update: FilamentSpuleCreate) -> FilamentSpuleRead:
     spule = db.get(FilamentSpule, spulen_id)
     if not spule:
         raise HTTPException(status_code=404, detail="Spule not found")
@@ -1449,18 +1575,24 @@ async def update_spule(spulen_id: int, spule_update: FilamentSpuleCreate, db: Se
 
     db.commit()
     db.refresh(spule)
-    # WebSocket-Dashboard-Benachrichtigung
+    return FilamentSpuleRead.model_validate(spule)
+
+
+@app.patch("/spulen/{spulen_id}", response_model=FilamentSpuleRead)
+async def patch_spule(spulen_id: int, update: SpuleUpdate, db: AsyncSession = Depends(get_async_db)):
+    async with async_write_lane(db):
+        spule = await db.run_sync(_patch_spule, spulen_id, update)
     await notify_dashboard({
         "event": "spule_updated",
         "spule_id": spule.spulen_id,
+        "typ_id": spule.typ_id,
         "restmenge": spule.restmenge,
         "gesamtmenge": spule.gesamtmenge
     })
     return spule
 
 
-@app.patch("/spulen/{spulen_id}", response_model=FilamentSpuleRead)
-async def patch_spule(spulen_id: int, update: SpuleUpdate, db: Session = Depends(get_db)):
+def _patch_spule(db: Session, spulen_id: int, update: SpuleUpdate) -> FilamentSpuleRead:
     spule = db.get(FilamentSpule, spulen_id)
     if not spule:
         raise HTTPException(status_code=404, detail="Spule nicht gefunden")
@@ -1517,16 +1649,7 @@ async def patch_spule(spulen_id: int, update: SpuleUpdate, db: Session = Depends
 
     db.commit()
     db.refresh(spule)
-
-    # Dashboard sicher benachrichtigen
-    await notify_dashboard({
-        "event": "spule_updated",
-        "spule_id": spule.spulen_id,
-        "restmenge": spule.restmenge,
-        "gesamtmenge": spule.gesamtmenge
-    })
-
-    return spule
+    return FilamentSpuleRead.model_validate(spule)
 
 @app.delete("/spulen/{spulen_id}")
 def delete_spule_api(
@@ -1547,6 +1670,7 @@ def delete_spule_api(
         db.add(verbrauch_eintrag)
 
     # QR-Code löschen und Spule entfernen
+    typ_id = spule.typ_id
     delete_qrcode_for_spule(spule)
     db.delete(spule)
     db.commit()
@@ -1556,7 +1680,7 @@ def delete_spule_api(
         import asyncio as _asyncio
         if APP_EVENT_LOOP:
             _asyncio.run_coroutine_threadsafe(
-                notify_dashboard({"event": "spule_deleted", "spule_id": spulen_id}),
+                notify_dashboard({"event": "spule_deleted", "spule_id": spulen_id, "typ_id": typ_id}),
                 APP_EVENT_LOOP
             )
     except Exception:
@@ -1672,7 +1796,7 @@ def upload_image(file: UploadFile = File(...), name: str = Form("")):
 
 # Bild zuweisen zu einem Typ nach ID
 @app.patch("/typs/{typ_id}/bild", status_code=204)
-async def assign_image_to_typ(typ_id: int, request: Request, db: Session = Depends(get_db)):
+async def assign_image_to_typ(typ_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
     form = await request.form()
     bild_input = form.get("bildname") or request.query_params.get("bildname")
 
@@ -1684,29 +1808,37 @@ async def assign_image_to_typ(typ_id: int, request: Request, db: Session = Depen
     else:
         bildname = str(bild_input)
 
-    typ = db.get(FilamentTyp, typ_id)
+    typ = await db.get(FilamentTyp, typ_id)
     if not typ:
         raise HTTPException(status_code=404, detail=f"Typ-ID {typ_id} nicht gefunden")
 
     # Andere Typen, die das Bild nutzen → zurücksetzen
-    andere_typs = db.query(FilamentTyp).filter(
+    andere_typs = (await db.scalars(select(FilamentTyp).filter(
         FilamentTyp.bildname == bildname,
         FilamentTyp.id != typ_id
-    ).all()
+    ))).all()
     for anderer in andere_typs:
         anderer.bildname = None
 
     typ.bildname = bildname
     try:
-        db.commit()
+        async with async_write_lane(db):
+            await db.commit()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Fehler beim Aktualisieren: {str(e)}")
     return Response(status_code=204)
 
 
 @app.get("/bilder/")
-def list_images(db: Session = Depends(get_db)):
+def list_images(request: Request, response: Response, db: Session = Depends(get_db)):
     image_dir = os.path.join(static_dir, "assets", "images")
+    # Verzeichnis-mtime mit ins ETag: auch von Hand kopierte/gelöschte Bilder werden erkannt
+    try:
+        dir_mtime = str(os.stat(image_dir).st_mtime_ns)
+    except OSError:
+        dir_mtime = None
+    if (not_modified := inventory_revision.not_modified(request, response, extra=dir_mtime)):
+        return not_modified
     try:
         all_files = [
             f for f in os.listdir(image_dir)
@@ -1888,7 +2020,7 @@ def serve_spulendetails(typ_id: int, spulen_id: int):
 # Neue JSON-API-Route für FilamentTyp-Daten
 @app.get("/api/typ/{typ_id}", response_model=FilamentTypWithSpulen)
 def get_typ_json(typ_id: int, db: Session = Depends(get_db)):
-    typ = db.get(FilamentTyp, typ_id)
+    typ = db.get(FilamentTyp, typ_id, options=[selectinload(FilamentTyp.spulen)])
     if not typ:
         raise HTTPException(status_code=404, detail="Typ nicht gefunden")
     return typ
@@ -1917,32 +2049,7 @@ def get_spule_detail_json(typ_id: int, spulen_id: int, db: Session = Depends(get
 # Neuer API-Endpoint: Leere und fast leere Typen
 @app.get("/fastleere_data", response_class=JSONResponse)
 def get_fastleere_typen(db: Session = Depends(get_db)):
-    result = []
-    typen = db.query(FilamentTyp).all()
-    for typ in typen:
-        spulen = typ.spulen
-        anzahl_spulen = len(spulen)
-        gesamt_restmenge = sum(float(s.restmenge or 0) for s in spulen)
-        if anzahl_spulen == 0:
-            status = "leer"
-        else:
-            if gesamt_restmenge < 800:
-                status = "fastleer"
-            else:
-                continue
-        result.append({
-            "id": typ.id,
-            "name": typ.name,
-            "material": typ.material,
-            "farbe": typ.farbe,
-            "durchmesser": typ.durchmesser,
-            "hersteller": typ.hersteller,
-            "bildname": typ.bildname,
-            "anzahl_spulen": anzahl_spulen,
-            "restmenge": gesamt_restmenge,
-            "status": status
-        })
-    return result
+    return stock_levels.low_stock_types(db, stock_levels.ABSOLUT)
 
 # HTML-Seite: /status zeigt Lagerstatus (leer & fastleer)
 @app.get("/status", response_class=FileResponse)
@@ -2046,82 +2153,36 @@ def get_typ_and_spulen_stats(db: Session = Depends(get_db)):
 
 
 # API-Endpoint: Dashboard-Daten
-@app.get("/api/dashboard-details")
-def get_dashboard_details(db: Session = Depends(get_db)):
-    typ_count = db.query(FilamentTyp).count()
-    spulen_count = db.query(FilamentSpule).count()
-
-    fastleere_typen = 0
-    typen = db.query(FilamentTyp).all()
-    for typ in typen:
-        spulen = typ.spulen
-        if not spulen or sum(s.restmenge for s in spulen) < 800:
-            fastleere_typen += 1
+# Die Abschnitte werden im Speicher gehalten und nur nach passenden Commits neu gebaut (siehe dashboard_snapshot.py)
+def _zaehler_delta(value: dict, changes: dict[str, TableChanges]) -> Optional[dict]:
+    typen = changes.get("filament_typ")
+    spulen = changes.get("filament_spule")
+    if typen and typen.deleted:
+        # Gelöschte Typen können Spulen per Kaskade mitnehmen: lieber neu zählen
+        return None
+    if typen:
+        value["typen"] += len(typen.inserted)
+    if spulen:
+        value["spulen"] += len(spulen.inserted) - spulen.deleted
+    return value
 
-    from datetime import datetime, timedelta
-    # Gesamtverbrauch der letzten 7 Tage aus Verbrauchslog
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    verbrauch_7tage_sum = (
-        db.query(func.sum(FilamentVerbrauch.verbrauch_in_g))
-        .filter(FilamentVerbrauch.datum >= seven_days_ago)
-        .scalar()
-    ) or 0
 
-    # Zuletzt bearbeitete Spulen (nach Historie-Einträgen)
-    letzte_events = (
-        db.query(FilamentSpuleHistorie)
-        .order_by(FilamentSpuleHistorie.created_at.desc())
-        .limit(5)
-        .all()
-    )
-    spulen_liste = [{
-        "spulen_id": s.spulen_id,
-        "typ_name": s.typ_name,
-        "farbe": s.farbe,
-        "material": s.material,
-        "durchmesser": s.durchmesser,
-        "alt_gewicht": s.alt_gewicht,
-        "neu_gewicht": s.neu_gewicht,
-        "created_at": s.created_at,
-        "updated_at": s.created_at,
-        "letzte_aktion": s.aktion,
-        "verpackt": s.verpackt,
-        "in_printer": s.in_printer,
-    } for s in letzte_events]
+@dashboard_snapshot.section("zaehler", tables={"filament_typ", "filament_spule"}, delta=_zaehler_delta)
+def _dashboard_zaehler(db: Session) -> dict:
+    return {
+        "typen": db.query(FilamentTyp).count(),
+        "spulen": db.query(FilamentSpule).count(),
+    }
 
-    job_events = (
-        db.query(PrinterJobHistory)
-        .order_by(PrinterJobHistory.finished_at.desc(), PrinterJobHistory.created_at.desc())
-        .limit(3)
-        .all()
-    )
-    job_historie = [{
-        "job_name": j.job_name,
-        "status": j.status,
-        "printer_serial": j.printer_serial,
-        "printer_name": j.printer_name,
-        "duration_seconds": j.duration_seconds,
-        "started_at": j.started_at,
-        "finished_at": j.finished_at,
-        "created_at": j.created_at,
-    } for j in job_events]
 
-    dashboard_notes = [
-        {
-            "id": note.id,
-            "title": note.title,
-            "message": note.message,
-            "created_at": note.created_at,
-            "author": note.author.username if note.author else None,
-            "author_role": note.author.rolle if note.author else None,
-        }
-        for note in db.query(DashboardNote).order_by(DashboardNote.created_at.desc()).limit(3).all()
-    ]
-    dashboard_note_total = db.query(func.count(DashboardNote.id)).scalar() or 0
+@dashboard_snapshot.section("bestand", tables={"filament_typ", "filament_spule"})
+def _dashboard_bestand(db: Session) -> dict:
+    fastleere_typen = len(stock_levels.low_stock_types(db, stock_levels.ABSOLUT))
 
     # Neu hinzugefügte Spulen (nach Erstellzeit)
     neue_spulen = (
         db.query(FilamentSpule)
+        .options(joinedload(FilamentSpule.typ))
         .order_by(FilamentSpule.created_at.desc())
         .limit(3)
         .all()
@@ -2142,7 +2203,12 @@ def get_dashboard_details(db: Session = Depends(get_db)):
     } for s in neue_spulen]
 
     # Ergänzung: Spulen, die aktuell im Drucker sind
-    im_drucker_spulen = db.query(FilamentSpule).filter(FilamentSpule.in_printer == True).all()
+    im_drucker_spulen = (
+        db.query(FilamentSpule)
+        .options(joinedload(FilamentSpule.typ))
+        .filter(FilamentSpule.in_printer == True)
+        .all()
+    )
     im_drucker_liste = [{
         "spulen_id": s.spulen_id,
         "typ_name": s.typ.name,
@@ -2196,20 +2262,126 @@ def get_dashboard_details(db: Session = Depends(get_db)):
     ]
 
     return {
-        "typen": typ_count,
-        "spulen": spulen_count,
         "fastleer": fastleere_typen,
-        "verbrauch_7tage": int(verbrauch_7tage_sum),
         "im_drucker": im_drucker,
         "im_drucker_spulen": im_drucker_liste,
-        "letzte_spulen": spulen_liste,
         "neue_spulen": neue_spulen_liste,
-        "job_historie": job_historie,
+    }
+
+
+def _verbrauch_delta(value: dict, changes: dict[str, TableChanges]) -> Optional[dict]:
+    from datetime import datetime, timedelta
+    verbrauch = changes.get("filament_verbrauch")
+    if verbrauch is None:
+        return value
+    if verbrauch.updated or verbrauch.deleted:
+        return None
+    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    for row in verbrauch.inserted:
+        datum = row.get("datum")
+        if datum is not None:
+            if datum.tzinfo is None:
+                # Naive Werte sind UTC (wie in der Datenbank gespeichert)
+                datum = datum.replace(tzinfo=timezone.utc)
+            if datum < seven_days_ago:
+                continue
+        # Ohne datum greift der Server-Default (jetzt)
+        value["_verbrauch_7tage_sum"] += row.get("verbrauch_in_g") or 0
+    value["verbrauch_7tage"] = int(value["_verbrauch_7tage_sum"])
+    return value
+
+
+# Das 7-Tage-Fenster wandert mit der Zeit, daher zusätzlich spätestens jede Minute neu rechnen
+@dashboard_snapshot.section("verbrauch", tables={"filament_verbrauch"}, max_age=60, delta=_verbrauch_delta)
+def _dashboard_verbrauch(db: Session) -> dict:
+    from datetime import datetime, timedelta
+    # Gesamtverbrauch der letzten 7 Tage aus Verbrauchslog (gleiches Fenster wie _verbrauch_delta)
+    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    verbrauch = verbrauch_rollup.usage_source(db, seven_days_ago)
+    verbrauch_7tage_sum = db.query(func.sum(verbrauch.c.verbrauch_in_g)).scalar() or 0
+    # Ungerundete Summe für Deltas merken (erscheint nicht in der Antwort)
+    return {"verbrauch_7tage": int(verbrauch_7tage_sum), "_verbrauch_7tage_sum": verbrauch_7tage_sum}
+
+
+@dashboard_snapshot.section("historie", tables={"filament_spule_historie"})
+def _dashboard_historie(db: Session) -> dict:
+    # Zuletzt bearbeitete Spulen (nach Historie-Einträgen)
+    letzte_events = (
+        db.query(FilamentSpuleHistorie)
+        .order_by(FilamentSpuleHistorie.created_at.desc())
+        .limit(5)
+        .all()
+    )
+    spulen_liste = [{
+        "spulen_id": s.spulen_id,
+        "typ_name": s.typ_name,
+        "farbe": s.farbe,
+        "material": s.material,
+        "durchmesser": s.durchmesser,
+        "alt_gewicht": s.alt_gewicht,
+        "neu_gewicht": s.neu_gewicht,
+        "created_at": s.created_at,
+        "updated_at": s.created_at,
+        "letzte_aktion": s.aktion,
+        "verpackt": s.verpackt,
+        "in_printer": s.in_printer,
+    } for s in letzte_events]
+    return {"letzte_spulen": spulen_liste}
+
+
+@dashboard_snapshot.section("jobs", tables={"printer_job_history"})
+def _dashboard_jobs(db: Session) -> dict:
+    job_events = (
+        db.query(PrinterJobHistory)
+        .order_by(PrinterJobHistory.finished_at.desc(), PrinterJobHistory.created_at.desc())
+        .limit(3)
+        .all()
+    )
+    job_historie = [{
+        "job_name": j.job_name,
+        "status": j.status,
+        "printer_serial": j.printer_serial,
+        "printer_name": j.printer_name,
+        "duration_seconds": j.duration_seconds,
+        "started_at": j.started_at,
+        "finished_at": j.finished_at,
+        "created_at": j.created_at,
+    } for j in job_events]
+    return {"job_historie": job_historie}
+
+
+# last_seen wird über presence_tracker als Core-UPDATE geschrieben und invalidiert daher nicht.
+@dashboard_snapshot.section("notizen", tables={"dashboard_notes", "users"})
+def _dashboard_notizen(db: Session) -> dict:
+    notes = (
+        db.query(DashboardNote)
+        .options(joinedload(DashboardNote.author))
+        .order_by(DashboardNote.created_at.desc())
+        .limit(3)
+        .all()
+    )
+    dashboard_notes = [
+        {
+            "id": note.id,
+            "title": note.title,
+            "message": note.message,
+            "created_at": note.created_at,
+            "author": note.author.username if note.author else None,
+            "author_role": note.author.rolle if note.author else None,
+        }
+        for note in notes
+    ]
+    dashboard_note_total = db.query(func.count(DashboardNote.id)).scalar() or 0
+    return {
         "dashboard_notes": dashboard_notes,
-        "dashboard_notes_total": dashboard_note_total
+        "dashboard_notes_total": dashboard_note_total,
     }
 
 
+@app.get("/api/dashboard-details")
+def get_dashboard_details():
+    return dashboard_snapshot.get()
+
 @app.get("/api/dashboard-notes")
 def list_dashboard_notes(limit: int = Query(0, ge=0), db: Session = Depends(get_db)):
     base_query = db.query(DashboardNote).order_by(DashboardNote.created_at.desc())
@@ -2241,7 +2413,7 @@ def create_dashboard_note(payload: DashboardNoteCreate, request: Request, db: Se
     title = (payload.title or None)
     if title:
         title = title.strip() or None
-    note = DashboardNote(title=title, message=message, author=user)
+    note = DashboardNote(title=title, message=message, author_id=user.id)
     db.add(note)
     db.commit()
     db.refresh(note)
@@ -2299,7 +2471,9 @@ def delete_dashboard_note(note_id: int, request: Request, db: Session = Depends(
 
 
 @app.get("/api/printer_spools")
-def get_printer_spools(db: Session = Depends(get_db)):
+def get_printer_spools(request: Request, response: Response, db: Session = Depends(get_db)):
+    if (not_modified := inventory_revision.not_modified(request, response)):
+        return not_modified
     printers = {p.serial: p for p in db.query(Printer).all()}
     spulen = db.query(FilamentSpule).filter(FilamentSpule.in_printer == True).all()
     result: dict[str, dict] = {}
@@ -2370,7 +2544,9 @@ def get_in_printer_status(spulen_id: int, db: Session = Depends(get_db)):
 
 # Neuer API-Endpoint: Filamente im Drucker (nach Typ gruppiert, mit Spulenanzahl)
 @app.get("/drucker_data")
-def get_filamente_im_drucker(db: Session = Depends(get_db)):
+def get_filamente_im_drucker(request: Request, response: Response, db: Session = Depends(get_db)):
+    if (not_modified := inventory_revision.not_modified(request, response)):
+        return not_modified
     result = (
         db.query(
             FilamentTyp.id,
@@ -2434,45 +2610,15 @@ def get_low_stock_types(db: Session = Depends(get_db)):
     Kriterium:
       - leer: keine Spulen ODER Gesamt-Rest <= 0
       - fastleer: Rest <= 10% der Gesamtmenge (über alle Spulen) ODER (falls Gesamt unbekannt/0) Rest <= 100g
+    Schwellen siehe stock_levels.ANTEIL.
     """
-    typen = db.query(FilamentTyp).all()
-    result = []
-    for typ in typen:
-        spulen = typ.spulen or []
-        anzahl_spulen = len(spulen)
-        gesamt_rest = sum(float(s.restmenge or 0) for s in spulen)
-        gesamt_kap = sum(float(s.gesamtmenge or 0) for s in spulen)
-
-        status = None
-        if anzahl_spulen == 0 or gesamt_rest <= 0:
-            status = "leer"
-        else:
-            if gesamt_kap > 0:
-                if gesamt_rest <= gesamt_kap * 0.10:
-                    status = "fastleer"
-            else:
-                # Fallback, wenn Gesamtmenge unbekannt ist
-                if gesamt_rest <= 100:
-                    status = "fastleer"
-
-        if status is not None:
-            result.append({
-                "id": typ.id,
-                "name": typ.name,
-                "material": typ.material,
-                "farbe": typ.farbe,
-                "durchmesser": typ.durchmesser,
-                "restmenge": gesamt_rest,
-                "gesamtmenge": gesamt_kap,
-                "anzahl_spulen": anzahl_spulen,
-                "status": status,
-            })
-    return result
+    return stock_levels.low_stock_types(db, stock_levels.ANTEIL)
 
 # Neuer API-Endpunkt: Top 10 meistgenutzte Filamente nach Gesamtverbrauch (aus Verbrauchslog)
 @app.get("/api/status/top_filaments")
 def get_top_filaments(db: Session = Depends(get_db)):
-    """Gibt die meistgenutzten Filamente nach Gesamtverbrauch zurück (aus Verbrauchslog)."""
+    """Gibt die meistgenutzten Filamente nach Gesamtverbrauch zurück (aus den Tagessummen)."""
+    verbrauch = verbrauch_rollup.usage_source(db)
     result = (
         db.query(
             FilamentTyp.id,
@@ -2480,11 +2626,11 @@ def get_top_filaments(db: Session = Depends(get_db)):
             FilamentTyp.material,
             FilamentTyp.farbe,
             FilamentTyp.durchmesser,
-            func.sum(FilamentVerbrauch.verbrauch_in_g).label("verbrauch")
+            func.sum(verbrauch.c.verbrauch_in_g).label("verbrauch")
         )
-        .join(FilamentVerbrauch, FilamentVerbrauch.typ_id == FilamentTyp.id)
+        .join(verbrauch, verbrauch.c.typ_id == FilamentTyp.id)
         .group_by(FilamentTyp.id, FilamentTyp.name, FilamentTyp.material, FilamentTyp.farbe, FilamentTyp.durchmesser)
-        .order_by(func.sum(FilamentVerbrauch.verbrauch_in_g).desc())
+        .order_by(func.sum(verbrauch.c.verbrauch_in_g).desc())
         .limit(10)
         .all()
     )
@@ -2500,6 +2646,7 @@ _USAGE_PERIODS = {
 
 
 def _usage_since(db: Session, since: datetime):
+    verbrauch = verbrauch_rollup.usage_source(db, since)
     query = (
         db.query(
             FilamentTyp.id,
@@ -2507,14 +2654,11 @@ def _usage_since(db: Session, since: datetime):
             FilamentTyp.material,
             FilamentTyp.farbe,
             FilamentTyp.durchmesser,
-            func.sum(FilamentVerbrauch.verbrauch_in_g).label("verbrauch")
+            func.sum(verbrauch.c.verbrauch_in_g).label("verbrauch")
         )
-        .join(FilamentVerbrauch, FilamentVerbrauch.typ_id == FilamentTyp.id)
+        .join(verbrauch, verbrauch.c.typ_id == FilamentTyp.id)
     )
 
-    if since is not None:
-        query = query.filter(FilamentVerbrauch.datum >= since)
-
     result = query.group_by(
         FilamentTyp.id,
         FilamentTyp.name,
@@ -2566,15 +2710,14 @@ def get_consumption_trend(
     start_of_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
     start = start_of_today - timedelta(days=days - 1)
 
-    bucket = func.date(FilamentVerbrauch.datum)
     rows = (
         db.query(
-            bucket.label("day"),
-            func.sum(FilamentVerbrauch.verbrauch_in_g).label("verbrauch")
+            VerbrauchDaily.tag.label("day"),
+            func.sum(VerbrauchDaily.verbrauch_in_g).label("verbrauch")
         )
-        .filter(FilamentVerbrauch.datum >= start)
-        .group_by(bucket)
-        .order_by(bucket)
+        .filter(VerbrauchDaily.tag >= start.date())
+        .group_by(VerbrauchDaily.tag)
+        .order_by(VerbrauchDaily.tag)
         .all()
     )
 
@@ -2622,15 +2765,16 @@ def get_color_usage(
         "Unbekannt"
     )
 
+    verbrauch = verbrauch_rollup.usage_source(db, since)
     rows = (
         db.query(
             color_expr.label("farbe"),
-            func.sum(FilamentVerbrauch.verbrauch_in_g).label("verbrauch")
+            func.sum(verbrauch.c.verbrauch_in_g).label("verbrauch")
         )
-        .join(FilamentTyp, FilamentTyp.id == FilamentVerbrauch.typ_id)
-        .filter(FilamentVerbrauch.datum >= since)
+        .select_from(verbrauch)
+        .join(FilamentTyp, FilamentTyp.id == verbrauch.c.typ_id)
         .group_by(color_expr)
-        .order_by(func.sum(FilamentVerbrauch.verbrauch_in_g).desc())
+        .order_by(func.sum(verbrauch.c.verbrauch_in_g).desc())
         .all()
     )
 
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from sqlalchemy import Index, inspect, text
+from sqlalchemy.engine import Connection, Dialect, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+import log_search
+import schema_baseline
+import verbrauch_rollup
+from models import SchemaVersion
+
+# ----------------------------
+# Versionierte Schema-Migrationen.
+# Jeder Schritt hat eine fortlaufende Nummer und läuft in einer eigenen Transaktion; danach wird
+# er mit Dauer in schema_version eingetragen. Ist die Datenbank aktuell, kostet der Start nur
+# ein SELECT MAX(version) – kein create_all, keine Inspector-Abfragen.
+#
+# Die ersten Schritte übernehmen die früheren ALTERs aus init_db und prüfen deshalb noch, ob die
+# Spalte schon existiert (bestehende Installationen ohne schema_version). Neue Tabellen, Spalten
+# oder Indizes: Schritt hinten anhängen, Nummern nie umsortieren. Kein Schritt liest models.py –
+# das Basisschema (Schritte 1 und 6) ist in schema_baseline.py eingefroren.
+#
+# Schritte mit @_outside_transaction laufen auf Postgres im Autocommit (CREATE INDEX CONCURRENTLY
+# sperrt die Tabelle nicht für Schreiber, ist aber in einer Transaktion nicht erlaubt). Sie müssen
+# deshalb wiederholbar sein; eingetragen wird die Version danach in einer eigenen Transaktion.
+# ----------------------------
+
+Migration = Callable[[Connection], None]
+
+DEFAULT_DISCORD_MESSAGE_TEMPLATE = "Hey {username}, dein Druckauftrag {job_name} auf {printer_name} ist fertig!"
+DEFAULT_DISCORD_FAILURE_TEMPLATE = "Hey {username}, dein Druckauftrag {job_name} auf {printer_name} ist fehlgeschlagen: {failure_reason}"
+
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {col["name"] for col in inspect(conn).get_columns(table)}
+
+
+def _is_sqlite(conn: Connection) -> bool:
+    return conn.dialect.name == "sqlite"
+
+
+def _outside_transaction(step: Migration) -> Migration:
+    step.outside_transaction = True
+    return step
+
+
+def _create_tables(conn: Connection) -> None:
+    schema_baseline.metadata.create_all(bind=conn)
+
+
+def _spule_printer_columns(conn: Connection) -> None:
+    columns = _columns(conn, "filament_spule")
+    if "printer_serial" not in columns:
+        conn.execute(text("ALTER TABLE filament_spule ADD COLUMN printer_serial VARCHAR"))
+    if "letzte_aktion" not in columns:
+        conn.execute(text("ALTER TABLE filament_spule ADD COLUMN letzte_aktion VARCHAR"))
+
+
+def _user_columns(conn: Connection) -> None:
+    columns = _columns(conn, "users")
+    timestamp_type = "TIMESTAMP" if _is_sqlite(conn) else "TIMESTAMP WITH TIME ZONE"
+    if "discord_id" not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN discord_id VARCHAR"))
+    if "created_at" not in columns:
+        conn.execute(text(f"ALTER TABLE users ADD COLUMN created_at {timestamp_type} DEFAULT CURRENT_TIMESTAMP"))
+    if "last_seen" not in columns:
+        conn.execute(text(f"ALTER TABLE users ADD COLUMN last_seen {timestamp_type} DEFAULT CURRENT_TIMESTAMP"))
+    conn.execute(text(
+        "UPDATE users SET created_at = COALESCE(created_at, CURRENT_TIMESTAMP), last_seen = COALESCE(last_seen, CURRENT_TIMESTAMP) "
+        "WHERE created_at IS NULL OR last_seen IS NULL"
+    ))
+
+
+def _discord_bot_config(conn: Connection) -> None:
+    columns = _columns(conn, "discord_bot_config")
+    if "use_dm" not in columns:
+        default = "0" if _is_sqlite(conn) else "FALSE"
+        conn.execute(text(f"ALTER TABLE discord_bot_config ADD COLUMN use_dm BOOLEAN DEFAULT {default}"))
+    if "failure_message_template" not in columns:
+        conn.execute(text("ALTER TABLE discord_bot_config ADD COLUMN failure_message_template TEXT"))
+    conn.execute(
+        text("UPDATE discord_bot_config SET failure_message_template = :default WHERE failure_message_template IS NULL"),
+        {"default": DEFAULT_DISCORD_FAILURE_TEMPLATE},
+    )
+    count = conn.execute(text("SELECT COUNT(*) FROM discord_bot_config")).scalar()
+    if not count:
+        conn.execute(
+            text("INSERT INTO discord_bot_config (id, enabled, use_dm, message_template, failure_message_template) VALUES (1, :enabled, :use_dm, :template, :failure_template)"),
+            {"enabled": False, "use_dm": False, "template": DEFAULT_DISCORD_MESSAGE_TEMPLATE, "failure_template": DEFAULT_DISCORD_FAILURE_TEMPLATE},
+        )
+
+
+def _already_in_baseline(conn: Connection) -> None:
+    # Ehemals discord_outbox.subscription_ids: die Spalte legt schon Schritt 1 an (schema_baseline).
+    # Die Nummer bleibt belegt, damit eingetragene Versionen weiter zu den Schritten passen.
+    pass
+
+
+def _drop_invalid_index(conn: Connection, name: str) -> None:
+    # Ein abgebrochenes CREATE INDEX CONCURRENTLY hinterlässt einen ungültigen Index,
+    # den IF NOT EXISTS sonst stehen ließe
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def _concurrent_index_ddl(index: Index, dialect: Dialect) -> str:
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    return ddl.replace("INDEX IF NOT EXISTS", "INDEX CONCURRENTLY IF NOT EXISTS", 1)
+
+
+@_outside_transaction
+def _model_indexes(conn: Connection) -> None:
+    # Indizes des Basisschemas auch auf Tabellen anlegen, die vor Schritt 1 existierten.
+    # Postgres (Autocommit): CONCURRENTLY, bestehende Tabellen bleiben während des Aufbaus beschreibbar.
+    concurrently = conn.dialect.name == "postgresql" and conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+    for table in schema_baseline.metadata.sorted_tables:
+        for index in table.indexes:
+            if not concurrently:
+                index.create(conn, checkfirst=True)
+                continue
+            _drop_invalid_index(conn, index.name)
+            conn.execute(text(_concurrent_index_ddl(index, conn.dialect)))
+
+
+def _verbrauch_daily_backfill(conn: Connection) -> None:
+    verbrauch_rollup.backfill_if_empty(conn)
+
+
+@_outside_transaction
+def _log_search_indexes(conn: Connection) -> None:
+    log_search.install(conn)
+
+
+# Spalten, nach denen die Admin-Logs per Keyset paginiert werden (pagination.py)
+_KEYSET_TIME_COLUMNS = (
+    ("printer_job_history", "created_at"),
+    ("filament_spule_historie", "created_at"),
+    ("filament_verbrauch", "datum"),
+)
+_CANONICAL_TIMESTAMP_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]"
+
+
+def _canonical_log_timestamps(conn: Connection) -> None:
+    # SQLite: CURRENT_TIMESTAMP-Werte ("... HH:MM:SS") auf das Format der ORM-Werte bringen,
+    # damit der Textvergleich der Keyset-Pagination der zeitlichen Reihenfolge entspricht
+    if not _is_sqlite(conn):
+        return
+    for table, column in _KEYSET_TIME_COLUMNS:
+        conn.execute(text(
+            f"UPDATE {table} SET {column} = strftime('%Y-%m-%d %H:%M:%f', {column}) || '000' "
+            f"WHERE {column} NOT GLOB :canonical AND strftime('%Y-%m-%d %H:%M:%f', {column}) IS NOT NULL"
+        ), {"canonical": _CANONICAL_TIMESTAMP_GLOB})
+
+
+def _inventory_state(conn: Connection) -> None:
+    # Revisions-Zähler für die Bestands-ETags (inventory_revision.py), genau eine Zeile
+    conn.execute(text("CREATE TABLE IF NOT EXISTS inventory_state (id INTEGER PRIMARY KEY, revision BIGINT NOT NULL DEFAULT 0)"))
+    if not conn.execute(text("SELECT COUNT(*) FROM inventory_state")).scalar():
+        conn.execute(text("INSERT INTO inventory_state (id, revision) VALUES (1, 0)"))
+
+
+def _discord_outbox_render_columns(conn: Connection) -> None:
+    # Vorlage und Kontext von Sammelnachrichten (discord_outbox.aggregate_message)
+    columns = _columns(conn, "discord_outbox")
+    for column in ("template", "context"):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE discord_outbox ADD COLUMN {column} TEXT"))
+
+
+MIGRATIONS: list[tuple[int, str, Migration]] = [
+    (1, "create_tables", _create_tables),
+    (2, "filament_spule_printer_columns", _spule_printer_columns),
+    (3, "users_discord_and_timestamps", _user_columns),
+    (4, "discord_bot_config_dm_and_failure_template", _discord_bot_config),
+    (5, "discord_outbox_subscription_ids", _already_in_baseline),
+    (6, "model_indexes", _model_indexes),
+    (7, "verbrauch_daily_backfill", _verbrauch_daily_backfill),
+    (8, "log_search_indexes", _log_search_indexes),
+    (9, "canonical_log_timestamps", _canonical_log_timestamps),
+    (10, "inventory_state", _inventory_state),
+    (11, "discord_outbox_render_columns", _discord_outbox_render_columns),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(engine: Engine) -> int:
+    """Höchste eingetragene Version, 0 wenn schema_version (noch) nicht existiert.
+
+    Andere Fehler (Datenbank nicht erreichbar, fehlende Rechte) werden weitergereicht – sonst
+    würde eine bestehende Datenbank als leer gelten und von Schritt 1 an migriert.
+    """
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        # Nur im Fehlerfall nachsehen, damit der Normalfall bei einem SELECT bleibt
+        with engine.connect() as conn:
+            if inspect(conn).has_table("schema_version"):
+                raise
+        return 0
+
+
+def _record(conn: Connection, number: int, name: str, started: float) -> int:
+    duration_ms = int((time.perf_counter() - started) * 1000)
+    conn.execute(
+        SchemaVersion.__table__.insert().values(
+            version=number,
+            name=name,
+            applied_at=datetime.now(timezone.utc),
+            duration_ms=duration_ms,
+        )
+    )
+    return duration_ms
+
+
+def migrate(engine: Engine) -> int:
+    """Wendet alle noch fehlenden Schritte an und gibt die danach aktuelle Version zurück.
+
+    Schlägt ein Schritt fehl, wird die Ausnahme weitergereicht; die Schritte davor bleiben eingetragen.
+    """
+    version = current_version(engine)
+    if version >= LATEST_VERSION:
+        return version
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+    # Erneut lesen: ein anderer Prozess kann inzwischen migriert haben
+    version = current_version(engine)
+    for number, name, step in MIGRATIONS:
+        if number <= version:
+            continue
+        started = time.perf_counter()
+        try:
+            if getattr(step, "outside_transaction", False) and engine.dialect.name == "postgresql":
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    step(conn)
+                with engine.begin() as conn:
+                    duration_ms = _record(conn, number, name, started)
+            else:
+                with engine.begin() as conn:
+                    step(conn)
+                    duration_ms = _record(conn, number, name, started)
+        except Exception as exc:
+            # Nicht mit halbem Schema weiterstarten: init_db bzw. der Start schlägt fehl
+            print(f"[DB] Migration {number} ({name}) fehlgeschlagen: {exc}")
+            raise
+        print(f"[DB] Migration {number} ({name}) angewendet in {duration_ms} ms")
+        version = number
+    return version
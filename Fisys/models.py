@@ -1,15 +1,27 @@
 from typing import List, Optional
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import Integer, String, Float, Text, ForeignKey, Boolean, DateTime
+from sqlalchemy import Integer, String, Float, Text, ForeignKey, Boolean, Date, DateTime, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from datetime import datetime
+from datetime import date, datetime, timezone
 from sqlalchemy.sql import func
 
 class Base(DeclarativeBase):
     pass
 
+
+# Default der per Keyset paginierten Zeitspalten (pagination.py): von Python gesetzt speichert SQLite
+# sie immer als "YYYY-MM-DD HH:MM:SS.ffffff", CURRENT_TIMESTAMP dagegen ohne Mikrosekunden
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class FilamentTyp(Base):
     __tablename__ = 'filament_typ'
+    __table_args__ = (
+        # get_or_create_filament_typ / Spulen-Anlage suchen Typen über diese vier Felder
+        Index('ix_filament_typ_lookup', 'name', 'material', 'farbe', 'durchmesser'),
+        Index('ix_filament_typ_bildname', 'bildname'),
+    )
 
     id: Mapped[int] = mapped_column('typ_id', Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String, nullable=False)
@@ -25,6 +37,11 @@ class FilamentTyp(Base):
 
 class FilamentSpule(Base):
     __tablename__ = 'filament_spule'
+    __table_args__ = (
+        Index('ix_filament_spule_typ_id', 'typ_id'),
+        Index('ix_filament_spule_in_printer', 'in_printer'),
+        Index('ix_filament_spule_created_at', 'created_at'),
+    )
 
     spulen_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     typ_id: Mapped[int] = mapped_column(ForeignKey('filament_typ.typ_id'), nullable=False)
@@ -47,6 +64,10 @@ class FilamentSpule(Base):
 
 class FilamentSpuleHistorie(Base):
     __tablename__ = 'filament_spule_historie'
+    __table_args__ = (
+        Index('ix_filament_spule_historie_created_at', 'created_at'),
+        Index('ix_filament_spule_historie_spulen_id', 'spulen_id'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     spulen_id: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -59,11 +80,15 @@ class FilamentSpuleHistorie(Base):
     neu_gewicht: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     verpackt: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
     in_printer: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
 
 
 class PrinterJobHistory(Base):
     __tablename__ = 'printer_job_history'
+    __table_args__ = (
+        Index('ix_printer_job_history_finished_at', 'finished_at', 'created_at'),
+        Index('ix_printer_job_history_created_at', 'created_at'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     printer_serial: Mapped[str] = mapped_column(String, nullable=False, index=True)
@@ -73,11 +98,14 @@ class PrinterJobHistory(Base):
     started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
     duration_seconds: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
 
 
 class DashboardNote(Base):
     __tablename__ = 'dashboard_notes'
+    __table_args__ = (
+        Index('ix_dashboard_notes_created_at', 'created_at'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -90,15 +118,40 @@ class DashboardNote(Base):
 
 class FilamentVerbrauch(Base):
     __tablename__ = 'filament_verbrauch'
+    __table_args__ = (
+        Index('ix_filament_verbrauch_datum', 'datum'),
+        # verbrauch_rollup.refresh_days: Einträge eines Typs an einem Tag
+        Index('ix_filament_verbrauch_typ_datum', 'typ_id', 'datum'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     typ_id: Mapped[int] = mapped_column(ForeignKey('filament_typ.typ_id'), nullable=False)
     verbrauch_in_g: Mapped[float] = mapped_column(Float, nullable=False)
-    datum: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    datum: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
 
     typ: Mapped["FilamentTyp"] = relationship("FilamentTyp")
 
 
+# Angewendete Schema-Migrationen (siehe migrations.py)
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    duration_ms: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+# Tagessummen aus filament_verbrauch (gepflegt von verbrauch_rollup.py)
+class VerbrauchDaily(Base):
+    __tablename__ = 'verbrauch_daily'
+
+    tag: Mapped[date] = mapped_column(Date, primary_key=True)
+    typ_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    verbrauch_in_g: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    anzahl: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
 # Pydantic model for serializing FilamentSpule
 class FilamentSpuleRead(BaseModel):
     spulen_id: int
@@ -203,6 +256,30 @@ class DiscordNotificationSubscription(Base):
     user: Mapped['User'] = relationship('User', back_populates='discord_notifications')
 
 
+class DiscordOutbox(Base):
+    """Zuzustellende Discord-Nachricht (Outbox). Wird vom Zustell-Worker mit Retry/Backoff abgearbeitet."""
+    __tablename__ = "discord_outbox"
+    __table_args__ = (Index('ix_discord_outbox_due', 'status', 'next_attempt_at'),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    subscription_id: Mapped[Optional[int]] = mapped_column(ForeignKey('discord_notification_subscriptions.id', ondelete='SET NULL'), nullable=True, index=True)
+    # Sammelnachricht (Webhook/Channel): komma-getrennte IDs aller erwähnten Abos
+    subscription_ids: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Sammelnachricht: Vorlage und Kontext (JSON) ohne Empfänger, um den Text neu aufzubauen,
+    # wenn ein Abo vor dem Versand entfernt wird
+    template: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    context: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    discord_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    failure_reason: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    status: Mapped[str] = mapped_column(String, nullable=False, default='pending')
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
 class DiscordBotConfig(Base):
     __tablename__ = "discord_bot_config"
 
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Hashable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import literal, tuple_
+from sqlalchemy.orm import Query
+
+# ----------------------------
+# Keyset-Pagination für die Admin-Logs: sortiert absteigend nach (Zeit, id), eine Seite wird über
+# die Werte der letzten/ersten Zeile angefordert statt über OFFSET. Jede Seite kostet damit gleich
+# viel, egal wie tief man blättert. Cursor sind undurchsichtige base64-Strings ("next"/"prev").
+# Verglichen wird der rohe Zeilenwert (zeit, id) < (:zeit, :id) – so greift der Index auf der
+# Zeitspalte (samt id/rowid). Auf SQLite setzt das ein einheitliches Textformat voraus: die
+# paginierten Spalten werden immer als "YYYY-MM-DD HH:MM:SS.ffffff" geschrieben (models.py,
+# Migration 9), damit Text- und Zeitreihenfolge übereinstimmen.
+#
+# Die Gesamtzahl ist optional und wird je Filterkombination für TOTAL_TTL_SECONDS gecacht
+# (Näherungswert – neue Einträge tauchen erst nach Ablauf auf).
+# ----------------------------
+
+TOTAL_TTL_SECONDS = float(os.getenv("ADMIN_LOG_TOTAL_TTL", "60"))
+_TOTAL_CACHE_SIZE = 256
+
+
+def encode_cursor(value: datetime, ident: int, direction: str) -> str:
+    raw = json.dumps([value.isoformat(), ident, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, ident, direction = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if direction not in {"next", "prev"}:
+            raise ValueError(direction)
+        return datetime.fromisoformat(value), int(ident), direction
+    except Exception:
+        raise HTTPException(status_code=400, detail="Ungültiger Cursor")
+
+
+def keyset_page(query: Query, time_column, id_column, limit: int, cursor: Optional[str]) -> tuple[list[Any], Optional[str], Optional[str]]:
+    """Liefert (Zeilen, next_cursor, prev_cursor) – Zeilen immer absteigend sortiert."""
+    time_key = time_column.key
+    id_key = id_column.key
+    direction = "next"
+    if cursor:
+        value, ident, direction = decode_cursor(cursor)
+        key = tuple_(time_column, id_column)
+        bound = tuple_(literal(value, time_column.type), literal(ident, id_column.type))
+        query = query.filter(key > bound if direction == "prev" else key < bound)
+
+    if direction == "prev":
+        rows = query.order_by(time_column.asc(), id_column.asc()).limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        has_next = True
+    else:
+        rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = cursor is not None
+
+    next_cursor = prev_cursor = None
+    if rows:
+        last, first = rows[-1], rows[0]
+        if has_next and getattr(last, time_key) is not None:
+            next_cursor = encode_cursor(getattr(last, time_key), getattr(last, id_key), "next")
+        if has_prev and getattr(first, time_key) is not None:
+            prev_cursor = encode_cursor(getattr(first, time_key), getattr(first, id_key), "prev")
+    return rows, next_cursor, prev_cursor
+
+
+class TotalCache:
+    """Gecachte Gesamtzahlen je Filterkombination, nach TTL neu gezählt."""
+
+    def __init__(self, ttl: float = TOTAL_TTL_SECONDS, maxsize: int = _TOTAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, count: Callable[[], int]) -> int:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1]
+        total = count()
+        with self._lock:
+            self._entries[key] = (now, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return total
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, Optional
+
+from passlib.context import CryptContext
+
+# ----------------------------
+# Passwort-Hashing außerhalb des Event-Loops.
+# bcrypt_sha256 kostet je Aufruf ~100-300 ms CPU; login/register sind async-Routen, daher läuft
+# Hashen/Prüfen in einem eigenen, begrenzten Thread-Pool (PASSWORD_HASH_WORKERS). Mehr als
+# PASSWORD_HASH_QUEUE gleichzeitige Aufträge (laufend + wartend) werden sofort mit HashingBusy
+# abgelehnt statt die Warteschlange wachsen zu lassen.
+#
+# Die Kosten (PASSWORD_HASH_ROUNDS) sind konfigurierbar; Hashes mit anderen Rounds werden beim
+# nächsten erfolgreichen Login transparent neu berechnet (verify_and_update).
+#
+# LoginThrottle zählt Fehlversuche je (Benutzername, Client-IP) im gleitenden Fenster – hinter einem
+# Reverse-Proxy sperrt ein einzelner Angreifer so nicht alle Benutzer aus. X-Forwarded-For zählt nur,
+# wenn die Verbindung von einem Proxy aus LOGIN_TRUSTED_PROXIES (IPs/Netze, kommagetrennt) kommt.
+# Verfolgt werden höchstens LOGIN_THROTTLE_MAX_KEYS Schlüssel (LRU); abgelaufene fallen vorher raus.
+# Davor wird ip_throttle geprüft: Fehlversuche je Client-IP über alle Benutzernamen mit dem höheren
+# Limit LOGIN_MAX_FAILURES_PER_IP – sonst könnte eine IP beliebig viele Namen durchprobieren
+# (Passwort-Spraying, Benutzer-Enumeration). Ein erfolgreicher Login setzt nur den Benutzer-Zähler zurück.
+# ----------------------------
+
+HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "10"))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "50"))
+LOGIN_FAILURE_WINDOW_SECONDS = float(os.getenv("LOGIN_FAILURE_WINDOW_SECONDS", "300"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "4096"))
+LOGIN_TRUSTED_PROXIES = os.getenv("LOGIN_TRUSTED_PROXIES", "")
+
+password_context = CryptContext(
+    schemes=["bcrypt_sha256"],
+    bcrypt_sha256__rounds=HASH_ROUNDS,
+    # min = max = aktuelle Rounds: jeder abweichende Hash gilt als veraltet
+    bcrypt_sha256__min_rounds=HASH_ROUNDS,
+    bcrypt_sha256__max_rounds=HASH_ROUNDS,
+)
+
+
+class HashingBusy(Exception):
+    """Zu viele gleichzeitige Hash-Aufträge."""
+
+
+class PasswordHasher:
+    def __init__(self, context: CryptContext = password_context, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.context = context
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="PasswordHash")
+        self._slots = threading.BoundedSemaphore(max(1, queue_limit))
+        self.rejected = 0
+
+    async def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.context.hash, password)
+
+    async def verify(self, password: str, stored_hash: str) -> tuple[bool, Optional[str]]:
+        """(gültig, neuer Hash oder None) – neuer Hash, wenn sich die Kosten geändert haben."""
+        return await self._submit(self.context.verify_and_update, password, stored_hash)
+
+
+def _parse_networks(spec: str) -> tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, ...]:
+    networks = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            print(f"[Auth] Ungültiger Eintrag in LOGIN_TRUSTED_PROXIES ignoriert: {entry}")
+    return tuple(networks)
+
+
+class ClientAddress:
+    """Ermittelt die Client-IP; X-Forwarded-For nur über vertrauenswürdige Proxys."""
+
+    def __init__(self, trusted_proxies: str = LOGIN_TRUSTED_PROXIES):
+        self.trusted = _parse_networks(trusted_proxies)
+
+    def _is_trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address.strip())
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted)
+
+    def __call__(self, request) -> Optional[str]:
+        peer = request.client.host if request.client else None
+        if not peer or not self.trusted or not self._is_trusted(peer):
+            return peer
+        forwarded = request.headers.get("x-forwarded-for")
+        if not forwarded:
+            return peer
+        # Von rechts lesen: jeder vertrauenswürdige Proxy hängt die Adresse seines Gegenübers an
+        for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+            if not self._is_trusted(hop):
+                return hop
+        return peer
+
+
+def throttle_key(username: Optional[str], client_ip: Optional[str]) -> Optional[tuple[str, str]]:
+    if not client_ip:
+        return None
+    return ((username or "").strip().lower(), client_ip)
+
+
+class LoginThrottle:
+    def __init__(
+        self,
+        max_failures: int = LOGIN_MAX_FAILURES,
+        window_seconds: float = LOGIN_FAILURE_WINDOW_SECONDS,
+        max_keys: int = LOGIN_THROTTLE_MAX_KEYS,
+    ):
+        self.max_failures = max_failures
+        self.window_seconds = window_seconds
+        self.max_keys = max(1, max_keys)
+        # Reihenfolge = letzter Fehlversuch, ältester vorne
+        self._failures: "OrderedDict[Hashable, deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _prune(self, key: Hashable, now: float) -> Optional[deque[float]]:
+        entries = self._failures.get(key)
+        if entries is None:
+            return None
+        while entries and now - entries[0] >= self.window_seconds:
+            entries.popleft()
+        if not entries:
+            self._failures.pop(key, None)
+            return None
+        return entries
+
+    def _expire(self, now: float) -> None:
+        # Vorne stehen die Schlüssel mit dem ältesten letzten Fehlversuch
+        while self._failures:
+            key, entries = next(iter(self._failures.items()))
+            if now - entries[-1] < self.window_seconds:
+                return
+            del self._failures[key]
+
+    def blocked(self, key: Optional[Hashable]) -> bool:
+        if not key or self.max_failures <= 0:
+            return False
+        with self._lock:
+            entries = self._prune(key, time.monotonic())
+            return entries is not None and len(entries) >= self.max_failures
+
+    def failure(self, key: Optional[Hashable]) -> None:
+        if not key:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entries = self._prune(key, now)
+            if entries is None:
+                entries = self._failures[key] = deque(maxlen=max(1, self.max_failures))
+            entries.append(now)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+                self.evictions += 1
+
+    def reset(self, key: Optional[Hashable]) -> None:
+        if not key:
+            return
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"keys": len(self._failures), "max_keys": self.max_keys, "evictions": self.evictions}
+
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+ip_throttle = LoginThrottle(max_failures=LOGIN_MAX_FAILURES_PER_IP)
+client_address = ClientAddress()
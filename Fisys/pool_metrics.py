@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+
+# ----------------------------
+# Messwerte eines Connection-Pools für /_debug/db-pool (sync Engine und Async-Engine).
+# Zähler (Verbindungsaufbau, Checkout, Checkin) kommen aus den öffentlichen Pool-Events. Die
+# Wartezeit eines Checkouts (inkl. Verbindungsaufbau), wie oft kein freier Slot da war (wait) und
+# wie oft pool_timeout überschritten wurde, misst die Pool-Klasse selbst: db.py erzeugt die Engines
+# mit poolclass=metered_pool_class(url), einer Unterklasse der Standard-Pool-Klasse des Dialekts,
+# deren connect() die Zeit an die angehängten PoolMetrics meldet. Ohne diese Pool-Klasse bleiben
+# nur die Zähler. Damit lässt sich DB_POOL_SIZE/DB_MAX_OVERFLOW gegen Threadpool- und
+# Drucker-Threads abgleichen.
+# ----------------------------
+
+_LATENCY_SAMPLES = 500
+
+
+class PoolMetrics:
+    def __init__(self, pool: Pool, max_overflow: int):
+        self.pool = pool
+        self.max_overflow = max_overflow
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.peak_in_use = 0
+        self.total_wait_seconds = 0.0
+
+    @classmethod
+    def attach(cls, pool: Pool, max_overflow: int) -> "PoolMetrics":
+        metrics = cls(pool, max_overflow)
+        event.listen(pool, "connect", metrics._on_connect)
+        event.listen(pool, "checkout", metrics._on_checkout)
+        event.listen(pool, "checkin", metrics._on_checkin)
+        if isinstance(pool, _MeteredPool):
+            pool.metrics = metrics
+        return metrics
+
+    def _must_wait(self) -> bool:
+        # Kein freier Slot mehr: dieser Checkout muss warten, bis jemand zurückgibt
+        if not isinstance(self.pool, QueuePool):
+            return False
+        return self.pool.checkedin() == 0 and self.max_overflow > -1 and self.pool.overflow() >= self.max_overflow
+
+    def measure(self, connect: Callable[[], Any]) -> Any:
+        must_wait = self._must_wait()
+        started = time.perf_counter()
+        try:
+            connection = connect()
+        except PoolTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+            if must_wait:
+                self.waits += 1
+                self.total_wait_seconds += elapsed
+        return connection
+
+    def _on_connect(self, _dbapi_connection, _connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, _dbapi_connection, _connection_record, _connection_proxy) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _on_checkin(self, _dbapi_connection, _connection_record) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.in_use = max(0, self.in_use - 1)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+            total_wait = self.total_wait_seconds
+
+        def _percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        stats: dict[str, Any] = {"pool": type(self.pool).__name__, "status": self.pool.status()}
+        if isinstance(self.pool, QueuePool):
+            stats.update(
+                size=self.pool.size(),
+                max_overflow=self.max_overflow,
+                timeout=self.pool.timeout(),
+                idle=self.pool.checkedin(),
+                overflow=self.pool.overflow(),
+            )
+        stats.update(counters)
+        stats.update(
+            wait_ms_total=round(total_wait * 1000, 1),
+            checkout_ms_avg=round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            checkout_ms_p95=round(_percentile(0.95), 3),
+            checkout_ms_max=round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        )
+        return stats
+
+
+class _MeteredPool:
+    """Mixin für Pool-Klassen: connect() meldet die Wartezeit an die angehängten PoolMetrics."""
+
+    metrics: Optional[PoolMetrics] = None
+
+    def connect(self):
+        metrics = self.metrics
+        if metrics is None:
+            return super().connect()
+        return metrics.measure(super().connect)
+
+    def recreate(self):
+        # engine.dispose() ersetzt den Pool: Messwerte laufen am neuen Pool weiter (Events übernimmt SQLAlchemy)
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.pool = pool
+        return pool
+
+
+_metered_classes: dict[type, type] = {}
+
+
+def metered(pool_class: type) -> type:
+    """Unterklasse von pool_class mit Wartezeit-Messung (je Klasse nur einmal erzeugt)."""
+    if issubclass(pool_class, _MeteredPool):
+        return pool_class
+    if pool_class not in _metered_classes:
+        _metered_classes[pool_class] = type(f"Metered{pool_class.__name__}", (_MeteredPool, pool_class), {})
+    return _metered_classes[pool_class]
+
+
+def metered_pool_class(url: str) -> type:
+    """Gemessene Variante der Pool-Klasse, die create_engine bzw. create_async_engine für url wählen würde."""
+    parsed = make_url(url)
+    return metered(parsed.get_dialect().get_pool_class(parsed))
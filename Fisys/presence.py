@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, update
+
+from db import SessionLocal
+from models import User
+from user_cache import Principal
+
+# ----------------------------
+# last_seen der Benutzer ohne Schreibzugriff pro Request.
+# touch() merkt sich den Zeitpunkt nur im Speicher; der Flush-Thread schreibt alle gesammelten
+# Werte alle PRESENCE_FLUSH_SECONDS in einem gebündelten UPDATE (und beim Shutdown).
+# Innerhalb von PRESENCE_STALENESS_SECONDS nach dem letzten erfassten Zeitpunkt wird ein Benutzer
+# gar nicht erneut vorgemerkt – last_seen ist damit höchstens Staleness + Flush-Intervall alt.
+#
+# Das UPDATE läuft bewusst als Core-Statement: es löst keinen ORM-Flush aus und damit auch keine
+# Dashboard-Snapshot-/Rollup-Invalidierung.
+# ----------------------------
+
+FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", "30"))
+STALENESS_SECONDS = float(os.getenv("PRESENCE_STALENESS_SECONDS", "60"))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite liefert Zeitstempel ohne Zeitzone zurück
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class PresenceTracker:
+    """Sammelt last_seen je Benutzer-ID im Speicher und schreibt sie gebündelt."""
+
+    def __init__(self, flush_seconds: float = FLUSH_SECONDS, staleness_seconds: float = STALENESS_SECONDS):
+        self.flush_seconds = max(1.0, flush_seconds)
+        self.staleness_seconds = max(0.0, staleness_seconds)
+        self._lock = threading.Lock()
+        self._pending: dict[int, datetime] = {}
+        self._recorded: dict[int, datetime] = {}
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.skipped = 0
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="PresenceFlush", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def touch(self, user: User | Principal, force: bool = False) -> None:
+        """Vermerkt `user` als gerade aktiv (ohne DB-Zugriff)."""
+        now = _utcnow()
+        with self._lock:
+            previous = self._recorded.get(user.id) or _as_utc(user.last_seen)
+            if not force and previous is not None and (now - previous).total_seconds() < self.staleness_seconds:
+                self.skipped += 1
+                return
+            self._pending[user.id] = now
+            self._recorded[user.id] = now
+
+    def last_seen(self, user: User | Principal) -> Optional[datetime]:
+        """last_seen inkl. noch nicht geschriebener Werte (für Benutzerlisten)."""
+        with self._lock:
+            pending = self._pending.get(user.id)
+        stored = _as_utc(user.last_seen)
+        if pending is not None and (stored is None or pending > stored):
+            return pending
+        return user.last_seen
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._recorded.pop(user_id, None)
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        statement = (
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("user_id"))
+            .values(last_seen=bindparam("seen"))
+        )
+        session = SessionLocal()
+        try:
+            session.execute(statement, [{"user_id": user_id, "seen": seen} for user_id, seen in pending.items()])
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            # Werte zurücklegen, neuere touch()-Einträge haben Vorrang
+            with self._lock:
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            print(f"[Presence] last_seen konnte nicht geschrieben werden: {exc}")
+            return 0
+        finally:
+            session.close()
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(pending)
+        return len(pending)
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                print(f"[Presence] Fehler im Flush-Thread: {exc}")
+
+
+presence_tracker = PresenceTracker()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import ssl
 import threading
@@ -15,49 +16,98 @@ from paho.mqtt import client as mqtt
 # Mehrere Instanzen parallel verwalten (keyed by serial)
 _instances: dict[str, dict[str, Any]] = {}
 
+# Betriebsart: "threads" (MQTT- + Sender-Thread je Drucker) oder "asyncio" (ein Hub-Thread für alle)
+PRINTER_SERVICE_MODE = os.getenv("PRINTER_SERVICE_MODE", "threads").strip().lower()
+
+# Push bei Änderung: kurzes Sammelfenster gegen Report-Bursts, sonst nur noch ein seltener Heartbeat
+PUSH_COALESCE_SECONDS = float(os.getenv("PRINTER_PUSH_COALESCE_SECONDS", "0.5"))
+HEARTBEAT_SECONDS = int(os.getenv("PRINTER_HEARTBEAT_SECONDS", "60"))
+
 
 # ----------------------------
-# Parser (defensiv, gibt ein schlankes Dict für das Dashboard zurück)
+# Zustands-Store: Bambu schickt meist nur Teil-Reports (z.B. nur mc_percent oder nur ams).
+# Die Reports werden je Serial in ein persistentes Dokument gemerged; abgeleitete
+# Dashboard-Felder werden nur neu berechnet, wenn sich ihre Eingaben geändert haben.
 # ----------------------------
 
-def _parse_payload(serial: str, raw: bytes) -> dict[str, Any]:
+# Dashboard-Feld -> Eingabeschlüssel (relativ zu "print" bzw. Root)
+_FIELD_INPUTS: dict[str, tuple[str, ...]] = {
+    "state": ("stage", "gcode_state", "print_status", "state"),
+    "percent": ("mc_percent", "progress", "percent"),
+    "eta_min": ("mc_remaining_time", "remain_time", "time_remaining"),
+    "job_name": ("subtask_name", "task_name"),
+    "filament": ("ams",),
+}
+_INPUT_KEYS = {key for keys in _FIELD_INPUTS.values() for key in keys}
+
+
+def _decode_report(raw: bytes) -> Optional[dict[str, Any]]:
     try:
         data = json.loads(raw.decode("utf-8", "ignore"))
     except Exception:
-        return {"serial": serial, "state": "unknown"}
+        return None
+    return data if isinstance(data, dict) else None
 
-    pr: dict[str, Any] = {}
-    if isinstance(data, dict):
-        pr = data.get("print", {}) if isinstance(data.get("print"), dict) else data
 
-    state = (
-        pr.get("stage")
-        or pr.get("gcode_state")
-        or pr.get("print_status")
-        or pr.get("state")
-        or "unknown"
-    )
+def _print_section(doc: dict[str, Any]) -> dict[str, Any]:
+    return doc["print"] if isinstance(doc.get("print"), dict) else doc
 
-    percent = pr.get("mc_percent") or pr.get("progress") or pr.get("percent")
-    eta_min = pr.get("mc_remaining_time") or pr.get("remain_time") or pr.get("time_remaining")
-    job_name = pr.get("subtask_name") or pr.get("task_name")
 
-    # normalize
-    try:
-        percent = None if percent is None else float(percent)
-    except Exception:
-        percent = None
-    try:
-        eta_min = None if eta_min is None else int(eta_min)
-    except Exception:
-        eta_min = None
-
-    # --- AMS / Filament detection (current loaded slot) ---
-    filament_name = None
-    filament_tray = None
-    try:
-        if isinstance(data, dict):
-            ams = data.get("ams")
+def _deep_merge(target: dict[str, Any], delta: dict[str, Any]) -> None:
+    # Dicts rekursiv zusammenführen, alles andere (inkl. Listen) ersetzen
+    for key, value in delta.items():
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            _deep_merge(current, value)
+        else:
+            target[key] = value
+
+
+def _input_fingerprint(doc: dict[str, Any], key: str) -> str:
+    return json.dumps([doc.get(key), _print_section(doc).get(key)], sort_keys=True, default=str)
+
+
+def _merge_report(doc: dict[str, Any], delta: dict[str, Any]) -> set[str]:
+    """Merged einen (Teil-)Report in doc und liefert die geänderten Eingabeschlüssel."""
+    touched = _INPUT_KEYS.intersection(set(delta) | set(_print_section(delta)))
+    before = {key: _input_fingerprint(doc, key) for key in touched}
+    _deep_merge(doc, delta)
+    return {key for key in touched if _input_fingerprint(doc, key) != before[key]}
+
+
+def _derive_field(doc: dict[str, Any], field: str) -> dict[str, Any]:
+    pr = _print_section(doc)
+    if field == "state":
+        state = (
+            pr.get("stage")
+            or pr.get("gcode_state")
+            or pr.get("print_status")
+            or pr.get("state")
+            or "unknown"
+        )
+        return {"state": str(state)}
+    if field == "percent":
+        percent = pr.get("mc_percent") or pr.get("progress") or pr.get("percent")
+        try:
+            percent = None if percent is None else float(percent)
+        except Exception:
+            percent = None
+        return {"percent": percent}
+    if field == "eta_min":
+        eta_min = pr.get("mc_remaining_time") or pr.get("remain_time") or pr.get("time_remaining")
+        try:
+            eta_min = None if eta_min is None else int(eta_min)
+        except Exception:
+            eta_min = None
+        return {"eta_min": eta_min}
+    if field == "job_name":
+        return {"job_name": pr.get("subtask_name") or pr.get("task_name")}
+    if field == "filament":
+        # --- AMS / Filament detection (current loaded slot) ---
+        filament_name = None
+        filament_tray = None
+        try:
+            ams = doc.get("ams") if isinstance(doc.get("ams"), dict) else pr.get("ams")
             if isinstance(ams, dict):
                 tray_now = ams.get("tray_now")
                 trays = ams.get("tray") or ams.get("trays") or []
@@ -70,29 +120,58 @@ def _parse_payload(serial: str, raw: bytes) -> dict[str, Any]:
                         or slot.get("color_name")
                         or slot.get("filament_name")
                     )
-    except Exception:
-        pass
-
-    return {
-        "serial": serial,
-        "state": str(state),
-        "percent": percent,
-        "eta_min": eta_min,
-        "job_name": job_name,
-        "filament_tray": filament_tray,
-        "filament_name": filament_name,
-    }
+        except Exception:
+            pass
+        return {"filament_tray": filament_tray, "filament_name": filament_name}
+    return {}
+
+
+def _apply_report(serial: str, inst: dict[str, Any], delta: dict[str, Any]) -> set[str]:
+    """Merged einen Report in den Instanz-Zustand. Aufrufer hält latest_lock. Liefert geänderte Dashboard-Felder."""
+    doc = inst.setdefault("doc", {})
+    derived = inst.setdefault("derived", {"serial": serial})
+    changed_inputs = _merge_report(doc, delta)
+    changed_fields: set[str] = set()
+    for field, inputs in _FIELD_INPUTS.items():
+        if field in inst.setdefault("derived_fields", set()) and not changed_inputs.intersection(inputs):
+            continue
+        inst["derived_fields"].add(field)
+        for key, value in _derive_field(doc, field).items():
+            if key not in derived or derived[key] != value:
+                changed_fields.add(key)
+            derived[key] = value
+    return changed_fields
 
 
 # ----------------------------
-# Core: MQTT-Loop + 15s-Sender
+# Core: MQTT-Client + Nachrichtenverarbeitung (gemeinsam für beide Betriebsarten)
 # ----------------------------
 
-def _mqtt_loop(serial: str):
-    inst = _instances.get(serial)
-    if not inst:
-        return
-    ip = inst.get("ip")
+def _handle_message(serial: str, inst: dict[str, Any], raw: bytes) -> None:
+    try:
+        delta = _decode_report(raw)
+        if delta is None:
+            return
+        with inst["latest_lock"]:
+            changed = _apply_report(serial, inst, delta)
+            derived = inst["derived"]
+            was_offline = inst.get("offline_emitted")
+            # Solange noch nie ein Zustand gemeldet wurde, bleibt ein vorhandener Snapshot stehen
+            if derived.get("state") != "unknown" or inst.get("latest_payload") is None:
+                inst["latest_payload"] = dict(derived)
+            else:
+                changed = set()
+            inst["last_seen"] = time.time()
+            inst["offline_emitted"] = False
+        notify_change = inst.get("notify_change")
+        if notify_change and (changed or was_offline):
+            notify_change()
+    except Exception as e:
+        # _log.exception(f"[MQTT] on_message parse error: {e}")
+        pass
+
+
+def _build_client(serial: str, inst: dict[str, Any]) -> mqtt.Client:
     access_code = inst.get("access_code")
     # set a deterministic client_id (many brokers/devices require this)
     client = mqtt.Client(client_id=f"{serial}-fisys-{os.getpid()}", clean_session=True)
@@ -106,6 +185,7 @@ def _mqtt_loop(serial: str):
     client.tls_insecure_set(True)
 
     topic = f"device/{serial}/report"
+    request_topic = f"device/{serial}/request"
 
     def on_connect(_c, _u, flags, rc):
         if rc == 0:
@@ -113,6 +193,8 @@ def _mqtt_loop(serial: str):
             try:
                 _c.subscribe(topic, qos=0)
                 # _log.info(f"[MQTT] Subscribed: {topic}")
+                # Einmal den Vollstand anfordern; danach reichen die Teil-Reports (siehe _apply_report)
+                _c.publish(request_topic, json.dumps({"pushing": {"sequence_id": "0", "command": "pushall"}}), qos=0)
             except Exception as e:
                 # _log.exception(f"[MQTT] Subscribe failed: {e}")
                 pass
@@ -134,27 +216,70 @@ def _mqtt_loop(serial: str):
         pass
 
     def on_message(_c, _u, m):
-        try:
-            parsed = _parse_payload(serial, m.payload)
-            # _log.info(f"[MQTT] Message on {m.topic}: {parsed}")
-            with inst["latest_lock"]:
-                # Nur sinnvolle Payloads übernehmen. "unknown" überschreibt keinen vorhandenen guten Snapshot.
-                if parsed.get("state") == "unknown" and inst.get("latest_payload") is not None:
-                    # _log.debug("[MQTT] Ignoring 'unknown' payload to preserve last valid snapshot")
-                    pass
-                else:
-                    inst["latest_payload"] = parsed
-                    inst["last_seen"] = time.time()
-                    inst["offline_emitted"] = False
-        except Exception as e:
-            # _log.exception(f"[MQTT] on_message parse error: {e}")
-            pass
+        _handle_message(serial, inst, m.payload)
 
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
     client.on_message = on_message
     client.on_log = on_log
     client.on_subscribe = on_subscribe
+    return client
+
+
+def _emit_snapshot(serial: str, inst: dict[str, Any]) -> None:
+    """Schickt den *zuletzt gesehenen* Status (oder einmalig 'offline') an on_push."""
+    on_push: Callable[[dict[str, Any]], None] = inst.get("on_push")
+    offline_timeout: int = inst.get("offline_timeout", 30)
+    payload = None
+    last_seen = None
+    with inst["latest_lock"]:
+        payload = inst.get("latest_payload")
+        last_seen = inst.get("last_seen")
+    now = time.time()
+    if last_seen and offline_timeout and (now - last_seen) > offline_timeout:
+        if not inst.get("offline_emitted"):
+            try:
+                offline_payload = {
+                    "serial": serial,
+                    "state": "offline",
+                    "offline": True,
+                    "printer_name": inst.get("name"),
+                }
+                on_push(offline_payload)
+            except Exception:
+                pass
+            inst["offline_emitted"] = True
+    elif payload:
+        try:
+            # Anreichern mit Name (falls vorhanden)
+            enriched = dict(payload)
+            name = inst.get("name")
+            if name:
+                enriched.setdefault("printer_name", name)
+                enriched.setdefault("name", name)
+            if last_seen:
+                enriched.setdefault("last_seen_ts", last_seen)
+            enriched.pop("offline", None)
+            on_push(enriched)
+            inst["offline_emitted"] = False
+        except Exception as e:
+            # _log.exception(f"[SENDER] on_push failed: {e}")
+            pass
+    else:
+        # _log.debug("[SENDER] no payload yet")
+        pass
+
+
+# ----------------------------
+# Betriebsart "threads": MQTT-Loop + 15s-Sender je Drucker in eigenen Threads
+# ----------------------------
+
+def _mqtt_loop(serial: str):
+    inst = _instances.get(serial)
+    if not inst:
+        return
+    ip = inst.get("ip")
+    client = _build_client(serial, inst)
 
     # Non-blocking loop and graceful stop
     try:
@@ -188,66 +313,184 @@ def _mqtt_loop(serial: str):
         pass
 
 
+def _sender_timeout(inst: dict[str, Any], next_heartbeat: float) -> float:
+    """Sekunden bis zum nächsten Heartbeat bzw. bis der Drucker als offline gilt."""
+    now = time.time()
+    timeout = next_heartbeat - now
+    last_seen = inst.get("last_seen")
+    offline_timeout = inst.get("offline_timeout", 30)
+    if last_seen and offline_timeout and not inst.get("offline_emitted"):
+        timeout = min(timeout, last_seen + offline_timeout - now + 0.05)
+    return max(0.0, timeout)
+
+
 def _sender_loop(serial: str):
     inst = _instances.get(serial)
     if not inst:
         return
-    on_push: Callable[[dict[str, Any]], None] = inst.get("on_push")
-    interval_seconds: int = inst.get("interval_seconds", 15)
-    offline_timeout: int = inst.get("offline_timeout", 30)
-    # Schicke alle interval_seconds den *zuletzt gesehenen* Status, wenn vorhanden.
-    # Es wird nichts persistiert – nur der flüchtige Snapshot wird genutzt.
+    # Gesendet wird, sobald sich ein Dashboard-Feld ändert (nach dem Sammelfenster),
+    # spätestens aber alle interval_seconds als Heartbeat. Es wird nichts persistiert.
+    interval_seconds: int = inst.get("interval_seconds", HEARTBEAT_SECONDS)
+    coalesce_seconds: float = inst.get("coalesce_seconds", PUSH_COALESCE_SECONDS)
+    wake = threading.Event()
+    inst["notify_change"] = wake.set
+    next_heartbeat = time.time()
     while inst.get("running"):
-        payload = None
-        last_seen = None
-        with inst["latest_lock"]:
-            payload = inst.get("latest_payload")
-            last_seen = inst.get("last_seen")
-        now = time.time()
-        if last_seen and offline_timeout and (now - last_seen) > offline_timeout:
-            if not inst.get("offline_emitted"):
+        if wake.wait(_sender_timeout(inst, next_heartbeat)):
+            if not inst.get("running"):
+                return
+            time.sleep(coalesce_seconds)
+            wake.clear()
+        _emit_snapshot(serial, inst)
+        next_heartbeat = time.time() + interval_seconds
+
+
+# ----------------------------
+# Betriebsart "asyncio": ein Event-Loop-Thread ("PrinterHub") für alle Drucker
+# ----------------------------
+
+_hub_loop: Optional[asyncio.AbstractEventLoop] = None
+_hub_lock = threading.Lock()
+
+
+class _AsyncioSocketBridge:
+    """Hängt den Socket eines paho-Clients in den Hub-Loop ein (ersetzt loop_start-Thread)."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self.sock = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call(self, fn: Callable[..., Any], *args: Any) -> None:
+        # paho ruft die Socket-Callbacks auch aus dem Connect-Executor auf
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._safe(fn, *args)
+        else:
+            self.loop.call_soon_threadsafe(self._safe, fn, *args)
+
+    @staticmethod
+    def _safe(fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            fn(*args)
+        except Exception:
+            pass
+
+    def _on_socket_open(self, _c, _u, sock):
+        self.sock = sock
+        self._call(self.loop.add_reader, sock.fileno(), self._on_readable)
+
+    def _on_socket_close(self, _c, _u, sock):
+        if self.sock is sock:
+            self.sock = None
+        self._detach(sock)
+
+    def _on_socket_register_write(self, _c, _u, sock):
+        self._call(self.loop.add_writer, sock.fileno(), self.client.loop_write)
+
+    def _on_socket_unregister_write(self, _c, _u, sock):
+        self._call(self.loop.remove_writer, sock.fileno())
+
+    def _on_readable(self):
+        self.client.loop_read()
+        # TLS puffert ggf. bereits entschlüsselte Daten, die der Selector nicht mehr meldet
+        sock = self.sock
+        while sock is not None and sock is self.sock and getattr(sock, "pending", lambda: 0)():
+            self.client.loop_read()
+
+    def _detach(self, sock):
+        try:
+            fd = sock.fileno()
+        except Exception:
+            return
+        if fd < 0:
+            return
+        self._call(self.loop.remove_reader, fd)
+        self._call(self.loop.remove_writer, fd)
+
+    def close(self):
+        if self.sock is not None:
+            self._detach(self.sock)
+            self.sock = None
+
+
+def _ensure_hub_loop() -> asyncio.AbstractEventLoop:
+    global _hub_loop
+    with _hub_lock:
+        if _hub_loop is None or _hub_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="PrinterHub", daemon=True)
+            thread.start()
+            _hub_loop = loop
+        return _hub_loop
+
+
+async def _hub_mqtt(serial: str):
+    inst = _instances.get(serial)
+    if not inst:
+        return
+    loop = asyncio.get_running_loop()
+    ip = inst.get("ip")
+    client = _build_client(serial, inst)
+    bridge = _AsyncioSocketBridge(loop, client)
+    inst["client"] = client
+    reconnect_delay = 1
+    try:
+        while inst.get("running"):
+            if bridge.sock is None:
                 try:
-                    offline_payload = {
-                        "serial": serial,
-                        "state": "offline",
-                        "offline": True,
-                        "printer_name": inst.get("name"),
-                    }
-                    on_push(offline_payload)
+                    # Verbindungsaufbau (DNS/TCP/TLS) blockiert – kurz in den Default-Executor auslagern
+                    await loop.run_in_executor(None, client.connect, ip, 8883, 60)
+                    reconnect_delay = 1
                 except Exception:
-                    pass
-                inst["offline_emitted"] = True
-        elif payload:
-            try:
-                # Anreichern mit Name (falls vorhanden)
-                enriched = dict(payload)
-                name = inst.get("name")
-                if name:
-                    enriched.setdefault("printer_name", name)
-                    enriched.setdefault("name", name)
-                if last_seen:
-                    enriched.setdefault("last_seen_ts", last_seen)
-                enriched.pop("offline", None)
-                on_push(enriched)
-                inst["offline_emitted"] = False
-            except Exception as e:
-                # _log.exception(f"[SENDER] on_push failed: {e}")
-                pass
-        else:
-            # _log.debug("[SENDER] no payload yet")
+                    await asyncio.sleep(reconnect_delay)
+                    reconnect_delay = min(reconnect_delay * 2, 5)
+                    continue
+            # Keepalive/PINGREQ und Timeout-Erkennung
+            client.loop_misc()
+            await asyncio.sleep(1)
+    finally:
+        try:
+            client.disconnect()
+        except Exception:
             pass
-        # Sendeintervall
-        for _ in range(interval_seconds):
-            if not inst.get("running"):
-                return
-            time.sleep(1)
+        bridge.close()
+
+
+async def _hub_sender(serial: str):
+    inst = _instances.get(serial)
+    if not inst:
+        return
+    interval_seconds: int = inst.get("interval_seconds", HEARTBEAT_SECONDS)
+    coalesce_seconds: float = inst.get("coalesce_seconds", PUSH_COALESCE_SECONDS)
+    # _handle_message läuft im selben Loop, daher genügt ein asyncio.Event
+    wake = asyncio.Event()
+    inst["notify_change"] = wake.set
+    next_heartbeat = time.time()
+    while inst.get("running"):
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=_sender_timeout(inst, next_heartbeat))
+            await asyncio.sleep(coalesce_seconds)
+            wake.clear()
+        except asyncio.TimeoutError:
+            pass
+        _emit_snapshot(serial, inst)
+        next_heartbeat = time.time() + interval_seconds
 
 
 # ----------------------------
 # Public API
 # ----------------------------
 
-def start_printer_service(*, ip: str, serial: str, access_code: str, on_push: Callable[[dict[str, Any]], None], interval_seconds: int = 15, name: Optional[str] = None, offline_timeout: int = 30) -> None:
+def start_printer_service(*, ip: str, serial: str, access_code: str, on_push: Callable[[dict[str, Any]], None], interval_seconds: Optional[int] = None, name: Optional[str] = None, offline_timeout: int = 30, coalesce_seconds: Optional[float] = None) -> None:
+    # interval_seconds ist der Heartbeat; Änderungen werden nach coalesce_seconds sofort gepusht
     # Starte (falls nicht vorhanden) eine Instanz je Serial
     if serial in _instances and _instances[serial].get("running"):
         return
@@ -256,7 +499,8 @@ def start_printer_service(*, ip: str, serial: str, access_code: str, on_push: Ca
         "serial": serial,
         "access_code": access_code,
         "on_push": on_push,
-        "interval_seconds": interval_seconds,
+        "interval_seconds": interval_seconds if interval_seconds is not None else HEARTBEAT_SECONDS,
+        "coalesce_seconds": coalesce_seconds if coalesce_seconds is not None else PUSH_COALESCE_SECONDS,
         "offline_timeout": max(10, offline_timeout),
         "latest_lock": threading.Lock(),
         "latest_payload": None,
@@ -267,6 +511,12 @@ def start_printer_service(*, ip: str, serial: str, access_code: str, on_push: Ca
     }
     _instances[serial] = inst
 
+    if PRINTER_SERVICE_MODE == "asyncio":
+        loop = _ensure_hub_loop()
+        inst["mqtt_task"] = asyncio.run_coroutine_threadsafe(_hub_mqtt(serial), loop)
+        inst["sender_task"] = asyncio.run_coroutine_threadsafe(_hub_sender(serial), loop)
+        return
+
     mqtt_thread = threading.Thread(target=_mqtt_loop, args=(serial,), name=f"PrinterMQTT-{serial}", daemon=True)
     sender_thread = threading.Thread(target=_sender_loop, args=(serial,), name=f"PrinterSender-{serial}", daemon=True)
     inst["mqtt_thread"] = mqtt_thread
@@ -280,6 +530,18 @@ def stop_printer_service() -> None:
     # Stoppt alle laufenden Instanzen (soft) und beendet MQTT-Loops zuverlässig
     for serial, inst in list(_instances.items()):
         inst["running"] = False
+        if "mqtt_task" in inst:
+            # Hub-Tasks räumen ihren Client im eigenen Loop auf
+            for key in ("mqtt_task", "sender_task"):
+                try:
+                    inst[key].cancel()
+                except Exception:
+                    pass
+            continue
+        notify_change = inst.get("notify_change")
+        if notify_change is not None:
+            # Sender-Thread aus dem Warten auf den Heartbeat wecken
+            notify_change()
         client = inst.get("client")
         if client is not None:
             try:
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Mapping, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# ----------------------------
+# Cache für fertig kodierte JSON-Antworten der Katalog-Endpunkte (/typs/, /spulen_mit_typen/).
+# Schlüssel: Endpunkt + Query-Parameter; Wert: die Bytes nach Pydantic-Validierung und JSON-Kodierung.
+# Jeder Eintrag kennt die Tabellen, aus denen er gebaut wurde. Ein Commit, der eine davon ändert
+# (Spulen-, Typ- und Bild-Handler), verwirft genau diese Einträge – lokal sofort, auf anderen
+# Workern über den Cluster-Kanal.
+#
+# LRU mit Obergrenze für Anzahl (RESPONSE_CACHE_SIZE) und Gesamtgröße (RESPONSE_CACHE_MAX_BYTES).
+# Wird während des Aufbaus invalidiert, landet das Ergebnis nicht im Cache (Generationszähler).
+# ----------------------------
+
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_SIZE", "64"))
+MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+_INFO_KEY = "response_cache_tables"
+
+ChangeHandler = Callable[[set[str]], None]
+
+
+class ResponseCache:
+    def __init__(self, tables: Iterable[str], max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        # Alle Tabellen, von denen Einträge abhängen können; Commits auf andere Tabellen werden ignoriert
+        self.tables = frozenset(tables)
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self._entries: "OrderedDict[Hashable, tuple[bytes, frozenset[str]]]" = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(endpoint: str, params: Optional[Mapping[str, Any]] = None) -> Hashable:
+        if params is None:
+            return (endpoint, ())
+        # Starlettes QueryParams kann Schlüssel mehrfach enthalten
+        items = params.multi_items() if hasattr(params, "multi_items") else params.items()
+        return (endpoint, tuple(sorted(items)))
+
+    def get_or_build(self, endpoint: str, params: Optional[Mapping[str, Any]], tables: Iterable[str], build: Callable[[], bytes]) -> bytes:
+        key = self.key(endpoint, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        body = build()
+        with self._lock:
+            if generation == self._generation and len(body) <= self.max_bytes:
+                self._store(key, body, frozenset(tables))
+        return body
+
+    def _store(self, key: Hashable, body: bytes, tables: frozenset[str]) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[0])
+        self._entries[key] = (body, tables)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> None:
+        """Verwirft alle Einträge, die von einer der Tabellen abhängen (None: alle)."""
+        changed = None if tables is None else set(tables)
+        with self._lock:
+            self._generation += 1
+            for key, (body, depends_on) in list(self._entries.items()):
+                if changed is None or depends_on & changed:
+                    del self._entries[key]
+                    self._bytes -= len(body)
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def track(self, session_target: Any, on_change: Optional[ChangeHandler] = None) -> None:
+        """Invalidiert nach jedem Commit die Einträge der geänderten Tabellen."""
+
+        @event.listens_for(session_target, "after_flush")
+        def _collect_tables(session: Session, _flush_context) -> None:
+            tables = session.info.setdefault(_INFO_KEY, set())
+            for obj in (*session.new, *session.dirty, *session.deleted):
+                table = getattr(obj, "__tablename__", None)
+                if table in self.tables:
+                    tables.add(table)
+
+        @event.listens_for(session_target, "after_commit")
+        def _invalidate_on_commit(session: Session) -> None:
+            tables = session.info.pop(_INFO_KEY, None)
+            if not tables:
+                return
+            self.invalidate(tables)
+            if on_change:
+                try:
+                    on_change(tables)
+                except Exception as exc:
+                    print(f"[ResponseCache] Invalidierung konnte nicht verteilt werden: {exc}")
+
+        @event.listens_for(session_target, "after_rollback")
+        def _discard_on_rollback(session: Session) -> None:
+            session.info.pop(_INFO_KEY, None)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    func,
+)
+
+# ----------------------------
+# Eingefrorenes Basisschema für Migrationsschritt 1 (create_tables) und Schritt 6 (model_indexes).
+# Bewusst unabhängig von models.py: spätere Modelländerungen dürfen nicht rückwirkend verändern,
+# was ein alter Schritt anlegt – sonst bekäme eine neue Installation andere Tabellen als eine
+# migrierte. Dieses Modul nie anpassen; neue Tabellen, Spalten und Indizes kommen als eigener
+# Schritt in migrations.py dazu.
+# ----------------------------
+
+metadata = MetaData()
+
+Table(
+    "filament_typ", metadata,
+    Column("typ_id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("material", String, nullable=False),
+    Column("farbe", String, nullable=False),
+    Column("durchmesser", Float, nullable=False),
+    Column("hersteller", String),
+    Column("hinweise", Text),
+    Column("bildname", String),
+    Column("leergewicht", Float, nullable=False),
+    Index("ix_filament_typ_lookup", "name", "material", "farbe", "durchmesser"),
+    Index("ix_filament_typ_bildname", "bildname"),
+)
+
+Table(
+    "printers", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("ip", String, nullable=False),
+    Column("serial", String, nullable=False, unique=True),
+    Column("access_token", String, nullable=False),
+    Column("show_on_dashboard", Boolean, nullable=False),
+)
+
+Table(
+    "filament_spule", metadata,
+    Column("spulen_id", Integer, primary_key=True),
+    Column("typ_id", Integer, ForeignKey("filament_typ.typ_id"), nullable=False),
+    Column("gesamtmenge", Float, nullable=False),
+    Column("restmenge", Float, nullable=False),
+    Column("in_printer", Boolean, nullable=False),
+    Column("verpackt", Boolean, nullable=False),
+    Column("printer_serial", String, ForeignKey("printers.serial"), nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("alt_gewicht", Float, nullable=False),
+    Column("letzte_aktion", String, nullable=True),
+    Index("ix_filament_spule_typ_id", "typ_id"),
+    Index("ix_filament_spule_in_printer", "in_printer"),
+    Index("ix_filament_spule_created_at", "created_at"),
+)
+
+Table(
+    "filament_spule_historie", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("spulen_id", Integer, nullable=False),
+    Column("typ_name", String, nullable=True),
+    Column("material", String, nullable=True),
+    Column("farbe", String, nullable=True),
+    Column("durchmesser", Float, nullable=True),
+    Column("aktion", String, nullable=False),
+    Column("alt_gewicht", Float, nullable=True),
+    Column("neu_gewicht", Float, nullable=True),
+    Column("verpackt", Boolean, nullable=True),
+    Column("in_printer", Boolean, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Index("ix_filament_spule_historie_created_at", "created_at"),
+    Index("ix_filament_spule_historie_spulen_id", "spulen_id"),
+)
+
+Table(
+    "printer_job_history", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("printer_serial", String, nullable=False, index=True),
+    Column("printer_name", String, nullable=True),
+    Column("job_name", String, nullable=True),
+    Column("status", String, nullable=False),
+    Column("started_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("finished_at", DateTime(timezone=True), nullable=True),
+    Column("duration_seconds", Integer, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Index("ix_printer_job_history_finished_at", "finished_at", "created_at"),
+    Index("ix_printer_job_history_created_at", "created_at"),
+)
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String, unique=True, nullable=False),
+    Column("password_hash", String, nullable=False),
+    Column("rolle", String, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("last_seen", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("discord_id", String, nullable=True),
+)
+
+Table(
+    "dashboard_notes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("title", String, nullable=True),
+    Column("message", Text, nullable=False),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Index("ix_dashboard_notes_created_at", "created_at"),
+)
+
+Table(
+    "filament_verbrauch", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("typ_id", Integer, ForeignKey("filament_typ.typ_id"), nullable=False),
+    Column("verbrauch_in_g", Float, nullable=False),
+    Column("datum", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Index("ix_filament_verbrauch_datum", "datum"),
+    Index("ix_filament_verbrauch_typ_datum", "typ_id", "datum"),
+)
+
+Table(
+    "verbrauch_daily", metadata,
+    Column("tag", Date, primary_key=True),
+    Column("typ_id", Integer, primary_key=True),
+    Column("verbrauch_in_g", Float, nullable=False),
+    Column("anzahl", Integer, nullable=False),
+)
+
+Table(
+    "auth_tokens", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("token", String, unique=True, nullable=False, index=True),
+    Column("rolle", String, nullable=False),
+    Column("erstellt_am", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("verwendet", Boolean, nullable=False),
+)
+
+Table(
+    "discord_notification_subscriptions", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("printer_serial", String, nullable=False, index=True),
+    Column("job_name", String, nullable=True),
+    Column("status", String, nullable=False),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("notified_at", DateTime(timezone=True), nullable=True),
+)
+
+Table(
+    "discord_outbox", metadata,
+    Column("id", Integer, primary_key=True),
+    Column(
+        "subscription_id", Integer,
+        ForeignKey("discord_notification_subscriptions.id", ondelete="SET NULL"),
+        nullable=True, index=True,
+    ),
+    Column("subscription_ids", Text, nullable=True),
+    Column("discord_id", String, nullable=True),
+    Column("content", Text, nullable=False),
+    Column("failure_reason", String, nullable=True),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("next_attempt_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("last_error", Text, nullable=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("sent_at", DateTime(timezone=True), nullable=True),
+    Index("ix_discord_outbox_due", "status", "next_attempt_at"),
+)
+
+Table(
+    "discord_bot_config", metadata,
+    # Einzeilige Tabelle (id = 1), daher kein SERIAL
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("enabled", Boolean, nullable=False),
+    Column("use_dm", Boolean, nullable=False),
+    Column("webhook_url", String, nullable=True),
+    Column("bot_token", String, nullable=True),
+    Column("channel_id", String, nullable=True),
+    Column("message_template", Text, nullable=False),
+    Column("failure_message_template", Text, nullable=False),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
@@ -0,0 +1,121 @@
+"""Nebenläufigkeits-Benchmark für das SQLite-Profil aus db.py.
+
+Start:
+    python sqlite_benchmark.py --seconds 10 --writers 6 --readers 6 --jobs 2
+
+Legt eine temporäre SQLite-Datei an und lässt gemischte Last darauf laufen:
+    - Schreiber: Spulen-Gewicht ändern + Verbrauchseintrag (wie PUT/PATCH /spulen von der Station)
+    - Job-Threads: PrinterJobHistory-Einträge (wie die Job-Abschlüsse aus dem Hintergrund-Pool)
+    - Leser: Dashboard-/Status-Abfragen
+
+Am Ende werden Durchsatz und die Anzahl "database is locked"-Fehler ausgegeben; der Exit-Code ist 1,
+wenn Lock-Fehler aufgetreten sind. Vergleich ohne Tuning:
+    python sqlite_benchmark.py --plain
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SQLite-Nebenläufigkeits-Benchmark")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=6)
+    parser.add_argument("--readers", type=int, default=6)
+    parser.add_argument("--jobs", type=int, default=2)
+    parser.add_argument("--spulen", type=int, default=50)
+    parser.add_argument("--plain", action="store_true", help="ohne WAL/Pragmas/Schreib-Spur (alter Zustand)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="fisys-sqlite-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    if args.plain:
+        os.environ["SQLITE_JOURNAL_MODE"] = "DELETE"
+        os.environ["SQLITE_SYNCHRONOUS"] = "FULL"
+        os.environ["SQLITE_BUSY_TIMEOUT_MS"] = "5000"
+        os.environ["SQLITE_WRITE_LANE"] = "0"
+
+    from sqlalchemy import func
+    from sqlalchemy.exc import OperationalError
+    from db import SessionLocal, init_db, pool_stats
+    from models import FilamentSpule, FilamentTyp, FilamentVerbrauch, PrinterJobHistory
+
+    init_db()
+    session = SessionLocal()
+    typ = FilamentTyp(name="Bench", material="PLA", farbe="Schwarz", durchmesser=1.75, leergewicht=200)
+    session.add(typ)
+    session.flush()
+    for _ in range(args.spulen):
+        session.add(FilamentSpule(typ_id=typ.id, gesamtmenge=1000, restmenge=1000))
+    session.commit()
+    spulen_ids = [row.spulen_id for row in session.query(FilamentSpule.spulen_id).all()]
+    session.close()
+
+    stop_at = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    counts = {"writes": 0, "jobs": 0, "reads": 0, "locked": 0, "other_errors": 0}
+
+    def record(key):
+        with lock:
+            counts[key] += 1
+
+    def run(work, key):
+        index = 0
+        while time.monotonic() < stop_at:
+            db = SessionLocal()
+            try:
+                work(db, index)
+                record(key)
+            except OperationalError as exc:
+                db.rollback()
+                record("locked" if "locked" in str(exc).lower() else "other_errors")
+            except Exception as exc:
+                db.rollback()
+                record("other_errors")
+                print(f"Fehler: {exc}")
+            finally:
+                db.close()
+            index += 1
+
+    def write(db, index):
+        spule = db.get(FilamentSpule, spulen_ids[index % len(spulen_ids)])
+        spule.alt_gewicht = spule.restmenge
+        spule.restmenge = max(0.0, spule.restmenge - 1)
+        db.add(FilamentVerbrauch(typ_id=spule.typ_id, verbrauch_in_g=1))
+        db.commit()
+
+    def job(db, index):
+        db.add(PrinterJobHistory(printer_serial="BENCH", job_name=f"job-{index}", status="finished"))
+        db.commit()
+
+    def read(db, index):
+        db.query(func.count(FilamentSpule.spulen_id)).scalar()
+        db.query(func.sum(FilamentVerbrauch.verbrauch_in_g)).scalar()
+        db.query(PrinterJobHistory).order_by(PrinterJobHistory.created_at.desc()).limit(3).all()
+
+    threads = (
+        [threading.Thread(target=run, args=(write, "writes")) for _ in range(args.writers)]
+        + [threading.Thread(target=run, args=(job, "jobs")) for _ in range(args.jobs)]
+        + [threading.Thread(target=run, args=(read, "reads")) for _ in range(args.readers)]
+    )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mode = "plain" if args.plain else "tuned"
+    print(f"[{mode}] {args.seconds:.0f}s: " + ", ".join(f"{key}={value}" for key, value in counts.items()))
+    print(f"Writes/s: {(counts['writes'] + counts['jobs']) / args.seconds:.1f}  Reads/s: {counts['reads'] / args.seconds:.1f}")
+    print(f"Pool: {pool_stats()['engine']}")
+    return 1 if counts["locked"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
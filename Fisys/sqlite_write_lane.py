@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Optional
+
+# ----------------------------
+# Schreib-Spur für SQLite: höchstens eine schreibende Session-Transaktion gleichzeitig im Prozess.
+# Eine Session betritt die Spur beim ersten Flush bzw. DML-Statement und verlässt sie mit dem Ende
+# ihrer Transaktion (Commit/Rollback) – das kann in einem anderen Thread passieren als der Eintritt.
+#
+# Verschachtelt: öffnet ein Thread, der die Spur schon über eine Session hält, eine zweite
+# schreibende Session, darf er nicht auf sich selbst warten. Die innere Session tritt der Spur bei
+# (reentries) und schreibt innerhalb derselben Spur; frei wird sie erst, wenn alle Halter fertig sind.
+# Wird die Spur innerhalb von timeout nicht frei, schlägt der Schreibzugriff mit WriteLaneTimeout
+# fehl – geschrieben wird nie an der Spur vorbei.
+#
+# Async: auf dem Event-Loop wird nie blockierend gewartet. enter_async() versucht es sofort und
+# wartet sonst in einem Worker-Thread; solche Halter gehören keinem Thread (join=False), denn auf
+# dem Loop-Thread laufen viele Requests nebeneinander und dürfen einander nicht beitreten.
+# ----------------------------
+
+
+class WriteLaneTimeout(TimeoutError):
+    """Die Schreib-Spur wurde nicht rechtzeitig frei."""
+
+
+class WriteLaneBusy(WriteLaneTimeout):
+    """Die Schreib-Spur ist belegt und der Aufrufer darf nicht warten (Event-Loop)."""
+
+
+class SQLiteWriteLane:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        # Halter -> Thread, in dem er die Spur betreten hat (None: keinem Thread zugeordnet)
+        self._holders: dict[Any, Optional[int]] = {}
+        self.acquisitions = 0
+        self.reentries = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def holds(self, holder: Any) -> bool:
+        with self._cond:
+            return holder in self._holders
+
+    def _try_enter_locked(self, holder: Any, thread: Optional[int]) -> bool:
+        if holder in self._holders:
+            return True
+        if thread is not None and thread in self._holders.values():
+            self._holders[holder] = thread
+            self.reentries += 1
+            return True
+        if self._holders:
+            return False
+        self._holders[holder] = thread
+        self.acquisitions += 1
+        return True
+
+    def try_enter(self, holder: Any, join: bool = True) -> bool:
+        """Betritt die Spur nur, wenn das ohne Warten geht."""
+        thread = threading.get_ident() if join else None
+        with self._cond:
+            return self._try_enter_locked(holder, thread)
+
+    def enter(self, holder: Any, join: bool = True) -> None:
+        """Betritt die Spur für `holder` (blockiert höchstens timeout Sekunden).
+
+        join=False: `holder` wird keinem Thread zugeordnet – weder tritt er einem Halter desselben
+        Threads bei, noch können spätere Sessions dieses Threads ihm beitreten.
+        """
+        thread = threading.get_ident() if join else None
+        with self._cond:
+            if self._try_enter_locked(holder, thread):
+                return
+            self.waits += 1
+            deadline = time.monotonic() + self.timeout
+            while not self._try_enter_locked(holder, thread):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise WriteLaneTimeout(f"SQLite-Schreib-Spur nach {self.timeout:.0f} s nicht frei")
+                self._cond.wait(remaining)
+
+    async def enter_async(self, holder: Any) -> None:
+        """Betritt die Spur aus einer Coroutine, ohne den Event-Loop zu blockieren."""
+        if self.try_enter(holder, join=False):
+            return
+        waiting = asyncio.ensure_future(asyncio.to_thread(self.enter, holder, False))
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            # Der Worker-Thread wartet weiter; hat er die Spur bekommen, sofort wieder freigeben
+            def _release(done: asyncio.Future) -> None:
+                if not done.cancelled() and done.exception() is None:
+                    self.leave(holder)
+
+            waiting.add_done_callback(_release)
+            raise
+
+    def leave(self, holder: Any) -> None:
+        with self._cond:
+            if holder in self._holders:
+                del self._holders[holder]
+                if not self._holders:
+                    self._cond.notify_all()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "holders": len(self._holders),
+                "acquisitions": self.acquisitions,
+                "reentries": self.reentries,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import FilamentSpule, FilamentTyp
+
+# ----------------------------
+# Lagerstand je Filament-Typ: ein GROUP BY über filament_spule liefert Anzahl, Rest- und
+# Gesamtmenge pro Typ, ohne einzelne Spulen zu laden. Die Einstufung "leer"/"fastleer"
+# läuft danach auf diesen Summen (O(Typen)).
+#
+# Zwei Regeln, beide per Umgebungsvariablen einstellbar:
+#   - ABSOLUT (Dashboard, /fastleere_data): Rest < STOCK_FASTLEER_REST_G (Standard 800 g)
+#   - ANTEIL  (/api/status/low_stock_types): Rest <= STOCK_FASTLEER_ANTEIL der Gesamtmenge
+#             (Standard 10 %), bei unbekannter Gesamtmenge Rest <= STOCK_FASTLEER_FALLBACK_G (100 g)
+# ----------------------------
+
+
+@dataclass(frozen=True)
+class StockThresholds:
+    # Leer, sobald die Restmenge aller Spulen <= 0 ist (sonst nur bei 0 Spulen)
+    leer_bei_null_rest: bool = False
+    fastleer_rest_g: Optional[float] = None
+    fastleer_anteil: Optional[float] = None
+    fastleer_fallback_g: Optional[float] = None
+
+    def classify(self, anzahl_spulen: int, restmenge: float, gesamtmenge: float) -> Optional[str]:
+        if anzahl_spulen == 0 or (self.leer_bei_null_rest and restmenge <= 0):
+            return "leer"
+        if self.fastleer_rest_g is not None and restmenge < self.fastleer_rest_g:
+            return "fastleer"
+        if self.fastleer_anteil is not None:
+            if gesamtmenge > 0:
+                if restmenge <= gesamtmenge * self.fastleer_anteil:
+                    return "fastleer"
+            elif self.fastleer_fallback_g is not None and restmenge <= self.fastleer_fallback_g:
+                return "fastleer"
+        return None
+
+
+ABSOLUT = StockThresholds(
+    fastleer_rest_g=float(os.getenv("STOCK_FASTLEER_REST_G", "800")),
+)
+ANTEIL = StockThresholds(
+    leer_bei_null_rest=True,
+    fastleer_anteil=float(os.getenv("STOCK_FASTLEER_ANTEIL", "0.10")),
+    fastleer_fallback_g=float(os.getenv("STOCK_FASTLEER_FALLBACK_G", "100")),
+)
+
+
+def type_stock_levels(db: Session, thresholds: StockThresholds) -> list[dict[str, Any]]:
+    """Alle Typen mit aggregiertem Bestand und Status (None = ausreichend)."""
+    rows = (
+        db.query(
+            FilamentTyp.id,
+            FilamentTyp.name,
+            FilamentTyp.material,
+            FilamentTyp.farbe,
+            FilamentTyp.durchmesser,
+            FilamentTyp.hersteller,
+            FilamentTyp.bildname,
+            func.count(FilamentSpule.spulen_id).label("anzahl_spulen"),
+            func.coalesce(func.sum(FilamentSpule.restmenge), 0).label("restmenge"),
+            func.coalesce(func.sum(FilamentSpule.gesamtmenge), 0).label("gesamtmenge"),
+        )
+        .outerjoin(FilamentSpule, FilamentSpule.typ_id == FilamentTyp.id)
+        .group_by(
+            FilamentTyp.id,
+            FilamentTyp.name,
+            FilamentTyp.material,
+            FilamentTyp.farbe,
+            FilamentTyp.durchmesser,
+            FilamentTyp.hersteller,
+            FilamentTyp.bildname,
+        )
+        .order_by(FilamentTyp.id)
+        .all()
+    )
+    result = []
+    for row in rows:
+        anzahl_spulen = int(row.anzahl_spulen or 0)
+        restmenge = float(row.restmenge or 0)
+        gesamtmenge = float(row.gesamtmenge or 0)
+        result.append({
+            "id": row.id,
+            "name": row.name,
+            "material": row.material,
+            "farbe": row.farbe,
+            "durchmesser": row.durchmesser,
+            "hersteller": row.hersteller,
+            "bildname": row.bildname,
+            "anzahl_spulen": anzahl_spulen,
+            "restmenge": restmenge,
+            "gesamtmenge": gesamtmenge,
+            "status": thresholds.classify(anzahl_spulen, restmenge, gesamtmenge),
+        })
+    return result
+
+
+def low_stock_types(db: Session, thresholds: StockThresholds) -> list[dict[str, Any]]:
+    """Nur die Typen, die leer oder fast leer sind."""
+    return [row for row in type_stock_levels(db, thresholds) if row["status"] is not None]
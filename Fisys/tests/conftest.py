@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Module lesen DATABASE_URL/SECRET_KEY beim Import: vor allen Imports setzen
+_DATA_DIR = tempfile.mkdtemp(prefix="fisys-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_DATA_DIR, 'fisys.db')}")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
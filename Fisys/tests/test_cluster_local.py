@@ -0,0 +1,85 @@
+import json
+import threading
+
+import cluster
+from cluster import LocalBackend
+
+
+def _start(backend, received):
+    backend.start(on_message=received.append, on_leadership=lambda _is_leader: None)
+    return backend
+
+
+def test_only_one_local_worker_becomes_leader(tmp_path, monkeypatch):
+    first = _start(LocalBackend(str(tmp_path)), [])
+    # Zweiter Worker im selben Prozess: eigene WORKER_ID, eigener Lock-Deskriptor
+    monkeypatch.setattr(cluster, "WORKER_ID", "other-worker")
+    second = _start(LocalBackend(str(tmp_path)), [])
+    try:
+        assert first.is_leader is True
+        assert second.is_leader is False
+
+        first.stop()
+        second._try_lead()
+        assert second.is_leader is True
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_local_workers_receive_each_others_messages(tmp_path, monkeypatch):
+    leader_messages: list = []
+    follower_messages: list = []
+    leader = _start(LocalBackend(str(tmp_path)), leader_messages)
+    monkeypatch.setattr(cluster, "WORKER_ID", "follower")
+    follower = _start(LocalBackend(str(tmp_path)), follower_messages)
+    try:
+        follower.publish({"kind": "sync_request"})
+        deadline = threading.Event()
+        for _ in range(50):
+            if leader_messages:
+                break
+            deadline.wait(0.05)
+        assert leader_messages == [{"kind": "sync_request", "origin": "follower", "seq": 1}]
+        # Eigene Nachrichten kommen nicht zurück
+        assert follower_messages == []
+    finally:
+        leader.stop()
+        follower.stop()
+
+
+def test_missing_sequence_numbers_trigger_a_resync(tmp_path):
+    gaps = []
+    received = []
+    backend = LocalBackend(str(tmp_path))
+    backend._on_message = received.append
+    backend._on_gap = lambda: gaps.append(1)
+
+    def _deliver(message):
+        backend._dispatch(json.dumps({"origin": "peer", **message}))
+
+    _deliver({"kind": "inventory_revision", "seq": 1})
+    _deliver({"kind": "heartbeat", "seq": 1})
+    assert gaps == []
+    # Nachricht 2 ging verloren (voller Puffer, Reconnect)
+    _deliver({"kind": "catalog_cache", "seq": 3})
+    assert len(gaps) == 1
+    # Verlorene letzte Nachricht: erst der Heartbeat verrät sie
+    _deliver({"kind": "heartbeat", "seq": 4})
+    assert len(gaps) == 2
+    assert [message["kind"] for message in received] == ["inventory_revision", "catalog_cache"]
+    assert backend.gaps == 2
+
+
+def test_resync_invalidates_message_driven_caches():
+    import main
+
+    main.init_db()
+    revision = main.inventory_revision.revision
+    main.catalog_cache.get_or_build("typs", None, {"filament_typ"}, lambda: b"[]")
+    assert main.catalog_cache.stats()["entries"] >= 1
+
+    main._resync_cluster_caches()
+
+    assert main.inventory_revision.revision == revision + 1
+    assert main.catalog_cache.stats()["entries"] == 0
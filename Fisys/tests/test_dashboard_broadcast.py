@@ -0,0 +1,71 @@
+import asyncio
+
+from dashboard_broadcast import OVERFLOW_CLOSE_CODE, DashboardBroadcaster
+
+
+class FakeWebSocket:
+    def __init__(self, block: bool = False):
+        self.sent: list[str] = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+        if not block:
+            self.gate.set()
+
+    async def send_text(self, text: str) -> None:
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed_with = code
+
+
+def test_overflow_disconnects_instead_of_dropping_events():
+    async def scenario():
+        broadcaster = DashboardBroadcaster(max_pending=3)
+        ws = FakeWebSocket(block=True)
+        broadcaster.add(ws)
+        for spule_id in range(10):
+            broadcaster.publish({"event": "spule_updated", "spule_id": spule_id})
+        await asyncio.sleep(0.05)
+        return broadcaster, ws
+
+    broadcaster, ws = asyncio.run(scenario())
+    assert ws.closed_with == OVERFLOW_CLOSE_CODE
+    assert broadcaster.overflow_disconnects == 1
+    assert len(broadcaster) == 0
+
+
+def test_printer_snapshots_are_coalesced_without_overflow():
+    async def scenario():
+        broadcaster = DashboardBroadcaster(max_pending=3)
+        ws = FakeWebSocket(block=True)
+        broadcaster.add(ws)
+        for percent in range(50):
+            broadcaster.publish({"serial": "A", "percent": percent})
+        ws.gate.set()
+        await asyncio.sleep(0.05)
+        return broadcaster, ws
+
+    broadcaster, ws = asyncio.run(scenario())
+    assert ws.closed_with is None
+    assert len(ws.sent) == 1 and '"percent":49' in ws.sent[0]
+
+
+def test_printer_subscription_filters_other_printers():
+    async def scenario():
+        broadcaster = DashboardBroadcaster()
+        ws = FakeWebSocket()
+        broadcaster.add(ws)
+        broadcaster.handle_client_message(ws, '{"action": "subscribe", "topics": ["printer:A", "spule"]}')
+        broadcaster.publish({"serial": "A", "percent": 10})
+        broadcaster.publish({"serial": "B", "percent": 20})
+        broadcaster.publish({"event": "spule_updated", "spule_id": 1})
+        broadcaster.publish({"event": "debug", "serial": "B"})
+        await asyncio.sleep(0.05)
+        return ws
+
+    ws = asyncio.run(scenario())
+    assert any('"subscribed"' in text for text in ws.sent)
+    assert any('"serial":"A"' in text for text in ws.sent)
+    assert not any('"B"' in text for text in ws.sent)
+    assert any('"spule_updated"' in text for text in ws.sent)
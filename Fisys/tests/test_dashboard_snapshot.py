@@ -0,0 +1,95 @@
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from dashboard_snapshot import DashboardSnapshot
+from db import engine, init_db
+from models import FilamentTyp
+
+
+def _counting_snapshot(before_track=None):
+    init_db()
+    factory = sessionmaker(bind=engine)
+    snapshot = DashboardSnapshot(factory)
+    if before_track:
+        before_track(snapshot, factory)
+    builds = {"zaehler": 0}
+
+    def _delta(value, changes):
+        typen = changes["filament_typ"]
+        if typen.deleted:
+            return None
+        value["typen"] += len(typen.inserted)
+        return value
+
+    @snapshot.section("zaehler", tables={"filament_typ"}, delta=_delta)
+    def _zaehler(db):
+        builds["zaehler"] += 1
+        return {"typen": db.query(FilamentTyp).count(), "_intern": 1}
+
+    snapshot.track(factory)
+    return snapshot, factory, builds
+
+
+def _add_typ(factory) -> int:
+    session = factory()
+    try:
+        typ = FilamentTyp(name="Delta", material="PLA", farbe="blau", durchmesser=1.75, leergewicht=200)
+        session.add(typ)
+        session.commit()
+        return typ.id
+    finally:
+        session.close()
+
+
+def test_insert_is_applied_as_delta_without_rebuild():
+    snapshot, factory, builds = _counting_snapshot()
+    before = snapshot.get()
+    assert "_intern" not in before
+
+    _add_typ(factory)
+    after = snapshot.get()
+
+    assert builds["zaehler"] == 1
+    assert after["typen"] == before["typen"] + 1
+    assert after["snapshot_version"] > before["snapshot_version"]
+    assert snapshot.deltas_applied == 1
+
+
+def test_change_without_delta_falls_back_to_rebuild():
+    snapshot, factory, builds = _counting_snapshot()
+    typ_id = _add_typ(factory)
+    before = snapshot.get()
+
+    session = factory()
+    try:
+        session.delete(session.get(FilamentTyp, typ_id))
+        session.commit()
+    finally:
+        session.close()
+    after = snapshot.get()
+
+    assert builds["zaehler"] == 2
+    assert after["typen"] == before["typen"] - 1
+
+
+def test_rebuild_overlapping_a_commit_is_not_double_counted():
+    def _rebuild_before_after_commit(snapshot, factory):
+        # Läuft vor dem after_commit des Snapshots: der Neuaufbau sieht die Zeile schon
+        @event.listens_for(factory, "after_commit")
+        def _rebuild(_session):
+            if rebuild_on_commit:
+                rebuild_on_commit.pop()
+                snapshot.get()
+
+    rebuild_on_commit = []
+    snapshot, factory, builds = _counting_snapshot(_rebuild_before_after_commit)
+    before = snapshot.get()["typen"]
+
+    snapshot.invalidate()
+    rebuild_on_commit.append(True)
+    _add_typ(factory)
+    after = snapshot.get()
+
+    assert after["typen"] == before + 1
+    assert snapshot.deltas_applied == 0
+    assert builds["zaehler"] == 3
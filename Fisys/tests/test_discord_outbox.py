@@ -0,0 +1,284 @@
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+import discord_outbox
+import fake_discord_server
+from db import SessionLocal, init_db
+from models import DiscordBotConfig, DiscordNotificationSubscription, DiscordOutbox, User
+
+
+def _subscriber(session, discord_id: str) -> DiscordNotificationSubscription:
+    user = User(username=f"user-{uuid.uuid4().hex[:8]}", password_hash="x", rolle="user", discord_id=discord_id)
+    session.add(user)
+    session.flush()
+    subscription = DiscordNotificationSubscription(user_id=user.id, printer_serial="SERIAL-AGG", job_name="Job")
+    session.add(subscription)
+    session.flush()
+    return subscription
+
+
+def test_deleting_member_of_aggregated_message_removes_it():
+    init_db()
+    session = SessionLocal()
+    try:
+        first = _subscriber(session, "111111")
+        second = _subscriber(session, "222222")
+        entry = discord_outbox.enqueue(session, [first, second], "<@111111> <@222222> Druck fertig")
+        session.commit()
+
+        discord_outbox.cancel_for_subscription(session, first)
+        session.delete(first)
+        session.commit()
+
+        session.refresh(entry)
+        assert entry.status == 'pending'
+        assert discord_outbox._entry_subscription_ids(entry) == [second.id]
+        assert entry.content == "<@222222> Druck fertig"
+
+        discord_outbox.cancel_for_subscription(session, second)
+        session.delete(second)
+        session.commit()
+
+        session.refresh(entry)
+        assert entry.status == 'cancelled'
+    finally:
+        session.close()
+
+
+def test_aggregated_message_appends_mentions_and_is_rebuilt_on_cancel():
+    init_db()
+    session = SessionLocal()
+    try:
+        first = _subscriber(session, "121212")
+        second = _subscriber(session, "343434")
+        template = "Hey {username}, {job_name} ist fertig!"
+        context = {"job_name": "Benchy"}
+        users = [first.user, second.user]
+        content = discord_outbox.aggregate_message(template, context, users)
+        # Vorlage ohne {discord_mention}: Erwähnungen werden angehängt
+        assert content == f"Hey {first.user.username}, {second.user.username}, Benchy ist fertig!\n<@121212> <@343434>"
+        entry = discord_outbox.enqueue(session, [first, second], content, template=template, context=context)
+        session.commit()
+
+        discord_outbox.cancel_for_subscription(session, first)
+        session.delete(first)
+        session.commit()
+
+        session.refresh(entry)
+        assert entry.content == f"Hey {second.user.username}, Benchy ist fertig!\n<@343434>"
+        assert first.user.username not in entry.content
+    finally:
+        session.close()
+
+
+def test_aggregated_message_without_live_subscriptions_is_not_sent():
+    init_db()
+    session = SessionLocal()
+    try:
+        first = _subscriber(session, "333333")
+        second = _subscriber(session, "444444")
+        entry = discord_outbox.enqueue(session, [first, second], "<@333333> <@444444> Druck fertig")
+        session.commit()
+        # Abos ohne cancel_for_subscription entfernt (z. B. mit dem Benutzer gelöscht)
+        session.delete(first)
+        session.delete(second)
+        session.commit()
+
+        kept = discord_outbox.DiscordOutboxWorker()._drop_orphaned(session, [entry])
+        assert kept == []
+        assert entry.status == 'cancelled'
+    finally:
+        session.close()
+
+
+# ----------------------------
+# Zustell-Worker gegen fake_discord_server.py (echte HTTP-Aufrufe auf einen lokalen Port)
+# ----------------------------
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def fake_discord(monkeypatch):
+    """Startet den Fake-Server mit den übergebenen Optionen und richtet Outbox und Bot-Config darauf aus."""
+    init_db()
+    servers = []
+    worker = discord_outbox.DiscordOutboxWorker()
+    worker._running = True
+
+    def _start(*argv: str) -> discord_outbox.DiscordOutboxWorker:
+        server = fake_discord_server.start(["--port", "0", *argv])
+        servers.append(server)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        monkeypatch.setattr(discord_outbox, "DISCORD_API_BASE", base)
+        session = SessionLocal()
+        try:
+            # Offene Einträge anderer Tests nicht mitsenden
+            session.query(DiscordOutbox).filter(DiscordOutbox.status == 'pending').update({"status": "cancelled"})
+            config = session.get(DiscordBotConfig, 1) or DiscordBotConfig(id=1)
+            config.enabled = True
+            config.use_dm = False
+            config.webhook_url = f"{base}/webhooks/1/test"
+            config.bot_token = "fake-token"
+            config.channel_id = None
+            session.add(config)
+            session.commit()
+        finally:
+            session.close()
+        return worker
+
+    try:
+        yield _start
+    finally:
+        worker._running = False
+        worker._executor.shutdown(wait=True)
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        with discord_outbox._dm_lock:
+            discord_outbox._dm_channels.clear()
+        session = SessionLocal()
+        try:
+            config = session.get(DiscordBotConfig, 1)
+            if config is not None:
+                config.enabled = False
+                session.commit()
+        finally:
+            session.close()
+
+
+def _queue(content: str, discord_id: str = None) -> int:
+    session = SessionLocal()
+    try:
+        subscription = _subscriber(session, discord_id or "777777")
+        entry = discord_outbox.enqueue(session, [subscription], content, discord_id=discord_id)
+        session.commit()
+        return entry.id
+    finally:
+        session.close()
+
+
+def _entry(entry_id: int) -> DiscordOutbox:
+    session = SessionLocal()
+    try:
+        return session.get(DiscordOutbox, entry_id)
+    finally:
+        session.close()
+
+
+def test_rate_limited_message_waits_for_retry_after_then_succeeds(fake_discord):
+    worker = fake_discord("--limit", "1", "--window", "0.5")
+    entry_ids = [_queue("erste Nachricht"), _queue("zweite Nachricht")]
+
+    wait = worker.process_due()
+
+    assert fake_discord_server.stats["webhooks"] == 1
+    assert fake_discord_server.stats["rate_limited"] == 1
+    entries = [_entry(entry_id) for entry_id in entry_ids]
+    assert sorted(entry.status for entry in entries) == ["pending", "sent"]
+    limited = next(entry for entry in entries if entry.status == "pending")
+    assert limited.attempts == 1
+    assert limited.last_error.startswith("HTTP 429")
+    # Retry-After (Rest des Fensters) wird für den Eintrag und als globale Sperre übernommen
+    assert 0 < wait <= 0.5
+    assert (_as_utc(limited.next_attempt_at) - discord_outbox._utcnow()).total_seconds() <= 0.5
+
+    # Vor Ablauf von Retry-After wird nichts gesendet
+    worker.process_due()
+    assert fake_discord_server.stats["rate_limited"] == 1
+    assert _entry(limited.id).status == "pending"
+
+    time.sleep(wait + 0.1)
+    worker.process_due()
+
+    retried = _entry(limited.id)
+    assert retried.status == "sent"
+    assert retried.attempts == 2
+    assert fake_discord_server.stats["webhooks"] == 2
+    assert fake_discord_server.stats["rate_limited"] == 1
+
+
+def test_server_errors_back_off_exponentially(fake_discord, monkeypatch):
+    monkeypatch.setattr(discord_outbox, "BACKOFF_BASE_SECONDS", 0.2)
+    worker = fake_discord("--fail-every", "1")
+    entry_id = _queue("Druck fertig")
+
+    delays = []
+    for _ in range(2):
+        started = discord_outbox._utcnow()
+        worker.process_due()
+        entry = _entry(entry_id)
+        assert entry.status == "pending"
+        assert entry.last_error.startswith("HTTP 500")
+        delay = (_as_utc(entry.next_attempt_at) - started).total_seconds()
+        delays.append(delay)
+        time.sleep(delay + 0.05)
+
+    # Basis 0.2s, verdoppelt je Versuch, ±20 % Jitter
+    assert 0.16 <= delays[0] <= 0.3
+    assert 0.32 <= delays[1] <= 0.55
+    assert worker.retried == 2
+
+    fake_discord_server.args.fail_every = 0
+    worker.process_due()
+
+    entry = _entry(entry_id)
+    assert entry.status == "sent"
+    assert entry.attempts == 3
+    assert fake_discord_server.stats["errors"] == 2
+    assert fake_discord_server.stats["webhooks"] == 1
+
+
+def test_expired_lease_is_claimed_again(fake_discord, monkeypatch):
+    monkeypatch.setattr(discord_outbox, "LEASE_SECONDS", 0.3)
+    worker = fake_discord()
+    entry_id = _queue("Druck fertig")
+
+    # Anderer Prozess least den Eintrag und stirbt vor der Zustellung
+    session = SessionLocal()
+    try:
+        assert discord_outbox.DiscordOutboxWorker()._claim(session, entry_id, 0, discord_outbox._utcnow())
+        session.commit()
+        # Mit veraltetem attempts-Stand kann niemand ein zweites Mal leasen
+        assert not worker._claim(session, entry_id, 0, discord_outbox._utcnow())
+        session.rollback()
+    finally:
+        session.close()
+
+    worker.process_due()
+    assert fake_discord_server.stats["webhooks"] == 0
+    assert _entry(entry_id).status == "pending"
+
+    time.sleep(0.4)
+    worker.process_due()
+
+    entry = _entry(entry_id)
+    assert entry.status == "sent"
+    assert entry.attempts == 2
+    assert fake_discord_server.stats["webhooks"] == 1
+
+
+def test_dm_channel_is_created_once_per_recipient(fake_discord):
+    worker = fake_discord()
+    session = SessionLocal()
+    try:
+        config = session.get(DiscordBotConfig, 1)
+        config.use_dm = True
+        session.commit()
+    finally:
+        session.close()
+
+    first = _queue("erste DM", discord_id="555555")
+    worker.process_due()
+    second = _queue("zweite DM", discord_id="555555")
+    worker.process_due()
+
+    assert _entry(first).status == "sent"
+    assert _entry(second).status == "sent"
+    assert fake_discord_server.stats["dm_channels"] == 1
+    assert fake_discord_server.stats["messages"] == 2
+    assert {item["path"] for item in fake_discord_server.received} == {"/channels/9555555/messages"}
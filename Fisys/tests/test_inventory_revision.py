@@ -0,0 +1,50 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db import engine, init_db
+from inventory_revision import InventoryRevision
+from models import FilamentTyp
+
+
+class _TrackedSession(Session):
+    pass
+
+
+def _counter_bump():
+    # Commit eines anderen Workers, dessen Cluster-Nachricht verloren ging
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE inventory_state SET revision = revision + 1 WHERE id = 1"))
+
+
+def test_missed_cluster_message_is_caught_by_the_db_counter():
+    init_db()
+    stale = []
+    revision = InventoryRevision(check_seconds=0)
+    revision.watch(engine, on_stale=lambda: stale.append(1))
+    revision._check_db()
+    etag = revision.etag()
+
+    _counter_bump()
+    revision._check_db()
+
+    assert revision.etag() != etag
+    assert stale == [1]
+
+
+def test_own_commits_do_not_look_like_foreign_changes():
+    init_db()
+    stale = []
+    revision = InventoryRevision(check_seconds=0)
+    revision.track(_TrackedSession)
+    revision.watch(engine, on_stale=lambda: stale.append(1))
+    revision._check_db()
+
+    with _TrackedSession(bind=engine) as session:
+        session.add(FilamentTyp(name="etag-counter", material="PLA", farbe="Blau", durchmesser=1.75))
+        session.commit()
+        session.delete(session.get(FilamentTyp, session.query(FilamentTyp.id).filter(FilamentTyp.name == "etag-counter").scalar()))
+        session.commit()
+    revision._check_db()
+
+    assert revision.revision == 2
+    assert stale == []
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from password_hashing import ClientAddress, LoginThrottle, throttle_key
+
+
+def _request(peer, forwarded=None):
+    headers = {"x-forwarded-for": forwarded} if forwarded else {}
+    return SimpleNamespace(client=SimpleNamespace(host=peer), headers=headers)
+
+
+def test_failures_are_counted_per_username_and_ip():
+    throttle = LoginThrottle(max_failures=2, window_seconds=60)
+    proxy_ip = "10.0.0.1"
+    for _ in range(2):
+        throttle.failure(throttle_key("Mallory", proxy_ip))
+
+    assert throttle.blocked(throttle_key("mallory ", proxy_ip))
+    # Gleiche IP (z. B. Reverse-Proxy), anderer Benutzer: nicht gesperrt
+    assert not throttle.blocked(throttle_key("alice", proxy_ip))
+    assert not throttle.blocked(throttle_key("mallory", "10.0.0.2"))
+
+
+def test_forwarded_for_is_only_honored_from_trusted_proxies():
+    untrusted = ClientAddress("")
+    assert untrusted(_request("203.0.113.9", "198.51.100.1")) == "203.0.113.9"
+
+    trusted = ClientAddress("10.0.0.0/8, 127.0.0.1")
+    assert trusted(_request("10.1.2.3", "198.51.100.1")) == "198.51.100.1"
+    # Gefälschter linker Eintrag zählt nicht: maßgeblich ist der erste nicht vertrauenswürdige von rechts
+    assert trusted(_request("10.1.2.3", "1.2.3.4, 198.51.100.1, 10.0.0.5")) == "198.51.100.1"
+    assert trusted(_request("203.0.113.9", "198.51.100.1")) == "203.0.113.9"
+    assert trusted(_request("127.0.0.1")) == "127.0.0.1"
+
+
+def test_tracked_keys_are_capped_lru_and_expired(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("password_hashing.time.monotonic", lambda: clock[0])
+    throttle = LoginThrottle(max_failures=1, window_seconds=60, max_keys=3)
+
+    for index in range(3):
+        throttle.failure(("user", f"10.0.0.{index}"))
+    throttle.failure(("user", "10.0.0.0"))  # zuletzt benutzt
+    throttle.failure(("user", "10.0.0.9"))
+
+    assert throttle.stats()["keys"] == 3
+    assert throttle.stats()["evictions"] == 1
+    assert not throttle.blocked(("user", "10.0.0.1"))
+    assert throttle.blocked(("user", "10.0.0.0"))
+
+    clock[0] += 61
+    throttle.failure(("user", "10.0.0.42"))
+    assert throttle.stats()["keys"] == 1
+
+
+def test_one_ip_cannot_spray_many_usernames(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import auth
+    import main
+    from db import init_db
+
+    init_db()
+    monkeypatch.setattr(auth, "ip_throttle", LoginThrottle(max_failures=3, window_seconds=60))
+    monkeypatch.setattr(auth, "login_throttle", LoginThrottle(max_failures=10, window_seconds=60))
+    client = TestClient(main.app)
+
+    def _login(username):
+        response = client.post("/login", data={"benutzername": username, "passwort": "x"}, follow_redirects=False)
+        return response.headers["location"]
+
+    # Jeder Name nur einmal: der Zähler je (Benutzer, IP) greift nie, der je IP schon
+    for index in range(3):
+        assert _login(f"spray-{index}") == "/login?error=user_not_found"
+    assert _login("spray-3") == "/login?error=too_many_attempts"
+    assert not auth.login_throttle.blocked(throttle_key("spray-3", "testclient"))
@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+
+import migrations
+import schema_baseline
+from models import Base
+
+
+def test_migrated_schema_matches_models(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    assert migrations.migrate(engine) == migrations.LATEST_VERSION
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        # Fehlt hier etwas, braucht die Modelländerung einen eigenen Migrationsschritt
+        assert columns == {column.name for column in table.columns}, table.name
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+
+
+def test_model_indexes_are_built_concurrently_on_postgres():
+    dialect = postgresql.dialect()
+    statements = [
+        migrations._concurrent_index_ddl(index, dialect)
+        for table in schema_baseline.metadata.sorted_tables
+        for index in table.indexes
+    ]
+    assert statements
+    assert all(statement.startswith(("CREATE INDEX CONCURRENTLY IF NOT EXISTS", "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS")) for statement in statements)
+    assert getattr(migrations._model_indexes, "outside_transaction", False)
+
+
+def test_current_version_only_treats_missing_table_as_empty(tmp_path):
+    assert migrations.current_version(create_engine(f"sqlite:///{tmp_path / 'empty.db'}")) == 0
+
+    broken = tmp_path / "broken.db"
+    broken.write_bytes(b"kein SQLite" * 200)
+    with pytest.raises(DBAPIError):
+        migrations.current_version(create_engine(f"sqlite:///{broken}"))
+
+
+def test_failed_step_is_raised_and_earlier_steps_stay_recorded(tmp_path, monkeypatch):
+    def _broken(conn):
+        raise RuntimeError("kaputt")
+
+    steps = [*migrations.MIGRATIONS, (migrations.LATEST_VERSION + 1, "broken", _broken)]
+    monkeypatch.setattr(migrations, "MIGRATIONS", steps)
+    monkeypatch.setattr(migrations, "LATEST_VERSION", migrations.LATEST_VERSION + 1)
+    engine = create_engine(f"sqlite:///{tmp_path / 'failing.db'}")
+
+    with pytest.raises(RuntimeError, match="kaputt"):
+        migrations.migrate(engine)
+    assert migrations.current_version(engine) == migrations.LATEST_VERSION - 1
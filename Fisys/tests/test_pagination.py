@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+import migrations
+from db import SessionLocal, init_db
+from models import PrinterJobHistory
+from pagination import keyset_page
+
+
+def _page(query, limit, cursor):
+    return keyset_page(query, PrinterJobHistory.created_at, PrinterJobHistory.id, limit, cursor)
+
+
+def test_pages_across_rows_sharing_a_timestamp():
+    init_db()
+    same = datetime(2026, 4, 1, 12, 0, 0, 123456)
+    stamps = [same] * 5 + [datetime(2026, 4, 1, 12, 0, 0, 123457), datetime(2026, 4, 1, 12, 0, 0, 123000)]
+    with SessionLocal() as session:
+        jobs = [PrinterJobHistory(printer_serial="KEYSET-TIE", status="ok", created_at=stamp) for stamp in stamps]
+        session.add_all(jobs)
+        session.commit()
+        expected = [job.id for job in sorted(jobs, key=lambda job: (job.created_at, job.id), reverse=True)]
+
+        query = session.query(PrinterJobHistory).filter(PrinterJobHistory.printer_serial == "KEYSET-TIE")
+        pages, prev_cursor, cursor = [], None, None
+        while True:
+            rows, next_cursor, prev_cursor = _page(query, 2, cursor)
+            pages.append([row.id for row in rows])
+            if not next_cursor:
+                break
+            cursor = next_cursor
+
+        assert [ident for page in pages for ident in page] == expected
+        assert all(len(page) == 2 for page in pages[:-1])
+        # Zurückblättern von der letzten Seite liefert die vorletzte
+        previous, _, _ = _page(query, 2, prev_cursor)
+        assert [row.id for row in previous] == pages[-2]
+
+
+def test_migration_rewrites_current_timestamp_values(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'timestamps.db'}")
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO printer_job_history (printer_serial, status, created_at) VALUES ('X', 'ok', '2026-04-01 12:00:00')"))
+        conn.execute(text("INSERT INTO printer_job_history (printer_serial, status, created_at) VALUES ('X', 'ok', '2026-04-01 12:00:00.500000')"))
+        migrations._canonical_log_timestamps(conn)
+        values = conn.execute(text("SELECT created_at FROM printer_job_history ORDER BY id")).scalars().all()
+    assert values == ["2026-04-01 12:00:00.000000", "2026-04-01 12:00:00.500000"]
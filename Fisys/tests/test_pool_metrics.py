@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from pool_metrics import PoolMetrics, metered
+
+
+def test_checkouts_waits_and_timeouts_are_counted(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=metered(QueuePool),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    metrics = PoolMetrics.attach(engine.pool, max_overflow=0)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            assert metrics.stats()["in_use"] == 1
+            # Einziger Slot belegt: der zweite Checkout wartet und läuft in pool_timeout
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+        with engine.connect():
+            pass
+
+        stats = metrics.stats()
+        assert stats["checkouts"] == 2
+        assert stats["checkins"] == 2
+        assert stats["in_use"] == 0
+        assert stats["peak_in_use"] == 1
+        assert stats["connects"] == 1
+        assert stats["waits"] == 0
+        assert stats["timeouts"] == 1
+        assert stats["size"] == 1
+    finally:
+        engine.dispose()
+
+
+def test_wait_for_free_slot_is_measured_and_survives_dispose(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'wait.db'}", poolclass=metered(QueuePool), pool_size=1, max_overflow=0)
+    metrics = PoolMetrics.attach(engine.pool, max_overflow=0)
+    try:
+        held = engine.connect()
+        threading.Timer(0.1, held.close).start()
+        with engine.connect():
+            pass
+        stats = metrics.stats()
+        assert stats["waits"] == 1
+        assert stats["wait_ms_total"] >= 80
+
+        # dispose() legt einen neuen Pool an: Messung und Zähler laufen dort weiter
+        engine.dispose()
+        with engine.connect():
+            pass
+        assert metrics.pool is engine.pool
+        assert metrics.stats()["checkouts"] == 3
+        assert len(metrics._latencies) == 3
+    finally:
+        engine.dispose()
+
+
+def test_pool_stats_report_sync_and_async_engine():
+    from db import AsyncSessionLocal, SessionLocal, init_db, pool_stats
+
+    init_db()
+    with SessionLocal() as session:
+        session.execute(text("SELECT 1"))
+
+    async def _read():
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+
+    asyncio.run(_read())
+
+    stats = pool_stats()
+    assert stats["engine"]["checkouts"] >= 1
+    assert stats["async_engine"]["checkouts"] >= 1
+    assert stats["async_engine"]["in_use"] == 0
+
+
+def test_debug_endpoints_require_admin_or_mod():
+    from fastapi.testclient import TestClient
+
+    import auth
+    import main
+    from db import SessionLocal, init_db
+    from models import User
+
+    init_db()
+    session = SessionLocal()
+    try:
+        for username, rolle in (("debug-admin", "admin"), ("debug-user", "user")):
+            if not session.query(User).filter_by(username=username).first():
+                session.add(User(username=username, password_hash="x", rolle=rolle))
+        session.commit()
+    finally:
+        session.close()
+
+    paths = ("/_debug/db-pool", "/_debug/work-queue", "/_debug/discord-outbox", "/_debug/response-cache")
+    anonymous = TestClient(main.app)
+    user = TestClient(main.app, cookies={"benutzer": auth.serializer.dumps({"username": "debug-user"})})
+    admin = TestClient(main.app, cookies={"benutzer": auth.serializer.dumps({"username": "debug-admin"})})
+    for path in paths:
+        assert anonymous.get(path).status_code in (401, 403), path
+        assert user.get(path).status_code == 403, path
+        assert admin.get(path).status_code == 200, path
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from db import SessionLocal, engine, init_db
+from models import FilamentSpule, FilamentTyp
+
+
+@contextmanager
+def _count_queries():
+    statements: list[str] = []
+
+    def _record(_conn, _cursor, statement, *_args) -> None:
+        # Periodischer Abgleich des ETag-Zählers (inventory_revision.py) gehört nicht zum Endpunkt
+        if "inventory_state" not in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+
+def _add_types(count: int, spools_per_type: int) -> int:
+    session = SessionLocal()
+    try:
+        last_id = None
+        for index in range(count):
+            typ = FilamentTyp(name=f"Typ {index}", material="PLA", farbe="rot", durchmesser=1.75, leergewicht=200)
+            session.add(typ)
+            session.flush()
+            for _ in range(spools_per_type):
+                session.add(FilamentSpule(typ_id=typ.id, gesamtmenge=1000, restmenge=500))
+            last_id = typ.id
+        session.commit()
+        return last_id
+    finally:
+        session.close()
+
+
+def _queries_per_endpoint(client: TestClient, typ_id: int) -> dict[str, int]:
+    counts = {}
+    for path in ("/typs/", f"/typs/{typ_id}", f"/api/typ/{typ_id}", "/spulen/"):
+        # Ohne Antwort-Cache messen: sonst zählt /typs/ beim zweiten Lauf gar keine Abfrage
+        main.catalog_cache.invalidate()
+        with _count_queries() as statements:
+            response = client.get(path)
+        assert response.status_code == 200, path
+        counts[path.replace(str(typ_id), "{id}")] = len(statements)
+    return counts
+
+
+def test_catalog_reads_use_constant_number_of_queries():
+    init_db()
+    client = TestClient(main.app)
+
+    small = _queries_per_endpoint(client, _add_types(2, 1))
+    large = _queries_per_endpoint(client, _add_types(20, 5))
+
+    assert small == large
+    # Typen + Spulen (selectin) bzw. Spulen mit Typ (join): höchstens zwei Abfragen je Endpunkt
+    assert all(1 <= count <= 2 for count in large.values()), large
@@ -0,0 +1,73 @@
+from response_cache import ResponseCache
+
+
+def _builder(body, calls):
+    def _build():
+        calls.append(body)
+        return body
+
+    return _build
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache({"a"}, max_entries=2, max_bytes=1024)
+    calls = []
+    cache.get_or_build("one", None, {"a"}, _builder(b"1", calls))
+    cache.get_or_build("two", None, {"a"}, _builder(b"2", calls))
+    # "one" wieder benutzt: "two" ist jetzt der älteste Eintrag
+    cache.get_or_build("one", None, {"a"}, _builder(b"1", calls))
+    cache.get_or_build("three", None, {"a"}, _builder(b"3", calls))
+
+    assert calls == [b"1", b"2", b"3"]
+    cache.get_or_build("one", None, {"a"}, _builder(b"1", calls))
+    cache.get_or_build("two", None, {"a"}, _builder(b"2", calls))
+    assert calls == [b"1", b"2", b"3", b"2"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_total_bytes_are_bounded():
+    cache = ResponseCache({"a"}, max_entries=10, max_bytes=10)
+    calls = []
+    cache.get_or_build("one", None, {"a"}, _builder(b"x" * 6, calls))
+    cache.get_or_build("two", None, {"a"}, _builder(b"y" * 6, calls))
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == 6
+
+    # Größer als das ganze Budget: wird ausgeliefert, aber nie gespeichert
+    body = cache.get_or_build("huge", None, {"a"}, _builder(b"z" * 11, calls))
+    assert body == b"z" * 11
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == 6
+
+
+def test_invalidation_only_drops_entries_of_changed_tables():
+    cache = ResponseCache({"typ", "spule", "bild"})
+    calls = []
+    cache.get_or_build("typs", None, {"typ"}, _builder(b"typs", calls))
+    cache.get_or_build("spulen", {"offen": "1"}, {"typ", "spule"}, _builder(b"spulen", calls))
+
+    cache.invalidate({"spule"})
+    cache.get_or_build("typs", None, {"typ"}, _builder(b"typs", calls))
+    cache.get_or_build("spulen", {"offen": "1"}, {"typ", "spule"}, _builder(b"spulen", calls))
+    assert calls == [b"typs", b"spulen", b"spulen"]
+    assert cache.stats()["invalidations"] == 1
+
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_result_built_during_invalidation_is_not_stored():
+    cache = ResponseCache({"typ"})
+    calls = []
+
+    def _stale_build():
+        calls.append("stale")
+        # Ein Commit invalidiert, während die Antwort noch gebaut wird
+        cache.invalidate({"typ"})
+        return b"alt"
+
+    assert cache.get_or_build("typs", None, {"typ"}, _stale_build) == b"alt"
+    assert cache.stats()["entries"] == 0
+    assert cache.get_or_build("typs", None, {"typ"}, _builder(b"neu", calls)) == b"neu"
+    assert calls == ["stale", b"neu"]
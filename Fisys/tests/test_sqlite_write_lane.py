@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from sqlite_write_lane import SQLiteWriteLane, WriteLaneTimeout
+
+
+def test_nested_session_on_same_thread_joins_without_waiting():
+    lane = SQLiteWriteLane(timeout=5)
+    outer, inner = object(), object()
+    lane.enter(outer)
+
+    started = time.monotonic()
+    lane.enter(inner)
+    assert time.monotonic() - started < 0.5
+    assert lane.stats()["reentries"] == 1
+
+    entered = threading.Event()
+
+    def _other_writer():
+        lane.enter("other")
+        entered.set()
+        lane.leave("other")
+
+    thread = threading.Thread(target=_other_writer)
+    thread.start()
+    # Die Spur bleibt belegt, solange noch einer der beiden Halter schreibt
+    lane.leave(outer)
+    assert not entered.wait(0.2)
+    lane.leave(inner)
+    assert entered.wait(2)
+    thread.join(2)
+
+
+def test_busy_lane_times_out_instead_of_writing_unserialized():
+    lane = SQLiteWriteLane(timeout=0.1)
+    holder_ready = threading.Event()
+    release = threading.Event()
+
+    def _holder():
+        lane.enter("holder")
+        holder_ready.set()
+        release.wait(2)
+        lane.leave("holder")
+
+    thread = threading.Thread(target=_holder)
+    thread.start()
+    try:
+        assert holder_ready.wait(2)
+        with pytest.raises(WriteLaneTimeout):
+            lane.enter("late")
+        assert not lane.holds("late")
+        assert lane.stats()["timeouts"] == 1
+    finally:
+        release.set()
+        thread.join(2)
+
+
+def _typ(name):
+    from models import FilamentTyp
+
+    return FilamentTyp(name=name, material="PLA", farbe="Rot", durchmesser=1.75)
+
+
+def _cleanup(prefix):
+    from db import SessionLocal
+    from models import FilamentTyp
+
+    with SessionLocal() as session:
+        session.query(FilamentTyp).filter(FilamentTyp.name.like(f"{prefix}%")).delete(synchronize_session=False)
+        session.commit()
+
+
+def test_async_and_sync_writers_are_serialized():
+    from db import AsyncSessionLocal, SessionLocal, async_write_lane, init_db, write_lane
+
+    init_db()
+    order = []
+    async_flushed = threading.Event()
+    waits_before = write_lane.stats()["waits"]
+
+    def _sync_writer():
+        assert async_flushed.wait(2)
+        with SessionLocal() as session:
+            session.add(_typ("lane-serial-sync"))
+            session.flush()
+            order.append("sync-flushed")
+            session.commit()
+
+    async def _main():
+        thread = threading.Thread(target=_sync_writer)
+        thread.start()
+        async with AsyncSessionLocal() as db:
+            async with async_write_lane(db):
+                await db.run_sync(lambda session: (session.add(_typ("lane-serial-async")), session.flush()))
+                async_flushed.set()
+                # Die Spur bleibt über await hinweg belegt: der sync Schreiber wartet
+                await asyncio.sleep(0.2)
+                await db.commit()
+                order.append("async-committed")
+        await asyncio.to_thread(thread.join, 2)
+
+    try:
+        asyncio.run(_main())
+        assert order == ["async-committed", "sync-flushed"]
+        assert write_lane.stats()["waits"] > waits_before
+        assert write_lane.stats()["holders"] == 0
+    finally:
+        _cleanup("lane-serial-")
+
+
+def test_async_writer_waits_for_sync_writer_without_blocking_the_loop():
+    from db import AsyncSessionLocal, SessionLocal, async_write_lane, init_db, write_lane
+    from sqlite_write_lane import WriteLaneBusy
+
+    init_db()
+    order = []
+    sync_flushed = threading.Event()
+    release = threading.Event()
+
+    def _sync_writer():
+        with SessionLocal() as session:
+            session.add(_typ("lane-loop-sync"))
+            session.flush()
+            sync_flushed.set()
+            release.wait(2)
+            session.commit()
+            order.append("sync-committed")
+
+    async def _ticker(ticks):
+        while True:
+            await asyncio.sleep(0.01)
+            ticks.append(1)
+
+    async def _main():
+        thread = threading.Thread(target=_sync_writer)
+        thread.start()
+        assert await asyncio.to_thread(sync_flushed.wait, 2)
+        async with AsyncSessionLocal() as db:
+            # Ohne async_write_lane: kein Warten auf dem Loop, sondern sofortiger Fehler
+            with pytest.raises(WriteLaneBusy):
+                await db.run_sync(lambda session: (session.add(_typ("lane-loop-unguarded")), session.flush()))
+            await db.rollback()
+
+            ticks = []
+            ticker = asyncio.create_task(_ticker(ticks))
+            asyncio.get_running_loop().call_later(0.2, release.set)
+            async with async_write_lane(db):
+                order.append("async-entered")
+                db.add(_typ("lane-loop-async"))
+                await db.commit()
+            ticker.cancel()
+            # Der Loop lief weiter, während auf die Spur gewartet wurde
+            assert len(ticks) >= 5
+        await asyncio.to_thread(thread.join, 2)
+
+    try:
+        asyncio.run(_main())
+        assert order == ["sync-committed", "async-entered"]
+        assert write_lane.stats()["holders"] == 0
+    finally:
+        _cleanup("lane-loop-")
@@ -0,0 +1,47 @@
+from datetime import date, datetime
+
+from sqlalchemy import func, select, text
+
+import verbrauch_rollup
+from db import SessionLocal, engine, init_db
+from models import FilamentTyp, VerbrauchDaily
+
+
+def _typ_id() -> int:
+    session = SessionLocal()
+    try:
+        typ = FilamentTyp(name="Mitternacht", material="PETG", farbe="grün", durchmesser=1.75, leergewicht=200)
+        session.add(typ)
+        session.commit()
+        return typ.id
+    finally:
+        session.close()
+
+
+def test_row_at_midnight_belongs_to_its_own_day():
+    init_db()
+    typ_id = _typ_id()
+    with engine.begin() as conn:
+        # Format des server_default (CURRENT_TIMESTAMP), ohne Mikrosekunden
+        conn.execute(
+            text("INSERT INTO filament_verbrauch (typ_id, verbrauch_in_g, datum) VALUES (:typ_id, 25, '2026-03-02 00:00:00')"),
+            {"typ_id": typ_id},
+        )
+        verbrauch_rollup.refresh_days(conn, [(date(2026, 3, 1), typ_id), (date(2026, 3, 2), typ_id)])
+
+    session = SessionLocal()
+    try:
+        rows = {
+            row.tag: row.verbrauch_in_g
+            for row in session.query(VerbrauchDaily).filter(VerbrauchDaily.typ_id == typ_id)
+        }
+        assert rows == {date(2026, 3, 2): 25}
+
+        # Angebrochener Vortag aus Rohdaten + volle Tage aus dem Rollup: nur einmal gezählt
+        verbrauch = verbrauch_rollup.usage_source(session, datetime(2026, 3, 1, 12, 0))
+        total = session.execute(
+            select(func.sum(verbrauch.c.verbrauch_in_g)).where(verbrauch.c.typ_id == typ_id)
+        ).scalar()
+        assert total == 25
+    finally:
+        session.close()
@@ -0,0 +1,86 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from work_queue import WorkQueue
+
+
+def test_full_queue_rejects_and_counts():
+    gate = threading.Event()
+    jobs = WorkQueue("Test", workers=1, maxsize=1)
+    try:
+        assert jobs.submit(gate.wait) is True
+        # Worker hängt im ersten Auftrag; der zweite belegt den einzigen Platz
+        for _ in range(50):
+            if jobs.stats()["busy"]:
+                break
+            threading.Event().wait(0.01)
+        assert jobs.submit(lambda: None) is True
+        assert jobs.submit(lambda: None) is False
+        stats = jobs.stats()
+        assert stats["depth"] == 1
+        assert stats["rejected"] == 1
+    finally:
+        gate.set()
+        jobs.stop(timeout=2)
+
+
+def test_job_history_is_written_inline_when_queue_is_full(monkeypatch):
+    import main
+    from db import SessionLocal, init_db
+    from models import PrinterJobHistory
+
+    init_db()
+    monkeypatch.setattr(main.background_jobs, "submit", lambda *args, **kwargs: False)
+    monkeypatch.setattr(main, "_process_discord_notifications", lambda *args: None)
+    finished = datetime.now(timezone.utc)
+    entry = {"job_name": "queue-full-job", "start_time": finished - timedelta(minutes=5)}
+
+    main._enqueue_job_finalization("SERIAL-QF", entry, "erfolgreich", finished)
+
+    session = SessionLocal()
+    try:
+        job = session.query(PrinterJobHistory).filter(PrinterJobHistory.job_name == "queue-full-job").one()
+        assert job.status == "erfolgreich"
+        assert job.duration_seconds == 300
+    finally:
+        session.close()
+
+
+def test_discord_notifications_run_inline_when_queue_is_full(monkeypatch):
+    import main
+    from db import init_db
+
+    init_db()
+    calls = []
+    monkeypatch.setattr(main.background_jobs, "submit", lambda *args, **kwargs: False)
+    monkeypatch.setattr(main, "_process_discord_notifications", lambda *args: calls.append(args))
+    finished = datetime.now(timezone.utc)
+
+    main._finalize_printer_job("SERIAL-QN", {"job_name": "queue-full-notify", "start_time": finished}, "erfolgreich", finished)
+
+    assert calls == [("SERIAL-QN", None, "queue-full-notify", "erfolgreich")]
+
+
+def test_overflow_never_runs_on_the_event_loop(monkeypatch):
+    import asyncio
+
+    import main
+
+    threads = []
+    done = threading.Event()
+    monkeypatch.setattr(main.background_jobs, "submit", lambda *args, **kwargs: False)
+
+    def _finalize(*_args):
+        threads.append(threading.get_ident())
+        done.set()
+
+    monkeypatch.setattr(main, "_finalize_printer_job", _finalize)
+
+    async def _hub_callback():
+        # Wie im PrinterHub: Statusmeldung auf einem Event-Loop-Thread
+        main._enqueue_job_finalization("SERIAL-HUB", {"job_name": "hub-job"}, "erfolgreich", datetime.now(timezone.utc))
+        assert await asyncio.to_thread(done.wait, 2)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(_hub_callback())
+    assert threads and threads[0] != loop_thread
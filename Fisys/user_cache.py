@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import User
+
+# ----------------------------
+# Kurzlebiger In-Process-Cache für den eingeloggten Benutzer (Principal).
+# Auflösung Cookie -> Benutzer kostet sonst pro Request eine users-Abfrage. Einträge leben
+# PRINCIPAL_CACHE_TTL Sekunden; Commits, die einen User ändern oder löschen (Rolle, Discord-ID,
+# Löschen), entfernen den Eintrag sofort – auf anderen Workern über den Cluster-Kanal.
+# ----------------------------
+
+TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+_INFO_KEY = "principal_cache_usernames"
+
+ChangeHandler = Callable[[set[str]], None]
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Unveränderliche Sicht auf den eingeloggten Benutzer (nicht an eine Session gebunden)."""
+
+    id: int
+    username: str
+    rolle: str
+    discord_id: Optional[str]
+    last_seen: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            rolle=user.rolle,
+            discord_id=user.discord_id,
+            last_seen=user.last_seen,
+        )
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float = TTL_SECONDS):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[float, Principal]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, username: str) -> Optional[Principal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry and now - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        user = db.query(User).filter(User.username == username).first()
+        if not user:
+            self.invalidate([username])
+            return None
+        principal = Principal.from_user(user)
+        with self._lock:
+            self._entries[username] = (now, principal)
+        return principal
+
+    def invalidate(self, usernames: Optional[Any] = None) -> None:
+        """Entfernt die genannten Benutzer (None: alle)."""
+        with self._lock:
+            if usernames is None:
+                self._entries.clear()
+                return
+            for username in usernames:
+                self._entries.pop(username, None)
+
+    def track(self, session_target: Any, on_change: Optional[ChangeHandler] = None) -> None:
+        """Invalidiert nach jedem Commit, der User-Zeilen angelegt, geändert oder gelöscht hat."""
+
+        @event.listens_for(session_target, "after_flush")
+        def _collect_users(session: Session, _flush_context) -> None:
+            usernames = session.info.setdefault(_INFO_KEY, set())
+            for obj in (*session.dirty, *session.deleted):
+                if isinstance(obj, User):
+                    usernames.add(obj.username)
+
+        @event.listens_for(session_target, "after_commit")
+        def _invalidate_on_commit(session: Session) -> None:
+            usernames = session.info.pop(_INFO_KEY, None)
+            if not usernames:
+                return
+            self.invalidate(usernames)
+            if on_change:
+                try:
+                    on_change(usernames)
+                except Exception as exc:
+                    print(f"[Auth] Benutzer-Cache-Invalidierung konnte nicht verteilt werden: {exc}")
+
+        @event.listens_for(session_target, "after_rollback")
+        def _discard_on_rollback(session: Session) -> None:
+            session.info.pop(_INFO_KEY, None)
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import String, delete, event, func, insert, inspect, literal, select, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from models import FilamentVerbrauch, VerbrauchDaily
+
+# ----------------------------
+# Tagessummen für die Verbrauchs-Statistiken (/api/status/*, Dashboard).
+# verbrauch_daily hält je (UTC-Tag, typ_id) Summe und Anzahl der Einträge aus filament_verbrauch.
+# Gepflegt wird sie über Session-Events: vor dem Flush werden die betroffenen Tage gemerkt
+# (auch der alte Tag/Typ bei Änderungen und gelöschte Einträge), nach dem Flush werden genau
+# diese Tage in derselben Transaktion aus den Rohdaten neu summiert.
+#
+# Nachberechnen (z. B. nach manuellen SQL-Änderungen):  python verbrauch_rollup.py --backfill
+# ----------------------------
+
+_KEYS_INFO = "verbrauch_rollup_keys"
+_IDS_INFO = "verbrauch_rollup_ids"
+_NEW_INFO = "verbrauch_rollup_new"
+
+_daily = VerbrauchDaily.__table__
+
+
+def _day_of(value: datetime) -> date:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date()
+
+
+def _day_start(tag: date) -> datetime:
+    return datetime(tag.year, tag.month, tag.day)
+
+
+def _day_bounds(dialect_name: str, tag: date) -> tuple[Any, Any]:
+    """[Tagesbeginn, Folgetag) eines UTC-Tags als Grenzen für Vergleiche mit filament_verbrauch.datum.
+
+    SQLite speichert DATETIME als Text: der server_default schreibt "YYYY-MM-DD HH:MM:SS",
+    gebundene datetime-Werte "YYYY-MM-DD HH:MM:SS.ffffff". Ein Eintrag um exakt 00:00:00 läge
+    textuell vor der Grenze "... 00:00:00.000000" und fiele in den Vortag. Reine Datums-Strings
+    sortieren vor jedem Zeitpunkt ihres Tages, passen zu beiden Formaten und lassen den Index nutzbar.
+    """
+    next_day = tag + timedelta(days=1)
+    if dialect_name == "sqlite":
+        return literal(tag.isoformat(), String), literal(next_day.isoformat(), String)
+    return (
+        datetime(tag.year, tag.month, tag.day, tzinfo=timezone.utc),
+        datetime(next_day.year, next_day.month, next_day.day, tzinfo=timezone.utc),
+    )
+
+
+def refresh_days(conn: Connection, keys: Iterable[tuple[date, int]]) -> None:
+    """Summiert die angegebenen (Tag, Typ)-Paare neu aus filament_verbrauch."""
+    for tag, typ_id in set(keys):
+        start, end = _day_bounds(conn.dialect.name, tag)
+        total, count = conn.execute(
+            select(func.coalesce(func.sum(FilamentVerbrauch.verbrauch_in_g), 0), func.count(FilamentVerbrauch.id))
+            .where(
+                FilamentVerbrauch.typ_id == typ_id,
+                FilamentVerbrauch.datum >= start,
+                FilamentVerbrauch.datum < end,
+            )
+        ).one()
+        conn.execute(delete(_daily).where(_daily.c.tag == tag, _daily.c.typ_id == typ_id))
+        if count:
+            conn.execute(insert(_daily).values(tag=tag, typ_id=typ_id, verbrauch_in_g=float(total or 0), anzahl=count))
+
+
+def rebuild(conn: Connection) -> int:
+    """Baut verbrauch_daily komplett aus den Rohdaten neu auf. Gibt die Anzahl der Tageszeilen zurück."""
+    totals: dict[tuple[date, int], list[float]] = defaultdict(lambda: [0.0, 0])
+    rows = conn.execute(
+        select(FilamentVerbrauch.typ_id, FilamentVerbrauch.datum, FilamentVerbrauch.verbrauch_in_g)
+        .where(FilamentVerbrauch.datum.is_not(None))
+    )
+    for typ_id, datum, verbrauch in rows:
+        entry = totals[(_day_of(datum), typ_id)]
+        entry[0] += float(verbrauch or 0)
+        entry[1] += 1
+    conn.execute(delete(_daily))
+    if totals:
+        conn.execute(insert(_daily), [
+            {"tag": tag, "typ_id": typ_id, "verbrauch_in_g": total, "anzahl": count}
+            for (tag, typ_id), (total, count) in totals.items()
+        ])
+    return len(totals)
+
+
+def backfill_if_empty(conn: Connection) -> None:
+    """Erster Start mit der neuen Tabelle: Rollup aus vorhandenen Einträgen füllen."""
+    if conn.execute(select(_daily.c.tag).limit(1)).first() is not None:
+        return
+    if conn.execute(select(FilamentVerbrauch.id).limit(1)).first() is None:
+        return
+    rows = rebuild(conn)
+    print(f"[DB] verbrauch_daily aus Verbrauchslog aufgebaut ({rows} Tageszeilen)")
+
+
+def track(session_target: Any) -> None:
+    """Hängt die Pflege von verbrauch_daily an die Flushes von session_target."""
+
+    @event.listens_for(session_target, "before_flush")
+    def _collect_days(session: Session, _flush_context, _instances) -> None:
+        keys = session.info.setdefault(_KEYS_INFO, set())
+        ids = session.info.setdefault(_IDS_INFO, set())
+        new = session.info.setdefault(_NEW_INFO, [])
+        for obj in session.new:
+            if isinstance(obj, FilamentVerbrauch):
+                new.append(obj)
+        for obj in session.dirty:
+            if isinstance(obj, FilamentVerbrauch):
+                state = inspect(obj)
+                old_datum = state.attrs.datum.history.deleted
+                old_typ = state.attrs.typ_id.history.deleted
+                datum = old_datum[0] if old_datum else obj.datum
+                typ_id = old_typ[0] if old_typ else obj.typ_id
+                if datum is not None:
+                    keys.add((_day_of(datum), typ_id))
+                ids.add(obj.id)
+        for obj in session.deleted:
+            if isinstance(obj, FilamentVerbrauch) and obj.datum is not None:
+                keys.add((_day_of(obj.datum), obj.typ_id))
+
+    @event.listens_for(session_target, "after_flush")
+    def _refresh_days(session: Session, _flush_context) -> None:
+        keys = session.info.pop(_KEYS_INFO, set())
+        ids = session.info.pop(_IDS_INFO, set())
+        ids.update(obj.id for obj in session.info.pop(_NEW_INFO, []) if obj.id is not None)
+        if not keys and not ids:
+            return
+        conn = session.connection()
+        if ids:
+            # Neue Einträge bekommen das Datum erst von der Datenbank (server_default)
+            rows = conn.execute(
+                select(FilamentVerbrauch.datum, FilamentVerbrauch.typ_id).where(FilamentVerbrauch.id.in_(ids))
+            )
+            keys.update((_day_of(datum), typ_id) for datum, typ_id in rows if datum is not None)
+        refresh_days(conn, keys)
+
+    @event.listens_for(session_target, "after_rollback")
+    def _discard_on_rollback(session: Session) -> None:
+        for key in (_KEYS_INFO, _IDS_INFO, _NEW_INFO):
+            session.info.pop(key, None)
+
+
+def usage_source(db: Session, since: Optional[datetime] = None):
+    """Subquery (typ_id, tag, verbrauch_in_g) ab `since`.
+
+    Volle Tage kommen aus verbrauch_daily; beginnt `since` mitten am Tag, wird nur dieser
+    angebrochene Tag aus den Rohdaten ergänzt.
+    """
+    rollup = select(_daily.c.typ_id, _daily.c.tag, _daily.c.verbrauch_in_g)
+    if since is None:
+        return rollup.subquery("verbrauch")
+    first_day = _day_of(since)
+    if since.replace(tzinfo=None) == _day_start(first_day):
+        return rollup.where(_daily.c.tag >= first_day).subquery("verbrauch")
+    first_full_day = first_day + timedelta(days=1)
+    _, end = _day_bounds(db.get_bind().dialect.name, first_day)
+    raw = (
+        select(FilamentVerbrauch.typ_id, literal(first_day).label("tag"), FilamentVerbrauch.verbrauch_in_g)
+        .where(FilamentVerbrauch.datum >= since, FilamentVerbrauch.datum < end)
+    )
+    return union_all(rollup.where(_daily.c.tag >= first_full_day), raw).subquery("verbrauch")
+
+
+if __name__ == "__main__":
+    if "--backfill" not in sys.argv[1:]:
+        print("Aufruf: python verbrauch_rollup.py --backfill")
+        sys.exit(1)
+    from db import engine, init_db
+
+    init_db()
+    with engine.begin() as connection:
+        count = rebuild(connection)
+    print(f"verbrauch_daily neu aufgebaut: {count} Tageszeilen")
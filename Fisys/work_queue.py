@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# ----------------------------
+# Begrenzte Hintergrund-Queue mit eigenem Worker-Pool.
+# Für blockierende Arbeit (DB-Commits, HTTP-Aufrufe), die nicht im MQTT-/Sender-Thread
+# oder im Event-Loop laufen soll. Ist die Queue voll, wird der Auftrag abgelehnt statt zu blockieren
+# (submit() liefert False) – Aufrufer, deren Arbeit nicht verloren gehen darf, führen sie dann selbst aus.
+# ----------------------------
+
+
+class WorkQueue:
+    def __init__(self, name: str, workers: int = 2, maxsize: int = 200):
+        self.name = name
+        self.workers = max(1, workers)
+        self.capacity = max(1, maxsize)
+        self._queue: "queue.Queue[Optional[tuple[Callable[..., Any], tuple, dict]]]" = queue.Queue(maxsize=self.capacity)
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._stopped = False
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        with self._lock:
+            self._stopped = False
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        if self._stopped:
+            print(f"[{self.name}] gestoppt – Auftrag {getattr(fn, '__name__', fn)} verworfen")
+            return False
+        if not self._threads:
+            self.start()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+            return True
+        except queue.Full:
+            # Kein Log je Ablehnung (das würde bei Last selbst zum Engpass): Zähler steht in stats()
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Arbeitet bereits eingereihte Aufträge (bis timeout) ab und beendet die Worker."""
+        with self._lock:
+            self._stopped = True
+            threads = list(self._threads)
+            self._threads.clear()
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "depth": self._queue.qsize(),
+            "capacity": self.capacity,
+            "workers": self.workers,
+            "busy": self._busy,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            fn, args, kwargs = item
+            with self._lock:
+                self._busy += 1
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.processed += 1
+            except Exception as exc:
+                with self._lock:
+                    self.failed += 1
+                print(f"[{self.name}] Auftrag {getattr(fn, '__name__', fn)} fehlgeschlagen: {exc}")
+            finally:
+                with self._lock:
+                    self._busy -= 1